@@ -2,11 +2,12 @@ import sys
 import os
 import io
 import json
-import torch
-import whisper
-import librosa
-import soundfile as sf
-import noisereduce as nr
+import time
+import argparse
+import subprocess
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
 from dotenv import load_dotenv
 
 # === Thiết lập mã hóa UTF-8 cho đầu ra console (Windows)
@@ -15,6 +16,15 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 # === Thư mục gốc dự án ===
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+# === Shared modules (result cache...) nằm ở command-ingress/shared/pythonScript
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "..", "..", "shared", "pythonScript"))
+from result_cache import get_cache
+from cli_output import ResultWriter
+from lang_detect import normalize_lang
+from stt_backends import make_backend, BACKENDS, DEFAULT_BACKEND
+from stt_sizing import plan_for_files, load_calibration, usable_cpus
+import metrics
+
 # === Load biến môi trường từ .env ===
 load_dotenv()
 CUSTOM_FFMPEG_PATH = os.getenv("FFMPEG_PATH")
@@ -22,6 +32,20 @@ CUSTOM_MODEL_PATH = os.getenv("WHISPER_MODEL_PATH")
 TOTAL_MEMORY_LARGE = float(os.getenv("TOTAL_MEMORY_LARGE", "12"))
 TOTAL_MEMORY_MEDIUM = float(os.getenv("TOTAL_MEMORY_MEDIUM", "8"))
 TOTAL_MEMORY_SMALL = float(os.getenv("TOTAL_MEMORY_SMALL", "4"))
+# Tiền xử lý theo block: độ dài block và phần chồng lấn (giây), ngưỡng VAD (dB dưới mức to nhất)
+STT_BLOCK_SECONDS = float(os.getenv("STT_BLOCK_SECONDS", "30"))
+STT_BLOCK_OVERLAP_SECONDS = float(os.getenv("STT_BLOCK_OVERLAP_SECONDS", "1"))
+STT_VAD_TOP_DB = float(os.getenv("STT_VAD_TOP_DB", "30"))
+# Transcribe song song: số worker (mỗi worker một model) và độ dài tối thiểu mỗi chunk (giây)
+STT_WORKERS = int(os.getenv("STT_WORKERS", "1"))
+STT_CHUNK_SECONDS = float(os.getenv("STT_CHUNK_SECONDS", "120"))
+# Backend STT: "openai" (openai-whisper) hoặc "faster-whisper" (CTranslate2, int8 trên CPU)
+STT_BACKEND = os.getenv("STT_BACKEND", DEFAULT_BACKEND)
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE") or None
+# Số thread CPU cho model (0 = mặc định của backend); worker của pool tự đặt theo số worker
+STT_THREADS = 0
+# Trên CPU: tự chọn model / thread / worker theo tài nguyên máy và hàng đợi (xem stt_sizing.py)
+STT_AUTO_SIZE = os.getenv("STT_AUTO_SIZE", "0").lower() in ("1", "true", "on", "yes")
 
 # === Cấu hình đường dẫn FFMPEG ===
 if CUSTOM_FFMPEG_PATH:
@@ -31,12 +55,26 @@ else:
     os.environ["PATH"] += os.pathsep + default_ffmpeg
 
 # === Chọn thiết bị xử lý ===
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"[DEVICE] whisper_device={device}", file=sys.stderr)
+# torch/numpy/noisereduce chỉ được import khi cần: cache hit không phải nạp chúng
+# (đặt STT_DEVICE=cpu|cuda để khoá cache không cần import torch để dò GPU)
+STT_DEVICE = os.getenv("STT_DEVICE")
+_device = None
+
+def get_device():
+    global _device
+    if _device is None:
+        if STT_DEVICE:
+            _device = STT_DEVICE
+        else:
+            import torch
+            _device = "cuda" if torch.cuda.is_available() else "cpu"
+        print(f"[DEVICE] whisper_device={_device}", file=sys.stderr)
+    return _device
 
-# === Tự động chọn mô hình Whisper phù hợp theo GPU ===
+# === Tự động chọn mô hình Whisper phù hợp theo GPU (CPU: small, hoặc theo auto_size)
 def choose_model_name():
-    if device == "cuda":
+    if get_device() == "cuda":
+        import torch
         total_mem = torch.cuda.get_device_properties(0).total_memory / (1024 ** 3)
         if total_mem >= TOTAL_MEMORY_LARGE:
             return "large"
@@ -48,49 +86,342 @@ def choose_model_name():
             return "tiny"
     return "small"
 
-MODEL_NAME = choose_model_name()
+_model_name = None
+# Cấu hình auto_size đã áp dụng (None nếu không dùng)
+SIZING = None
+
+def get_model_name():
+    global _model_name
+    if _model_name is None:
+        _model_name = choose_model_name()
+    return _model_name
+
+def auto_size(paths=None, target_rtf=None):
+    """
+    Chọn model, số thread và số worker cho hàng đợi `paths` từ tài nguyên máy
+    và file calibration (stt_sizing.py), áp dụng cho các lần transcribe sau.
+    Chỉ dùng trên CPU; trên GPU giữ cách chọn theo bộ nhớ CUDA.
+    """
+    global SIZING, _model_name, STT_THREADS, STT_WORKERS, model, MODEL_LOAD_MS
+    if get_device() != "cpu":
+        print("[SIZING] skipped: auto-size only applies to CPU", file=sys.stderr)
+        return None
+    try:
+        sizing = plan_for_files(
+            paths or [], target_rtf=target_rtf, backend=STT_BACKEND, compute_type=STT_COMPUTE_TYPE,
+            chunk_seconds=STT_CHUNK_SECONDS, calibration=load_calibration(STT_BACKEND, STT_COMPUTE_TYPE),
+        )
+    except RuntimeError as e:
+        # vd. không model nào vừa RAM còn trống: giữ cách chọn mặc định (choose_model_name)
+        print(f"[SIZING] skipped: {e}", file=sys.stderr)
+        return None
+    SIZING = sizing
+    if SIZING["model"] != _model_name or SIZING["threads"] != STT_THREADS:
+        model, MODEL_LOAD_MS = None, None
+    _model_name = SIZING["model"]
+    STT_WORKERS = SIZING["workers"]
+    # Tuần tự: model dùng mọi CPU được phép; song song: mỗi worker tự chia (get_pool)
+    STT_THREADS = SIZING["threads"] if SIZING["workers"] == 1 else 0
+    print(f"[SIZING] model={SIZING['model']} workers={SIZING['workers']} threads={SIZING['threads']} "
+          f"estimated_rtf={SIZING['estimated_rtf']} target={SIZING['target_rtf']} "
+          f"({SIZING['source']}, {SIZING['reason']})", file=sys.stderr)
+    return SIZING
+
 DOWNLOAD_ROOT = CUSTOM_MODEL_PATH or os.path.join(BASE_DIR, '..', 'libraries', 'models_whisper')
 SUPPORTED_FORMATS = ['.mp3', '.m4a', '.webm', '.wav', '.flac', '.aac', '.ogg']
 
-print(f"Đang tải mô hình Whisper: {MODEL_NAME}", file=sys.stderr)
-model = whisper.load_model(MODEL_NAME, device=device, download_root=DOWNLOAD_ROOT)
-
-# === Mapping ngôn ngữ về dạng chuẩn locale ===
-LANGUAGE_MAP = {
-    "vi": "vi-VN",
-    "en": "en-US",
-    "fr": "fr-FR",
-    "de": "de-DE",
-    "es": "es-ES",
-    "ja": "ja-JP",
-    "ko": "ko-KR",
-    "zh": "zh-CN"
-}
-
-# === Hàm tiền xử lý âm thanh (chuẩn hóa) ===
-def preprocess_audio(input_path):
-    y, sr = librosa.load(input_path, sr=16000, mono=True)
-
-    # Giảm noise
-    y = nr.reduce_noise(y=y, sr=sr)
-
-    # Chuẩn hóa volume
-    y = librosa.util.normalize(y)
-
-    # Voice Activity Detection (cắt im lặng)
-    intervals = librosa.effects.split(y, top_db=30)
-    processed_audio = []
-    for start, end in intervals:
-        processed_audio.extend(y[start:end])
-    y = torch.tensor(processed_audio, dtype=torch.float32).numpy()
-
-    # Xuất file tạm sau khi xử lý
-    output_path = os.path.splitext(input_path)[0] + "_clean.wav"
-    sf.write(output_path, y, 16000)
-    return output_path
+# Tăng khi logic STT thay đổi để cache không trả kết quả cũ
+EXTRACTOR_VERSION = "2"
+
+# === Model Whisper chỉ nạp khi thật sự cần (cache hit không tốn thời gian nạp model)
+model = None
+MODEL_LOAD_MS = None
+
+def get_model():
+    """Backend STT đã nạp model (xem stt_backends.py)."""
+    global model, MODEL_LOAD_MS
+    if model is None:
+        print(f"Đang tải mô hình Whisper: {get_model_name()}", file=sys.stderr)
+        with metrics.span("model_load", model=get_model_name(), backend=STT_BACKEND):
+            model = make_backend(
+                STT_BACKEND, get_model_name(), get_device(), DOWNLOAD_ROOT,
+                threads=STT_THREADS, compute_type=STT_COMPUTE_TYPE,
+            ).load()
+        MODEL_LOAD_MS = model.load_ms
+    return model
+
+def select_backend(name, compute_type=None):
+    """Đổi backend (vd. từ --backend); model cũ bị bỏ để nạp lại khi cần."""
+    global STT_BACKEND, STT_COMPUTE_TYPE, model, MODEL_LOAD_MS
+    if name not in BACKENDS:
+        raise ValueError(f"Backend STT không hỗ trợ: {name}")
+    if name != STT_BACKEND or (compute_type or None) != STT_COMPUTE_TYPE:
+        STT_BACKEND, STT_COMPUTE_TYPE = name, compute_type or None
+        model, MODEL_LOAD_MS = None, None
+
+# === Tiền xử lý âm thanh theo block (bộ nhớ không tăng theo độ dài file)
+SAMPLE_RATE = 16000
+# Khung RMS giống librosa.effects.split (frame 2048, hop 512, center=True)
+VAD_FRAME = 2048
+VAD_HOP = 512
+
+def decode_audio_blocks(input_path, block_samples):
+    """
+    Giải mã qua ffmpeg (mono, 16 kHz, float32) và trả về từng block
+    `block_samples` mẫu, không nạp cả file vào bộ nhớ.
+    """
+    import numpy as np
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", input_path,
+        "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-",
+    ]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    block_bytes = block_samples * 4
+    try:
+        while True:
+            with metrics.span("decode"):
+                data = proc.stdout.read(block_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % 4
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.float32)
+        err = proc.stderr.read().decode("utf-8", errors="replace")
+        if proc.wait() != 0:
+            raise RuntimeError(f"Không giải mã được audio: {err.strip()}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+def denoise_blocks(blocks, overlap_samples):
+    """
+    Giảm noise từng block kèm `overlap_samples` ngữ cảnh hai bên (lấy từ block
+    trước/sau) rồi cắt lại đúng phần lõi, tránh vết nối giữa các block.
+    """
+    import numpy as np
+    import noisereduce as nr
+    prev_tail = np.zeros(0, dtype=np.float32)
+    current = next(blocks, None)
+    while current is not None:
+        following = next(blocks, None)
+        head = following[:overlap_samples] if following is not None else np.zeros(0, dtype=np.float32)
+        window = np.concatenate((prev_tail, current, head))
+        with metrics.span("denoise"):
+            cleaned = nr.reduce_noise(y=window, sr=SAMPLE_RATE).astype(np.float32, copy=False)
+        yield cleaned[len(prev_tail):len(prev_tail) + len(current)]
+        prev_tail = current[-overlap_samples:] if overlap_samples else np.zeros(0, dtype=np.float32)
+        current = following
+
+def _hop_energy(block):
+    # Tổng bình phương theo từng đoạn hop (đoạn cuối có thể ngắn hơn)
+    import numpy as np
+    full = len(block) // VAD_HOP * VAD_HOP
+    squared = np.square(block, dtype=np.float64)
+    energy = squared[:full].reshape(-1, VAD_HOP).sum(axis=1)
+    if full < len(block):
+        energy = np.append(energy, squared[full:].sum())
+    return energy
+
+def voiced_hop_mask(hop_energy, n_samples, top_db):
+    """
+    Mặt nạ "có tiếng" cho từng đoạn hop, tương đương librosa.effects.split:
+    frame i (tâm i*hop, dài 2048 = 4 hop) giữ mẫu [i*hop, (i+1)*hop) khi
+    năng lượng trung bình của nó không thấp hơn frame to nhất quá top_db.
+    """
+    import numpy as np
+    n_frames = 1 + n_samples // VAD_HOP
+    padded = np.zeros(n_frames + 3, dtype=np.float64)
+    padded[2:2 + len(hop_energy)] = hop_energy[:n_frames + 1]
+    # Frame i phủ các đoạn hop i-2 .. i+1 (zero-pad hai đầu như center=True)
+    power = (padded[:-3] + padded[1:-2] + padded[2:-1] + padded[3:]) / VAD_FRAME
+    db = 10.0 * np.log10(np.maximum(power, 1e-10))
+    ref_db = 10.0 * np.log10(max(power.max(), 1e-10))
+    return db > ref_db - top_db
+
+def preprocess_audio(input_path, block_seconds=None, overlap_seconds=None, top_db=None, info=None):
+    """
+    Giảm noise, chuẩn hóa biên độ và cắt im lặng, trả về mảng float32 16 kHz
+    đưa thẳng vào Whisper (không ghi file _clean.wav).
+
+    Audio được đọc và giảm noise theo block; mỗi block chỉ giữ lại bản đã giảm
+    noise và năng lượng từng đoạn hop. Ngưỡng VAD và hệ số chuẩn hóa phụ thuộc
+    mức to nhất của cả file nên được áp dụng sau khi đọc hết.
+
+    Nếu truyền dict `info`: điền duration_s (audio gốc), voiced_s và
+    boundaries - vị trí mẫu trong mảng trả về nơi một đoạn im lặng đã bị cắt.
+    """
+    import numpy as np
+    block_seconds = block_seconds or STT_BLOCK_SECONDS
+    overlap_seconds = STT_BLOCK_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+    top_db = top_db or STT_VAD_TOP_DB
+
+    # Block là bội số của hop để mỗi đoạn hop nằm trọn trong một block
+    block_samples = max(1, int(block_seconds * SAMPLE_RATE) // VAD_HOP) * VAD_HOP
+    overlap_samples = int(overlap_seconds * SAMPLE_RATE)
+
+    blocks, energies = [], []
+    peak = 0.0
+    for block in denoise_blocks(decode_audio_blocks(input_path, block_samples), overlap_samples):
+        blocks.append(block)
+        energies.append(_hop_energy(block))
+        if len(block):
+            peak = max(peak, float(np.abs(block).max()))
+
+    n_samples = sum(len(b) for b in blocks)
+    if n_samples == 0:
+        if info is not None:
+            info.update({"duration_s": 0.0, "voiced_s": 0.0, "boundaries": []})
+        return np.zeros(0, dtype=np.float32)
+
+    with metrics.span("vad"):
+        hop_energy = np.concatenate(energies)
+        keep = voiced_hop_mask(hop_energy, n_samples, top_db)[:len(hop_energy)]
+
+    # Ghép các đoạn có tiếng vào một mảng đúng kích thước, giải phóng dần từng block
+    hop_len = np.full(len(hop_energy), VAD_HOP, dtype=np.int64)
+    hop_len[-1] = n_samples - (len(hop_energy) - 1) * VAD_HOP
+    kept_end = np.cumsum(np.where(keep, hop_len, 0))
+    out = np.empty(int(kept_end[-1]), dtype=np.float32)
+
+    if info is not None:
+        # Cuối mỗi đoạn có tiếng (trước một đoạn im lặng), theo toạ độ của mảng sau khi cắt
+        run_ends = np.flatnonzero(keep[:-1] & ~keep[1:])
+        info.update({
+            "duration_s": round(n_samples / SAMPLE_RATE, 2),
+            "voiced_s": round(len(out) / SAMPLE_RATE, 2),
+            "boundaries": [int(b) for b in kept_end[run_ends]],
+        })
+    written, hop_index = 0, 0
+    blocks.reverse()
+    while blocks:
+        block = blocks.pop()
+        n_hops = -(-len(block) // VAD_HOP)
+        block_keep = keep[hop_index:hop_index + n_hops]
+        if block_keep.all():
+            out[written:written + len(block)] = block
+            written += len(block)
+        elif block_keep.any():
+            sample_keep = np.repeat(block_keep, VAD_HOP)[:len(block)]
+            voiced = block[sample_keep]
+            out[written:written + len(voiced)] = voiced
+            written += len(voiced)
+        hop_index += n_hops
+        del block
+
+    # Chuẩn hóa volume theo đỉnh của toàn file (như librosa.util.normalize)
+    if peak > 0:
+        out *= 1.0 / peak
+    return out
+
+# === Transcribe song song theo chunk (cắt tại ranh giới im lặng của VAD)
+_pool = None
+_pool_key = None
+
+def _init_stt_worker(threads, backend, compute_type, model_name):
+    # Mỗi worker một phần CPU và một model riêng, nạp ngay khi khởi động
+    global STT_THREADS, _model_name
+    STT_THREADS = threads
+    _model_name = model_name
+    select_backend(backend, compute_type)
+    get_model()
+
+def _transcribe_chunk(audio, metrics_flags=(False, False)):
+    """(kết quả, metrics của chunk); worker spawn không thấy cấu hình metrics của process cha."""
+    enabled, trace = metrics_flags
+    with metrics.recording(enabled=enabled, trace=trace) as recorder:
+        with metrics.span("transcribe_chunk", samples=len(audio)):
+            part = get_model().transcribe(audio)
+    return part, recorder.to_dict(events=True)
+
+def get_pool(workers):
+    """Pool dùng lại giữa các file để không nạp lại model cho mỗi file."""
+    global _pool, _pool_key
+    key = (workers, STT_BACKEND, STT_COMPUTE_TYPE, get_model_name())
+    if _pool is not None and _pool_key != key:
+        shutdown_pool()
+    if _pool is None:
+        # Theo affinity / quota cgroup, không phải số CPU vật lý của node
+        threads = max(1, usable_cpus() // workers)
+        # spawn: không fork process đã khởi tạo torch/CUDA
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp.get_context("spawn"),
+            initializer=_init_stt_worker,
+            initargs=(threads, STT_BACKEND, STT_COMPUTE_TYPE, get_model_name()),
+        )
+        _pool_key = key
+    return _pool
+
+def shutdown_pool():
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool, _pool_key = None, None
+
+def plan_chunks(n_samples, boundaries, chunk_samples):
+    """
+    [(start, end)] theo mẫu: mỗi chunk kết thúc ở ranh giới im lặng đầu tiên sau
+    khi đủ chunk_samples; chunk cuối quá ngắn (< 1/4) được gộp vào chunk trước.
+    """
+    chunks, start = [], 0
+    for boundary in boundaries:
+        if boundary - start >= chunk_samples:
+            chunks.append((start, boundary))
+            start = boundary
+    if start < n_samples:
+        if chunks and n_samples - start < chunk_samples // 4:
+            chunks[-1] = (chunks[-1][0], n_samples)
+        else:
+            chunks.append((start, n_samples))
+    return chunks
+
+def format_segment(seg):
+    """Segment Whisper -> {"start", "end", "text", "confidence"} của kết quả."""
+    return {
+        "start": round(seg["start"], 2),
+        "end": round(seg["end"], 2),
+        "text": seg["text"].strip(),
+        "confidence": round((1 + seg.get("avg_logprob", -1)) / 2, 3),  # scale [-1,0] -> [0,1]
+    }
+
+def transcribe_chunks(audio, boundaries, workers, chunk_seconds, on_segment=None):
+    """
+    Transcribe các chunk trên process pool rồi ghép lại: timestamp segment được
+    cộng offset của chunk (cùng trục thời gian với transcribe một lần), ngôn
+    ngữ là ngôn ngữ chiếm nhiều audio nhất. Trả về (result, số chunk).
+    on_segment(index, segment) được gọi ngay khi chunk chứa segment xong (theo
+    thứ tự chunk), dùng cho --stream-partial.
+    """
+    chunks = plan_chunks(len(audio), boundaries, int(chunk_seconds * SAMPLE_RATE))
+    pool = get_pool(workers)
+    recorder = metrics.current()
+    metrics_flags = (recorder.enabled, recorder.trace)
+    futures = [pool.submit(_transcribe_chunk, audio[start:end], metrics_flags) for start, end in chunks]
+
+    texts, segments = [], []
+    language_samples = Counter()
+    for (start, end), future in zip(chunks, futures):
+        part, chunk_metrics = future.result()
+        recorder.merge(chunk_metrics)
+        offset = start / SAMPLE_RATE
+        for seg in part["segments"]:
+            seg["start"] += offset
+            seg["end"] += offset
+            if on_segment:
+                on_segment(len(segments), format_segment(seg))
+            segments.append(seg)
+        texts.append(part["text"].strip())
+        language_samples[part["language"]] += end - start
+
+    language = language_samples.most_common(1)[0][0] if language_samples else "unknown"
+    return {"language": language, "text": " ".join(t for t in texts if t), "segments": segments}, len(chunks)
 
 # === Hàm chuyển âm thanh thành văn bản và tách segment
-def transcribe(audio_path):
+def transcribe(audio_path, timing=None, workers=None, chunk_seconds=None, on_segment=None):
     if not os.path.isfile(audio_path):
         raise FileNotFoundError(f"Không tìm thấy file: {audio_path}")
 
@@ -98,25 +429,45 @@ def transcribe(audio_path):
     if ext not in SUPPORTED_FORMATS:
         raise ValueError(f"Định dạng không hỗ trợ: {ext}")
 
+    workers = workers or STT_WORKERS
+    chunk_seconds = chunk_seconds or STT_CHUNK_SECONDS
+
     # Bước (1) Chuẩn hóa trước khi đưa vào Whisper
-    clean_path = preprocess_audio(audio_path)
+    started = time.perf_counter()
+    info = {}
+    audio = preprocess_audio(audio_path, info=info)
+    preprocessed = time.perf_counter()
 
-    result = model.transcribe(clean_path, fp16=(device == "cuda"))
+    if workers > 1:
+        with metrics.span("transcribe", workers=workers):
+            result, n_chunks = transcribe_chunks(audio, info["boundaries"], workers, chunk_seconds, on_segment)
+    else:
+        model = get_model()
+        with metrics.span("transcribe"):
+            result, n_chunks = model.transcribe(audio), 1
+        # Tuần tự: cả file là một chunk, segment có sau khi model chạy xong
+        if on_segment:
+            for index, seg in enumerate(result.get("segments", [])):
+                on_segment(index, format_segment(seg))
 
-    # Chuẩn hóa ngôn ngữ
+    # Ghi lại thời gian từng bước và throughput nếu caller yêu cầu
+    if timing is not None:
+        finished = time.perf_counter()
+        timing["preprocess_ms"] = round((preprocessed - started) * 1000, 1)
+        timing["transcribe_ms"] = round((finished - preprocessed) * 1000, 1)
+        timing["audio_s"] = info["duration_s"]
+        timing["voiced_s"] = info["voiced_s"]
+        timing["workers"] = workers
+        timing["chunks"] = n_chunks
+        # Số giây audio xử lý được trong một giây thực
+        timing["audio_s_per_wall_s"] = round(info["duration_s"] / max(finished - started, 1e-6), 2)
+
+    # Chuẩn hóa ngôn ngữ (Whisper tự nhận diện, chỉ map sang locale)
     lang = result.get("language", "unknown")
-    normalized_lang = LANGUAGE_MAP.get(lang, lang)
+    normalized_lang = normalize_lang(lang, lang)
 
     # Tách segments kèm confidence
-    segments = []
-    for seg in result.get("segments", []):
-        confidence = round((1 + seg.get("avg_logprob", -1)) / 2, 3)  # scale [-1,0] -> [0,1]
-        segments.append({
-            "start": round(seg["start"], 2),
-            "end": round(seg["end"], 2),
-            "text": seg["text"].strip(),
-            "confidence": confidence
-        })
+    segments = [format_segment(seg) for seg in result.get("segments", [])]
 
     # Confidence toàn transcript = trung bình confidence segments
     overall_conf = None
@@ -130,22 +481,206 @@ def transcribe(audio_path):
         "segments": segments
     }
 
+# === Transcribe qua cache nội dung file (key gồm backend + model + device)
+def transcribe_with_cache(audio_path, timing=None, workers=None, chunk_seconds=None, on_segment=None):
+    """on_segment: xem transcribe_chunks; cache hit thì không được gọi."""
+    workers = workers or STT_WORKERS
+    chunk_seconds = chunk_seconds or STT_CHUNK_SECONDS
+    config = {
+        "version": EXTRACTOR_VERSION,
+        "backend": STT_BACKEND,
+        "compute_type": STT_COMPUTE_TYPE,
+        "model": get_model_name(),
+        "device": get_device(),
+        "block_s": STT_BLOCK_SECONDS,
+        "vad_top_db": STT_VAD_TOP_DB,
+        # Chia chunk làm ngữ cảnh Whisper khác đi nên kết quả khác chế độ tuần tự
+        "chunk_s": chunk_seconds if workers > 1 else None,
+    }
+    result, _ = get_cache().get_or_compute(
+        "audio", audio_path, config,
+        lambda: transcribe(audio_path, timing=timing, workers=workers, chunk_seconds=chunk_seconds,
+                           on_segment=on_segment)
+    )
+    return result
+
+# === Chế độ worker thường trú (--serve)
+# Giao thức: mỗi dòng stdin là một JSON job, mỗi dòng stdout là một JSON kết quả.
+#   {"id": "1", "file": "/path/a.wav"}          -> transcribe một file
+#   {"id": "2", "cmd": "stats"}                  -> thông tin worker
+#   {"id": "3", "cmd": "shutdown"}               -> dừng worker
+def write_message(message):
+    sys.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+def handle_job(job, stats):
+    cmd = job.get("cmd", "transcribe")
+    reply = {"id": job.get("id")}
+
+    if cmd == "stats":
+        reply.update({
+            "ok": True,
+            "backend": STT_BACKEND,
+            "model": get_model_name(),
+            "device": get_device(),
+            "model_load_ms": MODEL_LOAD_MS,
+            "workers": STT_WORKERS,
+            "sizing": SIZING,
+            "jobs_served": stats["jobs_served"],
+            "jobs_failed": stats["jobs_failed"],
+            "uptime_s": round(time.perf_counter() - stats["started"], 1),
+        })
+        return reply
+
+    if cmd != "transcribe":
+        reply.update({"ok": False, "error": f"Lệnh không hỗ trợ: {cmd}"})
+        return reply
+
+    path = job.get("file")
+    reply["file"] = path
+    timing = {}
+    started = time.perf_counter()
+    with metrics.recording() as recorder:
+        try:
+            if not path:
+                raise ValueError("Thiếu trường 'file'")
+            reply.update(transcribe_with_cache(path, timing=timing))
+            reply["ok"] = True
+            stats["jobs_served"] += 1
+        except Exception as e:
+            reply["ok"] = False
+            reply["error"] = str(e)
+            stats["jobs_failed"] += 1
+    timing["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    reply["timing"] = timing
+    if metrics.METRICS_ENABLED:
+        reply["metrics"] = recorder.to_dict()
+    return reply
+
+def serve():
+    stats = {"jobs_served": 0, "jobs_failed": 0, "started": time.perf_counter()}
+    # worker thường trú: nạp model ngay từ đầu (chế độ song song: model nằm trong pool)
+    if STT_WORKERS > 1:
+        get_pool(STT_WORKERS)
+    else:
+        get_model()
+    write_message({
+        "event": "ready",
+        "backend": STT_BACKEND,
+        "model": get_model_name(),
+        "device": get_device(),
+        "model_load_ms": MODEL_LOAD_MS,
+        "workers": STT_WORKERS,
+        "sizing": SIZING,
+        "pid": os.getpid(),
+    })
+
+    stdin = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            write_message({"id": None, "ok": False, "error": f"JSON không hợp lệ: {e}"})
+            continue
+        if not isinstance(job, dict):
+            write_message({"id": None, "ok": False, "error": f"Job phải là JSON object, nhận {type(job).__name__}"})
+            continue
+
+        if job.get("cmd") == "shutdown":
+            write_message({"id": job.get("id"), "ok": True, "event": "shutdown"})
+            break
+
+        write_message(handle_job(job, stats))
+
+    shutdown_pool()
+    metrics.write_trace()
+
 # === Chạy như CLI
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Cách dùng: python process_STT.py <file1> <file2>", file=sys.stderr)
+    parser = argparse.ArgumentParser(description="Speech-to-text (Whisper) cho file âm thanh")
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--serve", action="store_true", help="Worker thường trú, nhận job NDJSON qua stdin/stdout")
+    parser.add_argument("--stream", action="store_true",
+                        help="In mỗi file một dòng JSON ngay khi xong (NDJSON) thay vì một mảng cuối cùng")
+    parser.add_argument("--stream-partial", action="store_true",
+                        help="Cùng --stream: in thêm dòng {\"event\": \"segment\", ...} cho từng segment "
+                             "ngay khi chunk chứa nó xong (--workers > 1)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=STT_BACKEND,
+                        help="Backend STT (mặc định STT_BACKEND)")
+    parser.add_argument("--compute-type", default=STT_COMPUTE_TYPE,
+                        help="Kiểu tính của faster-whisper: int8, int8_float16, float16, float32...")
+    parser.add_argument("--workers", type=int, default=STT_WORKERS,
+                        help="Số process transcribe song song theo chunk (mặc định STT_WORKERS)")
+    parser.add_argument("--chunk-seconds", type=float, default=STT_CHUNK_SECONDS,
+                        help="Độ dài tối thiểu mỗi chunk khi chạy song song (mặc định STT_CHUNK_SECONDS)")
+    parser.add_argument("--auto-size", action="store_true", default=STT_AUTO_SIZE,
+                        help="CPU: chọn model/thread/worker theo tài nguyên máy và độ dài hàng đợi (mặc định STT_AUTO_SIZE)")
+    parser.add_argument("--target-rtf", type=float, default=None,
+                        help="Giây xử lý cho mỗi giây audio mà --auto-size nhắm tới (mặc định STT_TARGET_RTF)")
+    parser.add_argument("--metrics", action="store_true", default=None,
+                        help="Gắn thời gian/bộ nhớ từng bước vào metrics của mỗi file (mặc định EXTRACTION_METRICS)")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="Ghi các span ra file Chrome trace (mặc định EXTRACTION_TRACE)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.trace)
+    select_backend(args.backend, args.compute_type)
+    if args.auto_size and auto_size(args.files, args.target_rtf):
+        # Ghi đè --workers / STT_WORKERS bằng số worker đã chọn
+        args.workers = STT_WORKERS
+
+    if args.serve:
+        serve()
+        sys.exit(0)
+
+    if not args.files:
+        print("Cách dùng: python process_STT.py <file1> <file2> [--stream [--stream-partial]]", file=sys.stderr)
+        print("           python process_STT.py --serve   (worker NDJSON qua stdin/stdout)", file=sys.stderr)
         sys.exit(1)
 
-    results = []
+    writer = ResultWriter(stream=args.stream, partial=args.stream_partial, indent=2)
+    total_audio_s, total_wall_s = 0.0, 0.0
 
-    for path in sys.argv[1:]:
+    for path in args.files:
         entry = {"file": os.path.basename(path)}
+        timing = {}
+        emitted = []
+
+        def emit_segment(index, seg, name=entry["file"]):
+            emitted.append(index)
+            writer.event("segment", {"file": name, "index": index, **seg})
+
         try:
-            output = transcribe(path)
+            with metrics.recording() as recorder:
+                output = transcribe_with_cache(path, timing=timing, workers=args.workers,
+                                               chunk_seconds=args.chunk_seconds,
+                                               on_segment=emit_segment if writer.partial else None)
+            if metrics.METRICS_ENABLED:
+                entry["metrics"] = recorder.to_dict()
+            if timing:
+                # Báo cáo throughput (không có khi cache hit)
+                wall_s = (timing["preprocess_ms"] + timing["transcribe_ms"]) / 1000
+                total_audio_s += timing["audio_s"]
+                total_wall_s += wall_s
+                print(f"[THROUGHPUT] {entry['file']}: {timing['audio_s']}s audio "
+                      f"({timing['voiced_s']}s voiced) in {wall_s:.1f}s = "
+                      f"{timing['audio_s_per_wall_s']} audio s/wall s, "
+                      f"workers={timing['workers']} chunks={timing['chunks']}", file=sys.stderr)
+            if not emitted:
+                # Cache hit: segment lấy từ kết quả đã lưu
+                for index, seg in enumerate(output.get("segments", [])):
+                    writer.event("segment", {"file": entry["file"], "index": index, **seg})
             entry.update(output)
         except Exception as e:
             entry["error"] = str(e)
 
-        results.append(entry)
+        writer.write(entry)
 
-    print(json.dumps(results, ensure_ascii=False, indent=2))
+    writer.close()
+    shutdown_pool()
+    metrics.write_trace()
+    if total_wall_s > 0:
+        print(f"[THROUGHPUT] total: {total_audio_s:.1f}s audio in {total_wall_s:.1f}s = "
+              f"{total_audio_s / total_wall_s:.2f} audio s/wall s (workers={args.workers})", file=sys.stderr)
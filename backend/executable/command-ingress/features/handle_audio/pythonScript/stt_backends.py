@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Backend STT cho process_STT.py.
+
+Mỗi backend nhận mảng float32 mono 16 kHz và trả về cùng một dạng:
+    {"language": "vi", "text": "...",
+     "segments": [{"start", "end", "text", "avg_logprob"}]}
+process_STT.py tự chuẩn hóa ngôn ngữ và tính confidence từ avg_logprob.
+
+- openai:          openai-whisper (PyTorch), fp16 trên CUDA, fp32 trên CPU
+- faster-whisper:  CTranslate2, mặc định int8 trên CPU / float16 trên CUDA
+
+Chọn bằng STT_BACKEND (hoặc --backend), kiểu tính của faster-whisper bằng
+STT_COMPUTE_TYPE.
+"""
+
+import os
+import sys
+import time
+
+DEFAULT_BACKEND = "openai"
+
+
+class OpenAIWhisperBackend:
+    name = "openai"
+
+    def __init__(self, model_name, device, download_root, threads=0, compute_type=None):
+        self.model_name = model_name
+        self.device = device
+        self.download_root = download_root
+        self.threads = threads
+        # openai-whisper chỉ có fp16 (CUDA) hoặc fp32
+        self.compute_type = "float16" if device == "cuda" else "float32"
+        self.model = None
+        self.load_ms = None
+
+    def load(self):
+        if self.model is None:
+            import torch
+            import whisper
+
+            if self.threads:
+                torch.set_num_threads(self.threads)
+            started = time.perf_counter()
+            self.model = whisper.load_model(self.model_name, device=self.device, download_root=self.download_root)
+            self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self
+
+    def transcribe(self, audio) -> dict:
+        self.load()
+        result = self.model.transcribe(audio, fp16=(self.device == "cuda"))
+        return {
+            "language": result.get("language", "unknown"),
+            "text": result["text"],
+            "segments": [
+                {
+                    "start": seg["start"],
+                    "end": seg["end"],
+                    "text": seg["text"],
+                    "avg_logprob": seg.get("avg_logprob", -1),
+                }
+                for seg in result.get("segments", [])
+            ],
+        }
+
+
+class FasterWhisperBackend:
+    name = "faster-whisper"
+
+    def __init__(self, model_name, device, download_root, threads=0, compute_type=None):
+        self.model_name = model_name
+        self.device = device
+        # Model CTranslate2 khác định dạng với checkpoint của openai-whisper
+        self.download_root = os.path.join(download_root, "faster-whisper")
+        self.threads = threads
+        self.compute_type = compute_type or ("float16" if device == "cuda" else "int8")
+        self.model = None
+        self.load_ms = None
+
+    def load(self):
+        if self.model is None:
+            try:
+                from faster_whisper import WhisperModel
+            except ImportError as e:
+                raise ImportError("Backend 'faster-whisper' cần cài gói faster-whisper (pip install faster-whisper)") from e
+
+            started = time.perf_counter()
+            self.model = WhisperModel(
+                self.model_name,
+                device=self.device,
+                compute_type=self.compute_type,
+                cpu_threads=self.threads,
+                download_root=self.download_root,
+            )
+            self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self
+
+    def transcribe(self, audio) -> dict:
+        self.load()
+        # beam_size=1: giải mã greedy như model.transcribe của openai-whisper
+        segments, info = self.model.transcribe(audio, beam_size=1)
+        segments = [
+            {"start": seg.start, "end": seg.end, "text": seg.text, "avg_logprob": seg.avg_logprob}
+            for seg in segments  # generator: giải mã thật sự diễn ra ở đây
+        ]
+        return {
+            "language": info.language,
+            "text": "".join(seg["text"] for seg in segments),
+            "segments": segments,
+        }
+
+
+BACKENDS = {
+    OpenAIWhisperBackend.name: OpenAIWhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def make_backend(name, model_name, device, download_root, threads=0, compute_type=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Backend STT không hỗ trợ: {name} (chọn một trong {', '.join(BACKENDS)})")
+    print(f"[STT] backend={name} model={model_name} device={device}", file=sys.stderr)
+    return BACKENDS[name](model_name, device, download_root, threads=threads, compute_type=compute_type)
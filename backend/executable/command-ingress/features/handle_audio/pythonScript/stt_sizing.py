@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tự chọn model Whisper, số thread và số worker cho process_STT.py trên máy
+chỉ có CPU (STT_AUTO_SIZE=1 hoặc --auto-size).
+
+- Tài nguyên đo trên máy: số CPU được phép dùng (affinity + quota cgroup) và
+  RAM còn trống (MemAvailable, giới hạn cgroup; psutil nếu không có /proc).
+- Chi phí mỗi model: real-time factor (giây xử lý / giây audio) với 1 thread
+  và với mọi CPU, thời gian nạp và bộ nhớ một worker. Lấy từ file calibration
+  (chạy `python stt_sizing.py calibrate` một lần trên máy), không có thì dùng
+  bảng ước lượng thô bên dưới.
+- Chọn model lớn nhất mà cấu hình tốt nhất của nó (workers x threads vừa RAM,
+  đủ chunk để chia) đạt STT_TARGET_RTF trên hàng đợi audio hiện tại; thời gian
+  nạp model được chia đều cho tổng độ dài hàng đợi. Không model nào đạt thì
+  lấy cấu hình nhanh nhất.
+
+CLI:
+    python stt_sizing.py calibrate [--models tiny,base,small] [--clip a.wav] [--seconds 60]
+    python stt_sizing.py show
+    python stt_sizing.py plan a.wav b.mp3 [--target-rtf 0.5]
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "..", "..", "shared", "pythonScript"))
+
+import metrics
+
+# backend/: cùng thư mục .cache với result_cache.py, audio mẫu trong uploads_Audio
+BACKEND_DIR = os.path.abspath(os.path.join(BASE_DIR, "..", "..", "..", "..", ".."))
+DEFAULT_CALIBRATION_FILE = os.path.join(BACKEND_DIR, ".cache", "stt_calibration.json")
+SAMPLE_AUDIO_DIR = os.path.join(BACKEND_DIR, "uploads_Audio")
+CALIBRATION_FILE = os.getenv("STT_CALIBRATION_FILE") or DEFAULT_CALIBRATION_FILE
+# Giây xử lý cho mỗi giây audio mà chế độ tự chọn nhắm tới (0.5 = nhanh gấp đôi thời gian thực)
+STT_TARGET_RTF = float(os.getenv("STT_TARGET_RTF", "0.5"))
+# Các model được phép chọn, từ nhỏ đến lớn
+STT_AUTO_MODELS = [m.strip() for m in os.getenv("STT_AUTO_MODELS", "tiny,base,small,medium,large").split(",") if m.strip()]
+# Phần RAM còn trống được dùng cho các worker (phần còn lại cho audio và hệ thống)
+MEMORY_HEADROOM = 0.8
+# Độ dài hàng đợi giả định khi không biết trước (vd. worker --serve)
+DEFAULT_QUEUE_SECONDS = 600.0
+
+MODEL_SIZES = ("tiny", "base", "small", "medium", "large")
+MB = 1024 * 1024
+
+# Ước lượng khi chưa calibrate: RTF 1 thread, phần song song được theo thread,
+# bộ nhớ một worker (MB). Chỉ để thứ tự và độ lớn hợp lý, calibrate để có số thật.
+_ESTIMATES = {
+    "openai": {
+        "tiny": (0.35, 400), "base": (0.7, 550), "small": (2.2, 1300),
+        "medium": (6.5, 3500), "large": (13.0, 7000),
+    },
+    "faster-whisper": {
+        "tiny": (0.12, 200), "base": (0.25, 300), "small": (0.75, 650),
+        "medium": (2.2, 1500), "large": (4.5, 3200),
+    },
+}
+_ESTIMATE_PARALLEL = 0.75
+_ESTIMATE_LOAD_MS = {"tiny": 500, "base": 800, "small": 2000, "medium": 5000, "large": 10000}
+
+
+# =========================
+# Tài nguyên máy
+# =========================
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_cpu_limit():
+    """Số CPU theo quota cgroup (v2 cpu.max hoặc v1 cfs_quota), None nếu không giới hạn."""
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    quota, period = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"), _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def usable_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    if limit:
+        cpus = min(cpus, max(1, int(limit)))
+    return max(1, cpus)
+
+
+def available_memory_bytes():
+    """RAM còn dùng được (min của MemAvailable và phần còn lại của giới hạn cgroup), None nếu không đo được."""
+    available = None
+    meminfo = _read("/proc/meminfo")
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith("MemAvailable:"):
+                available = int(line.split()[1]) * 1024
+                break
+    else:
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+        except ImportError:
+            pass
+
+    for limit_path, usage_path in (("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+                                   ("/sys/fs/cgroup/memory/memory.limit_in_bytes",
+                                    "/sys/fs/cgroup/memory/memory.usage_in_bytes")):
+        limit, usage = _read(limit_path), _read(usage_path)
+        if limit and usage and limit.isdigit() and usage.isdigit() and int(limit) < 1 << 60:
+            remaining = int(limit) - int(usage)
+            available = remaining if available is None else min(available, remaining)
+            break
+    return available
+
+
+def host_resources() -> dict:
+    available = available_memory_bytes()
+    return {
+        "cpus": usable_cpus(),
+        "available_mb": round(available / MB) if available else None,
+    }
+
+
+def probe_duration(path):
+    """Độ dài audio (giây) qua ffprobe, None nếu không đọc được."""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            capture_output=True, text=True, timeout=30,
+        )
+        return float(out.stdout.strip()) if out.returncode == 0 and out.stdout.strip() else None
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+# =========================
+# Calibration
+# =========================
+def host_key(backend: str, compute_type) -> str:
+    """Kết quả calibrate chỉ dùng lại trên cùng máy, cùng số CPU và cùng backend."""
+    return f"{platform.node()}|{platform.machine()}|cpus={usable_cpus()}|{backend}|{compute_type or 'default'}"
+
+
+def load_calibration(backend: str, compute_type=None, path: str = None):
+    data = _read(path or CALIBRATION_FILE)
+    if not data:
+        return None
+    try:
+        return json.loads(data).get("hosts", {}).get(host_key(backend, compute_type))
+    except ValueError:
+        return None
+
+
+def save_calibration(backend: str, compute_type, entry: dict, path: str = None):
+    path = os.path.abspath(path or CALIBRATION_FILE)
+    data = {}
+    existing = _read(path)
+    if existing:
+        try:
+            data = json.loads(existing)
+        except ValueError:
+            data = {}
+    data.setdefault("hosts", {})[host_key(backend, compute_type)] = entry
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def _measure_model(backend, model_name, download_root, compute_type, threads, audio, sample_rate):
+    """Chạy trong process riêng (spawn): nạp model với `threads` thread, đo RTF và bộ nhớ."""
+    from stt_backends import make_backend
+
+    before = metrics.peak_rss_bytes()
+    stt = make_backend(backend, model_name, "cpu", download_root, threads=threads, compute_type=compute_type).load()
+    # Lượt khởi động ngắn: lần transcribe đầu có chi phí khởi tạo không lặp lại
+    stt.transcribe(audio[:sample_rate * 5])
+    started = time.perf_counter()
+    stt.transcribe(audio)
+    elapsed = time.perf_counter() - started
+    peak = metrics.peak_rss_bytes()
+    return {
+        "load_ms": stt.load_ms,
+        "rtf": elapsed / (len(audio) / sample_rate),
+        "memory_mb": round((peak - before) / MB) if peak and before else None,
+    }
+
+
+def _run_isolated(*args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as executor:
+        return executor.submit(_measure_model, *args).result()
+
+
+def calibrate(models, clip: str, backend: str, compute_type=None, seconds: float = 60.0) -> dict:
+    """Đo từng model với 1 thread và với mọi CPU, mỗi lần đo trong process riêng."""
+    from process_STT import preprocess_audio, DOWNLOAD_ROOT, SAMPLE_RATE
+
+    audio = preprocess_audio(clip)[:int(seconds * SAMPLE_RATE)]
+    if len(audio) < SAMPLE_RATE * 10:
+        raise ValueError(f"Clip calibrate quá ngắn sau khi cắt im lặng ({len(audio) / SAMPLE_RATE:.1f}s, cần >= 10s)")
+
+    cpus = usable_cpus()
+    entry = {
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "clip": os.path.basename(clip),
+        "audio_s": round(len(audio) / SAMPLE_RATE, 1),
+        "cpus": cpus,
+        "models": {},
+    }
+    for model_name in models:
+        print(f"[CALIBRATE] {model_name}: 1 thread ...", file=sys.stderr)
+        single = _run_isolated(backend, model_name, DOWNLOAD_ROOT, compute_type, 1, audio, SAMPLE_RATE)
+        if cpus > 1:
+            print(f"[CALIBRATE] {model_name}: {cpus} threads ...", file=sys.stderr)
+            full = _run_isolated(backend, model_name, DOWNLOAD_ROOT, compute_type, cpus, audio, SAMPLE_RATE)
+        else:
+            full = single
+        entry["models"][model_name] = {
+            "rtf_1": round(single["rtf"], 4),
+            "rtf_all": round(full["rtf"], 4),
+            "load_ms": max(single["load_ms"] or 0, full["load_ms"] or 0),
+            "memory_mb": max(single["memory_mb"] or 0, full["memory_mb"] or 0) or None,
+        }
+        print(f"[CALIBRATE] {model_name}: rtf 1 thread={single['rtf']:.3f}, "
+              f"{cpus} threads={full['rtf']:.3f}", file=sys.stderr)
+    return entry
+
+
+# =========================
+# Chọn cấu hình
+# =========================
+def model_costs(backend: str, compute_type=None, calibration: dict = None) -> dict:
+    """{model: {"rtf_1", "parallel", "load_ms", "memory_mb"}} theo calibration hoặc ước lượng."""
+    costs = {}
+    measured = (calibration or {}).get("models", {})
+    cpus = (calibration or {}).get("cpus") or usable_cpus()
+    estimates = _ESTIMATES.get(backend, _ESTIMATES["openai"])
+    for name in MODEL_SIZES:
+        if name in measured:
+            m = measured[name]
+            # Amdahl: speedup S với N thread -> phần song song p = (1 - 1/S) / (1 - 1/N)
+            parallel = 0.0
+            if cpus > 1 and m["rtf_all"] > 0:
+                speedup = m["rtf_1"] / m["rtf_all"]
+                parallel = min(1.0, max(0.0, (1 - 1 / speedup) / (1 - 1 / cpus)))
+            costs[name] = {"rtf_1": m["rtf_1"], "parallel": parallel, "load_ms": m["load_ms"],
+                           "memory_mb": m["memory_mb"] or estimates[name][1], "source": "calibrated"}
+        elif name in estimates:
+            rtf_1, memory_mb = estimates[name]
+            costs[name] = {"rtf_1": rtf_1, "parallel": _ESTIMATE_PARALLEL, "load_ms": _ESTIMATE_LOAD_MS[name],
+                           "memory_mb": memory_mb, "source": "estimate"}
+    return costs
+
+
+def _rtf(cost: dict, threads: int) -> float:
+    return cost["rtf_1"] * ((1 - cost["parallel"]) + cost["parallel"] / threads)
+
+
+def plan(queue_seconds=None, longest_seconds=None, target_rtf: float = None, backend: str = "openai",
+         compute_type=None, chunk_seconds: float = 120.0, resources: dict = None, calibration: dict = None) -> dict:
+    """
+    Cấu hình {"model", "workers", "threads", "estimated_rtf", ...} cho hàng đợi
+    có tổng `queue_seconds` giây audio, file dài nhất `longest_seconds` giây.
+    Worker chỉ tăng khi file đủ dài để chia thành chừng ấy chunk.
+    """
+    target_rtf = target_rtf or STT_TARGET_RTF
+    resources = resources or host_resources()
+    queue_seconds = queue_seconds or DEFAULT_QUEUE_SECONDS
+    longest_seconds = longest_seconds or queue_seconds
+    cpus = resources["cpus"]
+    budget_mb = resources["available_mb"] * MEMORY_HEADROOM if resources.get("available_mb") else None
+    max_chunks = max(1, int(longest_seconds // max(chunk_seconds, 1)))
+
+    costs = model_costs(backend, compute_type, calibration)
+    options = []
+    for name in [m for m in STT_AUTO_MODELS if m in costs]:
+        cost = costs[name]
+        for workers in range(1, min(cpus, max_chunks) + 1):
+            if budget_mb is not None and workers * cost["memory_mb"] > budget_mb:
+                break
+            threads = max(1, cpus // workers)
+            # Các worker nạp model song song: thời gian nạp tính một lần cho cả hàng đợi
+            total_s = cost["load_ms"] / 1000 + queue_seconds * _rtf(cost, threads) / workers
+            options.append({
+                "model": name,
+                "workers": workers,
+                "threads": threads,
+                "estimated_rtf": round(total_s / queue_seconds, 4),
+                "memory_mb": workers * cost["memory_mb"],
+                "source": cost["source"],
+            })
+    if not options:
+        raise RuntimeError(f"Không model nào vừa RAM còn trống ({resources.get('available_mb')} MB)")
+
+    best = {}
+    for option in options:
+        if option["model"] not in best or option["estimated_rtf"] < best[option["model"]]["estimated_rtf"]:
+            best[option["model"]] = option
+    meeting = [o for o in best.values() if o["estimated_rtf"] <= target_rtf]
+    if meeting:
+        chosen = max(meeting, key=lambda o: MODEL_SIZES.index(o["model"]))
+        reason = "largest model meeting target"
+    else:
+        chosen = min(best.values(), key=lambda o: o["estimated_rtf"])
+        reason = "no model meets target, fastest option"
+
+    return {
+        **chosen,
+        "target_rtf": target_rtf,
+        "queue_s": round(queue_seconds, 1),
+        "cpus": cpus,
+        "available_mb": resources.get("available_mb"),
+        "reason": reason,
+    }
+
+
+def plan_for_files(paths, **kwargs) -> dict:
+    durations = [d for d in (probe_duration(p) for p in paths) if d]
+    if durations:
+        kwargs.setdefault("queue_seconds", sum(durations))
+        kwargs.setdefault("longest_seconds", max(durations))
+    return plan(**kwargs)
+
+
+# =========================
+# CLI
+# =========================
+def default_clip(uploads=None):
+    """File .wav đầu tiên trong uploads_Audio, None nếu không có."""
+    uploads = uploads or SAMPLE_AUDIO_DIR
+    if os.path.isdir(uploads):
+        for name in sorted(os.listdir(uploads)):
+            if name.lower().endswith(".wav"):
+                return os.path.join(uploads, name)
+    return None
+
+
+def main():
+    from stt_backends import BACKENDS, DEFAULT_BACKEND
+
+    parser = argparse.ArgumentParser(description="Calibrate / auto-size Whisper trên máy CPU")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default=os.getenv("STT_BACKEND", DEFAULT_BACKEND))
+    parser.add_argument("--compute-type", default=os.getenv("STT_COMPUTE_TYPE") or None)
+    parser.add_argument("--file", default=None, help="File calibration (mặc định STT_CALIBRATION_FILE)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_cal = sub.add_parser("calibrate", help="Đo RTF/bộ nhớ từng model trên máy này và lưu lại")
+    p_cal.add_argument("--models", default=",".join(STT_AUTO_MODELS))
+    p_cal.add_argument("--clip", default=None, help="Audio có tiếng nói (mặc định file .wav đầu tiên trong uploads_Audio)")
+    p_cal.add_argument("--seconds", type=float, default=60.0, help="Số giây audio (sau khi cắt im lặng) dùng để đo")
+
+    sub.add_parser("show", help="In tài nguyên máy và chi phí model đang dùng để chọn")
+
+    p_plan = sub.add_parser("plan", help="Cấu hình sẽ được chọn cho các file audio")
+    p_plan.add_argument("files", nargs="*")
+    p_plan.add_argument("--target-rtf", type=float, default=None)
+    p_plan.add_argument("--chunk-seconds", type=float, default=float(os.getenv("STT_CHUNK_SECONDS", "120")))
+    args = parser.parse_args()
+
+    if args.cmd == "calibrate":
+        clip = args.clip or default_clip()
+        if not clip:
+            parser.error("Không tìm thấy clip mẫu, truyền --clip")
+        models = [m.strip() for m in args.models.split(",") if m.strip()]
+        entry = calibrate(models, clip, args.backend, args.compute_type, args.seconds)
+        path = save_calibration(args.backend, args.compute_type, entry, args.file)
+        print(json.dumps(entry, ensure_ascii=False, indent=2))
+        print(f"[CALIBRATE] saved to {path}", file=sys.stderr)
+    elif args.cmd == "show":
+        calibration = load_calibration(args.backend, args.compute_type, args.file)
+        print(json.dumps({
+            "host": host_key(args.backend, args.compute_type),
+            "resources": host_resources(),
+            "calibrated_at": calibration["measured_at"] if calibration else None,
+            "models": model_costs(args.backend, args.compute_type, calibration),
+        }, ensure_ascii=False, indent=2))
+    else:
+        calibration = load_calibration(args.backend, args.compute_type, args.file)
+        print(json.dumps(plan_for_files(
+            args.files, target_rtf=args.target_rtf, backend=args.backend, compute_type=args.compute_type,
+            chunk_seconds=args.chunk_seconds, calibration=calibration,
+        ), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
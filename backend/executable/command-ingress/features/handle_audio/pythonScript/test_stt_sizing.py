@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Kiểm tra đường dẫn mặc định của stt_sizing.py: python -m pytest test_stt_sizing.py"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import stt_sizing
+from result_cache import DEFAULT_CACHE_DIR
+
+
+class DefaultPathsTest(unittest.TestCase):
+    def test_backend_dir(self):
+        self.assertEqual(os.path.basename(stt_sizing.BACKEND_DIR), "backend")
+        self.assertTrue(os.path.isdir(os.path.join(stt_sizing.BACKEND_DIR, "executable")))
+
+    def test_calibration_file_shares_cache_root(self):
+        cache_root = os.path.dirname(os.path.abspath(DEFAULT_CACHE_DIR))
+        self.assertEqual(os.path.dirname(stt_sizing.DEFAULT_CALIBRATION_FILE), cache_root)
+
+    def test_default_clip_resolves_uploads_audio(self):
+        self.assertEqual(stt_sizing.SAMPLE_AUDIO_DIR, os.path.join(stt_sizing.BACKEND_DIR, "uploads_Audio"))
+        if not os.path.isdir(stt_sizing.SAMPLE_AUDIO_DIR):
+            self.skipTest("backend/uploads_Audio không có trong checkout này")
+        clip = stt_sizing.default_clip()
+        if clip is not None:
+            self.assertEqual(os.path.dirname(clip), stt_sizing.SAMPLE_AUDIO_DIR)
+            self.assertTrue(clip.lower().endswith(".wav"))
+
+    def test_default_clip_picks_first_wav(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ("b.wav", "a.mp3", "c.WAV"):
+                open(os.path.join(tmp, name), "wb").close()
+            self.assertEqual(stt_sizing.default_clip(tmp), os.path.join(tmp, "b.wav"))
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(stt_sizing.default_clip(tmp))
+
+
+if __name__ == "__main__":
+    unittest.main()
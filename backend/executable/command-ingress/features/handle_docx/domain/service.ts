@@ -13,12 +13,30 @@ export class ReadDocxService {
         const results: any[] = [];
         const inputIds: string[] = [];
 
+        // Lưu tất cả file rồi trích xuất trong một process Python duy nhất
+        const savePaths: string[] = [];
         for (const file of docxFiles) {
             const savePath = path.join(uploadDir, file.name);
             await file.mv(savePath);
-            try {
-                const result = await this.runDocxToText(savePath);
+            savePaths.push(savePath);
+        }
+
+        let extracted: any[] = [];
+        let batchError: string | null = null;
+        try {
+            extracted = await this.runDocxToText(savePaths);
+        } catch (error: any) {
+            batchError = error.message || 'Internal error';
+        }
 
+        for (let i = 0; i < docxFiles.length; i++) {
+            const file = docxFiles[i];
+            const result = extracted[i];
+            if (batchError || !result) {
+                results.push({ text: null, confidence: 0, error: batchError || 'No result from docx script' });
+                continue;
+            }
+            try {
                 // Lưu vào database
                 const savedInput = await this.saveDocumentToDB({
                     projectId,
@@ -89,9 +107,10 @@ export class ReadDocxService {
         return await input.save();
     }
 
-    async runDocxToText(docxPath: string): Promise<any> {
+    async runDocxToText(docxPaths: string[]): Promise<any[]> {
         const scriptPath = path.join(__dirname, '../pythonScript/process_docx.py');
-        const args = [scriptPath, docxPath];
+        // --array: luôn nhận một mảng kết quả theo đúng thứ tự file
+        const args = [scriptPath, '--array', ...docxPaths];
 
         return new Promise((resolve, reject) => {
             const python = spawn('python', args);
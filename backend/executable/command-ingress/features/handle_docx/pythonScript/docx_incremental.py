@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Trích xuất DOCX incremental cho process_docx.py (--incremental).
+
+Mỗi tài liệu (doc id, vd. project + tên file) có một manifest của lần trích
+xuất trước, lưu trong DOCX_MANIFEST_DIR: tách khỏi cache kết quả nên không bị
+evict theo LRU và vẫn có khi EXTRACTION_CACHE=0.
+
+- CRC32 + kích thước của word/document.xml, đọc từ thư mục của file zip (không
+  phải giải nén). Không đổi -> dùng lại toàn bộ khối, không parse body.
+- Từng khối của body (paragraph không rỗng, bảng): sha1 nội dung và nội dung
+  đã trích xuất. document.xml đổi thì body được đọc lại bằng iter_body như
+  read_docx (hash XML từng khối để bỏ qua khối không đổi còn chậm hơn đọc lại).
+
+diff so khớp dãy hash nội dung của hai phiên bản: mỗi khối là unchanged,
+modified hoặc added, khối bị xoá nằm trong "removed". Chỉ sửa định dạng (XML
+đổi, text giữ nguyên) vẫn là unchanged. changed_text ghép text các khối
+added/modified để bước refine phía sau chỉ xử lý phần thay đổi.
+
+Header/footer và core properties nhỏ nên luôn đọc lại.
+"""
+
+import os
+import json
+import difflib
+import hashlib
+import zipfile
+
+from docx_stream import DOCUMENT_PART, iter_body, headers_footers, core_properties
+from result_cache import ResultCache
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_MANIFEST_DIR = os.path.join(BASE_DIR, "..", "..", "..", "..", "..", ".cache", "docx-manifests")
+MANIFEST_DIR = os.getenv("DOCX_MANIFEST_DIR") or DEFAULT_MANIFEST_DIR
+MANIFEST_NAMESPACE = "docx-manifest"
+# Tăng khi cấu trúc manifest thay đổi
+MANIFEST_VERSION = "2"
+
+STATUSES = ("unchanged", "modified", "added")
+
+
+_store = None
+
+
+def get_manifest_store() -> ResultCache:
+    """Kho manifest: cùng định dạng file với cache kết quả, luôn bật, không evict."""
+    global _store
+    if _store is None:
+        _store = ResultCache(root=MANIFEST_DIR, enabled=True)
+    return _store
+
+
+def manifest_key(doc_id: str) -> str:
+    return hashlib.sha256(doc_id.encode("utf-8")).hexdigest()[:40]
+
+
+def load_manifest(doc_id: str, extractor_version: str):
+    """Manifest của phiên bản trước hoặc None (chưa có, bị evict, khác phiên bản extractor)."""
+    manifest = get_manifest_store().get(MANIFEST_NAMESPACE, manifest_key(doc_id))
+    if not manifest or manifest.get("version") != [MANIFEST_VERSION, extractor_version]:
+        return None
+    return manifest
+
+
+def save_manifest(doc_id: str, manifest: dict):
+    get_manifest_store().put(MANIFEST_NAMESPACE, manifest_key(doc_id), manifest, {"doc_id": doc_id}, evict=False)
+
+
+def _content_hash(value) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def block_text(block: dict) -> str:
+    """Text của khối theo cách process_docx ghép all_text."""
+    if block["kind"] == "table":
+        return "\n".join(" | ".join(row) for row in block["value"])
+    return block["value"]
+
+
+def read_docx_incremental(docx_path, previous: dict = None, extractor_version: str = None) -> tuple:
+    """
+    (content, manifest, stats): content cùng dạng với docx_stream.read_docx
+    (paragraphs đã bỏ dòng trống), manifest mới để lưu cho lần sau.
+    """
+    with zipfile.ZipFile(docx_path) as zf:
+        info = zf.getinfo(DOCUMENT_PART)
+        part = [info.CRC, info.file_size]
+        unchanged = bool(previous) and previous["document_part"] == part
+        if unchanged:
+            blocks, sections = previous["blocks"], previous["sections"]
+        else:
+            blocks, sections = [], []
+            with zf.open(DOCUMENT_PART) as f:
+                for kind, value in iter_body(f):
+                    if kind == "section":
+                        sections.append(value)
+                        continue
+                    if kind == "paragraph" and not value.strip():
+                        continue
+                    blocks.append({"kind": kind, "hash": _content_hash(value), "value": value})
+
+        headers, footers = headers_footers(zf, sections)
+        core = core_properties(zf)
+
+    content = {
+        "paragraphs": [b["value"] for b in blocks if b["kind"] == "paragraph"],
+        "tables": [b["value"] for b in blocks if b["kind"] == "table"],
+        "headers": headers,
+        "footers": footers,
+        "core": core,
+    }
+    manifest = {
+        "version": [MANIFEST_VERSION, extractor_version],
+        "document_part": part,
+        "sections": sections,
+        "blocks": blocks,
+    }
+    stats = {"document_part_unchanged": unchanged}
+    return content, manifest, stats
+
+
+def diff_blocks(previous_blocks, blocks: list) -> dict:
+    """
+    {"summary", "blocks", "removed", "changed_text"}. blocks[i] ứng với khối
+    thứ i của phiên bản mới; ref là chỉ số trong paragraphs hoặc tables của
+    kết quả. previous_blocks None (chưa có phiên bản trước): mọi khối là added.
+    """
+    refs, counters = [], {"paragraph": 0, "table": 0}
+    for block in blocks:
+        refs.append(counters[block["kind"]])
+        counters[block["kind"]] += 1
+
+    entries = [None] * len(blocks)
+    removed = []
+
+    def mark(i, status, previous_index=None):
+        entries[i] = {
+            "index": i,
+            "kind": blocks[i]["kind"],
+            "ref": refs[i],
+            "status": status,
+            "previous_index": previous_index,
+        }
+
+    if previous_blocks is None:
+        for i in range(len(blocks)):
+            mark(i, "added")
+    else:
+        matcher = difflib.SequenceMatcher(
+            None, [b["hash"] for b in previous_blocks], [b["hash"] for b in blocks], autojunk=False
+        )
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for k in range(j2 - j1):
+                    mark(j1 + k, "unchanged", i1 + k)
+                continue
+            # replace: ghép từng cặp theo thứ tự thành modified, phần dư là added / removed
+            paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+            for k in range(paired):
+                mark(j1 + k, "modified", i1 + k)
+            for j in range(j1 + paired, j2):
+                mark(j, "added")
+            for i in range(i1 + paired, i2):
+                removed.append({
+                    "previous_index": i,
+                    "kind": previous_blocks[i]["kind"],
+                    "text": block_text(previous_blocks[i]),
+                })
+
+    summary = {status: 0 for status in STATUSES}
+    for entry in entries:
+        summary[entry["status"]] += 1
+    summary["removed"] = len(removed)
+
+    return {
+        "summary": summary,
+        "blocks": entries,
+        "removed": removed,
+        "changed_text": "\n".join(
+            block_text(blocks[entry["index"]]) for entry in entries if entry["status"] != "unchanged"
+        ),
+    }
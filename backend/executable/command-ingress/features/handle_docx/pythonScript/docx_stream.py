@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Đọc DOCX dạng streaming cho process_docx.py, không dựng object model của
+python-docx.
+
+word/document.xml được đọc bằng iterparse: mỗi paragraph / hàng bảng ở cấp
+body được xử lý ngay khi parse xong rồi bị gỡ khỏi cây, nên bộ nhớ chỉ giữ
+phần tử đang đọc thay vì cả tài liệu. Kết quả khớp với đường python-docx:
+
+- paragraph.text: chỉ các w:r (và w:r trong w:hyperlink) con trực tiếp của
+  w:p; w:tab/w:ptab -> "\\t", w:br (textWrapping)/w:cr -> "\\n",
+  w:noBreakHyphen -> "-"
+- row.cells: ô gridSpan=n lặp lại n lần, ô vMerge="continue" lấy nội dung
+  của ô phía trên cùng cột lưới
+- header/footer: header/footer "default" của từng section, section không
+  khai báo thì dùng của section trước (như is_linked_to_previous)
+- core properties: title/author/last_modified_by là "" nếu không có;
+  created/modified đổi về UTC theo offset W3CDTF ("+07:00") như python-docx
+"""
+
+import re
+import zipfile
+import posixpath
+from datetime import datetime, timedelta, timezone
+from xml.etree.ElementTree import iterparse, fromstring
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+DCTERMS = "{http://purl.org/dc/terms/}"
+CP = "{http://schemas.openxmlformats.org/package/2006/metadata/core-properties}"
+
+DOCUMENT_PART = "word/document.xml"
+
+_BODY = W + "body"
+_P = W + "p"
+_R = W + "r"
+_HYPERLINK = W + "hyperlink"
+_TBL = W + "tbl"
+_TR = W + "tr"
+_TC = W + "tc"
+_SECT_PR = W + "sectPr"
+_VAL = W + "val"
+_TYPE = W + "type"
+
+
+def _run_text(r) -> str:
+    parts = []
+    for child in r:
+        tag = child.tag
+        if tag == W + "t":
+            parts.append(child.text or "")
+        elif tag in (W + "tab", W + "ptab"):
+            parts.append("\t")
+        elif tag == W + "br":
+            if child.get(_TYPE, "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif tag == W + "cr":
+            parts.append("\n")
+        elif tag == W + "noBreakHyphen":
+            parts.append("-")
+    return "".join(parts)
+
+
+def paragraph_text(p) -> str:
+    parts = []
+    for child in p:
+        if child.tag == _R:
+            parts.append(_run_text(child))
+        elif child.tag == _HYPERLINK:
+            parts.extend(_run_text(r) for r in child if r.tag == _R)
+    return "".join(parts)
+
+
+def _int_prop(parent, path, default):
+    el = parent.find(path) if parent is not None else None
+    if el is None:
+        return default
+    try:
+        return int(el.get(_VAL))
+    except (TypeError, ValueError):
+        return default
+
+
+def row_cells(tr, row_above) -> tuple:
+    """
+    Text các ô của hàng theo lưới (như row.cells của python-docx).
+    row_above: {cột lưới: text} của hàng trước, dùng cho ô vMerge="continue".
+    Trả về (cells, grid) với grid là {cột lưới: text} của hàng này.
+    """
+    cells, grid = [], {}
+    col = _int_prop(tr.find(W + "trPr"), W + "gridBefore", 0)
+    for tc in tr:
+        if tc.tag != _TC:
+            continue
+        tc_pr = tc.find(W + "tcPr")
+        span = max(1, _int_prop(tc_pr, W + "gridSpan", 1))
+        v_merge = tc_pr.find(W + "vMerge") if tc_pr is not None else None
+        if v_merge is not None and v_merge.get(_VAL, "continue") == "continue":
+            texts = [row_above.get(col + i, "") for i in range(span)]
+        else:
+            text = "\n".join(
+                t.strip() for t in (paragraph_text(p) for p in tc if p.tag == _P) if t.strip()
+            )
+            texts = [text] * span
+        for i, text in enumerate(texts):
+            grid[col + i] = text
+        cells.extend(texts)
+        col += span
+    return cells, grid
+
+
+def _section_refs(sect_pr) -> dict:
+    """rId của header/footer "default" khai báo trong một w:sectPr."""
+    refs = {}
+    for kind in ("header", "footer"):
+        for ref in sect_pr.iter(W + kind + "Reference"):
+            if ref.get(_TYPE, "default") == "default":
+                refs[kind] = ref.get(R + "id")
+    return refs
+
+
+def iter_body(source):
+    """
+    Sinh các khối của body theo đúng thứ tự trong tài liệu:
+        ("paragraph", text) | ("table", [[cell, ...], ...]) | ("section", refs)
+    source: file-like hoặc đường dẫn tới word/document.xml.
+    """
+    stack = []
+    body = table = None
+    rows, row_above = [], {}
+    for event, el in iterparse(source, events=("start", "end")):
+        if event == "start":
+            stack.append(el)
+            if el.tag == _BODY:
+                body = el
+            elif el.tag == _TBL and len(stack) >= 2 and stack[-2] is body:
+                table, rows, row_above = el, [], {}
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent is body and body is not None:
+            if el.tag == _P:
+                yield "paragraph", paragraph_text(el)
+                sect_pr = el.find(W + "pPr/" + _SECT_PR)
+                if sect_pr is not None:
+                    yield "section", _section_refs(sect_pr)
+            elif el.tag == _TBL:
+                yield "table", rows
+                table, rows = None, []
+            elif el.tag == _SECT_PR:
+                yield "section", _section_refs(el)
+            body.remove(el)
+        elif parent is table and table is not None and el.tag == _TR:
+            cells, row_above = row_cells(el, row_above)
+            rows.append(cells)
+            table.remove(el)
+
+
+def _relationships(zf: zipfile.ZipFile, part: str) -> dict:
+    rels_path = posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+    try:
+        root = fromstring(zf.read(rels_path))
+    except KeyError:
+        return {}
+    base = posixpath.dirname(part)
+    return {
+        rel.get("Id"): posixpath.normpath(posixpath.join(base, rel.get("Target", "")))
+        for rel in root.iter(REL + "Relationship")
+        if rel.get("TargetMode") != "External"
+    }
+
+
+def _part_paragraphs(zf: zipfile.ZipFile, part: str) -> list:
+    try:
+        root = fromstring(zf.read(part))
+    except KeyError:
+        return []
+    return [paragraph_text(p) for p in root if p.tag == _P]
+
+
+_OFFSET = re.compile(r"([+-])(\d\d):(\d\d)")
+
+
+def _parse_datetime(value):
+    """W3CDTF -> datetime UTC, giống CT_CoreProperties._parse_W3CDTF_to_datetime."""
+    if not value:
+        return None
+    # 19 ký tự đầu là ngày giờ, phần sau là "Z" hoặc offset dạng "+07:00"
+    parsed = None
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d", "%Y-%m", "%Y"):
+        try:
+            parsed = datetime.strptime(value[:19], fmt)
+            break
+        except ValueError:
+            continue
+    if parsed is None:
+        return None
+    offset = value[19:]
+    if len(offset) == 6:
+        match = _OFFSET.match(offset)
+        if match is None:
+            return None
+        sign, hours, minutes = match.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes))
+        parsed = parsed - delta if sign == "+" else parsed + delta
+    return parsed.replace(tzinfo=timezone.utc)
+
+
+def core_properties(zf: zipfile.ZipFile) -> dict:
+    try:
+        root = fromstring(zf.read("docProps/core.xml"))
+    except KeyError:
+        root = None
+
+    def text_of(tag):
+        el = root.find(tag) if root is not None else None
+        return (el.text or "") if el is not None else ""
+
+    return {
+        "title": text_of(DC + "title"),
+        "author": text_of(DC + "creator"),
+        "last_modified_by": text_of(CP + "lastModifiedBy"),
+        "created": _parse_datetime(text_of(DCTERMS + "created")),
+        "modified": _parse_datetime(text_of(DCTERMS + "modified")),
+    }
+
+
+def headers_footers(zf: zipfile.ZipFile, sections: list) -> tuple:
+    """(headers, footers): paragraph của header/footer "default" theo từng section."""
+    rels = _relationships(zf, DOCUMENT_PART)
+    headers, footers = [], []
+    current = {"header": None, "footer": None}
+    for refs in sections:
+        for kind, out in (("header", headers), ("footer", footers)):
+            if kind in refs:
+                current[kind] = rels.get(refs[kind])
+            if current[kind]:
+                out.extend(_part_paragraphs(zf, current[kind]))
+    return headers, footers
+
+
+def read_docx(docx_path) -> dict:
+    """
+    {"paragraphs", "tables", "headers", "footers", "core"} của file DOCX.
+    paragraphs/headers/footers chưa lọc dòng trống (giống doc.paragraphs).
+    """
+    paragraphs, tables, sections = [], [], []
+    with zipfile.ZipFile(docx_path) as zf:
+        with zf.open(DOCUMENT_PART) as f:
+            for kind, value in iter_body(f):
+                if kind == "paragraph":
+                    paragraphs.append(value)
+                elif kind == "table":
+                    tables.append(value)
+                else:
+                    sections.append(value)
+
+        headers, footers = headers_footers(zf, sections)
+        return {
+            "paragraphs": paragraphs,
+            "tables": tables,
+            "headers": headers,
+            "footers": footers,
+            "core": core_properties(zf),
+        }
@@ -1,130 +1,306 @@
 import sys
 import json
-from docx import Document
 import io
 import os
-from langdetect import detect_langs, DetectorFactory
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-# Đảm bảo kết quả ổn định khi detect
-DetectorFactory.seed = 0
+# Shared modules (result cache...) nằm ở command-ingress/shared/pythonScript
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "..", "..", "shared", "pythonScript"))
+
+from result_cache import get_cache
+from cli_output import ResultWriter
+from docx_stream import read_docx
+from docx_incremental import read_docx_incremental, diff_blocks, load_manifest, save_manifest
+from lang_detect import detect_language, load_profiles
+import metrics
+
+# Tăng khi logic trích xuất thay đổi để cache không trả kết quả cũ
+EXTRACTOR_VERSION = "3"
+
+# Bộ đọc DOCX: "python-docx" (object model đầy đủ), "stream" (iterparse
+# word/document.xml, xem docx_stream.py) hoặc "auto": stream cho file từ
+# DOCX_STREAM_MIN_BYTES trở lên. Hai bộ đọc cho cùng kết quả; bộ đọc được
+# chọn vẫn nằm trong khoá cache để khác biệt (nếu có) không lẫn vào nhau.
+DOCX_PARSER = os.getenv("DOCX_PARSER", "auto")
+DOCX_STREAM_MIN_BYTES = int(os.getenv("DOCX_STREAM_MIN_BYTES", str(2 * 1024 * 1024)))
+DOCX_PARSERS = ("auto", "stream", "python-docx")
+
+# Số process đọc DOCX khi có nhiều file (0 = theo số CPU, 1 = tuần tự)
+DOCX_WORKERS = int(os.getenv("DOCX_WORKERS", "0"))
 
 # Đảm bảo output UTF-8
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-# Mapping ISO-639-1 -> locale phổ biến
-LANG_MAP = {
-    "vi": "vi-VN",
-    "en": "en-US",
-    "fr": "fr-FR",
-    "de": "de-DE",
-    "es": "es-ES",
-    "it": "it-IT",
-    "pt": "pt-PT",
-    "ru": "ru-RU",
-    "ja": "ja-JP",
-    "ko": "ko-KR",
-    "zh-cn": "zh-CN",
-    "zh-tw": "zh-TW"
-}
-
-def normalize_lang(lang_code: str) -> str:
-    """Chuyển ISO-639-1 sang locale, nếu không có thì trả về nguyên bản."""
-    return LANG_MAP.get(lang_code.lower(), lang_code)
-
-def extract_text(docx_path):
-    try:
-        doc = Document(docx_path)
-
-        # Lấy paragraphs
-        paragraphs = [para.text for para in doc.paragraphs if para.text.strip()]
-
-        # Lấy bảng (giữ nguyên dạng lưới, không mất xuống dòng trong cell)
-        tables = []
-        for table in doc.tables:
-            table_data = []
-            for row in table.rows:
-                row_data = []
-                for cell in row.cells:
-                    cell_text = "\n".join(
-                        p.text.strip() for p in cell.paragraphs if p.text.strip()
-                    )
-                    row_data.append(cell_text)
-                table_data.append(row_data)
-            tables.append(table_data)
-
-        # Lấy header/footer
-        headers, footers = [], []
-        for section in doc.sections:
-            if section.header and section.header.paragraphs:
-                headers.extend([p.text for p in section.header.paragraphs if p.text.strip()])
-            if section.footer and section.footer.paragraphs:
-                footers.extend([p.text for p in section.footer.paragraphs if p.text.strip()])
-
-        # Ghép toàn bộ text
-        all_text = "\n".join(paragraphs)
-        for table in tables:
-            for row in table:
-                all_text += "\n" + " | ".join(row)
-
-        # Detect language (đa ngôn ngữ, trả về list)
-        
-        language = None
-        try:
-            if all_text:
-                langs = detect_langs(all_text[:5000])  # lấy mẫu tối đa 5000 ký tự
-                if langs:
-                # lấy lang có xác suất cao nhất
-                    top_lang = max(langs, key=lambda x: x.prob)
-                language = normalize_lang(str(top_lang.lang))
-        except Exception:
-            language = None
-
-        # Lấy metadata
-        core = doc.core_properties
-        metadata = {
-            "file_path": os.path.abspath(docx_path),
+def error_result(docx_path, error):
+    return {
+        "text": None,
+        "confidence": 0,
+        "error": error,
+        "metadata": {
+            "file_path": docx_path
+        }
+    }
+
+def read_python_docx(docx_path) -> dict:
+    """Cùng dạng với docx_stream.read_docx nhưng qua object model của python-docx."""
+    from docx import Document
+
+    doc = Document(docx_path)
+
+    # Lấy bảng (giữ nguyên dạng lưới, không mất xuống dòng trong cell)
+    tables = []
+    for table in doc.tables:
+        table_data = []
+        for row in table.rows:
+            row_data = []
+            for cell in row.cells:
+                cell_text = "\n".join(
+                    p.text.strip() for p in cell.paragraphs if p.text.strip()
+                )
+                row_data.append(cell_text)
+            table_data.append(row_data)
+        tables.append(table_data)
+
+    # Lấy header/footer
+    headers, footers = [], []
+    for section in doc.sections:
+        if section.header and section.header.paragraphs:
+            headers.extend(p.text for p in section.header.paragraphs)
+        if section.footer and section.footer.paragraphs:
+            footers.extend(p.text for p in section.footer.paragraphs)
+
+    core = doc.core_properties
+    return {
+        "paragraphs": [para.text for para in doc.paragraphs],
+        "tables": tables,
+        "headers": headers,
+        "footers": footers,
+        "core": {
             "title": core.title,
             "author": core.author,
             "last_modified_by": core.last_modified_by,
-            "created": core.created.strftime("%Y-%m-%d %H:%M:%S") if core.created else None,
-            "modified": core.modified.strftime("%Y-%m-%d %H:%M:%S") if core.modified else None,
-            "pages": None,  # python-docx không hỗ trợ
-            "language": language,
-            "file_size": os.path.getsize(docx_path),
-            "paragraphs_count": len(paragraphs),
-            "tables_count": len(tables),
-            "headers": headers,
-            "footers": footers
-        }
+            "created": core.created,
+            "modified": core.modified,
+        },
+    }
 
-        return {
-            "text": all_text.strip(),
-            "confidence": 1.0,
-            "metadata": metadata,
-            "paragraphs": paragraphs,
-            "tables": tables
-        }
 
+def choose_parser(docx_path, parser=None) -> str:
+    parser = parser or DOCX_PARSER
+    if parser not in DOCX_PARSERS:
+        raise ValueError(f"DOCX parser không hỗ trợ: {parser} (chọn một trong {', '.join(DOCX_PARSERS)})")
+    if parser == "auto":
+        return "stream" if os.path.getsize(docx_path) >= DOCX_STREAM_MIN_BYTES else "python-docx"
+    return parser
+
+
+def build_result(docx_path, content) -> dict:
+    """Kết quả (text, metadata, paragraphs, tables) từ nội dung của một bộ đọc."""
+    paragraphs = [text for text in content["paragraphs"] if text.strip()]
+    tables = content["tables"]
+    headers = [text for text in content["headers"] if text.strip()]
+    footers = [text for text in content["footers"] if text.strip()]
+
+    # Ghép toàn bộ text: paragraphs rồi từng hàng bảng, join một lần
+    parts = ["\n".join(paragraphs)]
+    parts.extend(" | ".join(row) for table in tables for row in table)
+    all_text = "\n".join(parts).strip()
+
+    # Detect language (lấy mẫu phân tầng trên toàn văn bản)
+    try:
+        detected = detect_language(all_text)
+    except Exception:
+        detected = {"language": None, "spans": []}
+
+    # Lấy metadata
+    core = content["core"]
+    metadata = {
+        "file_path": os.path.abspath(docx_path),
+        "title": core["title"],
+        "author": core["author"],
+        "last_modified_by": core["last_modified_by"],
+        "created": core["created"].strftime("%Y-%m-%d %H:%M:%S") if core["created"] else None,
+        "modified": core["modified"].strftime("%Y-%m-%d %H:%M:%S") if core["modified"] else None,
+        "pages": None,  # DOCX không lưu số trang
+        "language": detected["language"],
+        "language_spans": detected["spans"],
+        "file_size": os.path.getsize(docx_path),
+        "paragraphs_count": len(paragraphs),
+        "tables_count": len(tables),
+        "headers": headers,
+        "footers": footers
+    }
+
+    return {
+        "text": all_text,
+        "confidence": 1.0,
+        "metadata": metadata,
+        "paragraphs": paragraphs,
+        "tables": tables
+    }
+
+def extract_text(docx_path, parser=None):
+    try:
+        chosen = choose_parser(docx_path, parser)
+        with metrics.span("read", parser=chosen):
+            if chosen == "stream":
+                content = read_docx(docx_path)
+            else:
+                content = read_python_docx(docx_path)
+        return build_result(docx_path, content)
     except Exception as e:
-        return {
-            "text": None,
-            "confidence": 0,
-            "error": str(e),
-            "metadata": {
-                "file_path": docx_path
-            }
-        }
+        return error_result(docx_path, str(e))
+
+def extract_incremental(docx_path, doc_id):
+    """
+    Trích xuất so với phiên bản trước của cùng doc_id (xem docx_incremental.py):
+    kết quả như extract_text kèm "diff" (khối unchanged/modified/added/removed).
+    Không qua cache kết quả: diff phụ thuộc manifest của lần trước.
+    """
+    try:
+        previous = load_manifest(doc_id, EXTRACTOR_VERSION)
+        if previous is None:
+            print(f"[DOCX] No previous manifest for doc id {doc_id!r}: every block is reported as added",
+                  file=sys.stderr)
+        with metrics.span("read", parser="incremental"):
+            content, manifest, stats = read_docx_incremental(docx_path, previous, EXTRACTOR_VERSION)
+        result = build_result(docx_path, content)
+        with metrics.span("diff"):
+            diff = diff_blocks(previous["blocks"] if previous else None, manifest["blocks"])
+        result["diff"] = {"doc_id": doc_id, "previous_version": previous is not None, **stats, **diff}
+        save_manifest(doc_id, manifest)
+        return result
+    except Exception as e:
+        return error_result(docx_path, str(e))
+
+def extract_with_cache(docx_path, parser=None, use_cache=True):
+    """extract_text qua cache nội dung file; file_path luôn là đường dẫn hiện tại."""
+    if not use_cache:
+        return extract_text(docx_path, parser)
+    try:
+        chosen = choose_parser(docx_path, parser)
+    except Exception as e:
+        return error_result(docx_path, str(e))
+    result, hit = get_cache().get_or_compute(
+        "docx", docx_path, {"version": EXTRACTOR_VERSION, "parser": chosen},
+        lambda: extract_text(docx_path, chosen),
+        is_cacheable=lambda r: not r.get("error")
+    )
+    if hit:
+        result["metadata"]["file_path"] = os.path.abspath(docx_path)
+    return result
+
+def _extract_one(docx_path, parser, use_cache, doc_id=None, metrics_flags=(None, None)):
+    """
+    (kết quả, trace events). doc_id: trích xuất incremental theo tài liệu đó.
+    metrics_flags = (enabled, trace) truyền tường minh vì worker có thể không
+    thừa hưởng cấu hình CLI của process cha.
+    """
+    enabled, trace = metrics_flags
+    with metrics.recording(enabled=enabled, trace=trace) as recorder:
+        # Lỗi của một file (không đọc được, cache hỏng...) không làm hỏng cả lô
+        try:
+            if doc_id:
+                result = extract_incremental(docx_path, doc_id)
+            else:
+                result = extract_with_cache(docx_path, parser, use_cache)
+        except Exception as e:
+            result = error_result(docx_path, str(e))
+    if (metrics.METRICS_ENABLED if enabled is None else enabled):
+        # Gắn sau khi tra cache: metrics là của lần chạy này, không được lưu vào cache
+        result = {**result, "metrics": recorder.to_dict()}
+    return result, recorder.events if recorder.trace else []
+
+def extract_files(paths, workers=1, parser=None, use_cache=True, doc_ids=None):
+    """
+    Sinh kết quả theo đúng thứ tự `paths`. Với workers > 1 các file được đọc
+    trên process pool: cả hai bộ đọc và langdetect đều là Python thuần, giữ GIL.
+    doc_ids (cùng độ dài với paths): trích xuất incremental theo từng tài liệu.
+    """
+    doc_ids = doc_ids or [None] * len(paths)
+    if workers <= 1 or len(paths) <= 1:
+        for path, doc_id in zip(paths, doc_ids):
+            yield _extract_one(path, parser, use_cache, doc_id)[0]
+        return
+
+    # Nạp profile langdetect trước khi fork để các worker dùng chung
+    load_profiles()
+    metrics_flags = (metrics.METRICS_ENABLED, bool(metrics.TRACE_PATH))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_extract_one, path, parser, use_cache, doc_id, metrics_flags)
+            for path, doc_id in zip(paths, doc_ids)
+        ]
+        for path, future in zip(paths, futures):
+            try:
+                result, events = future.result()
+                metrics.add_trace_events(events)
+                yield result
+            except Exception as e:
+                # Worker chết giữa chừng (BrokenProcessPool, hết bộ nhớ...)
+                yield error_result(path, str(e) or type(e).__name__)
+
+def handle_cli():
+    parser = argparse.ArgumentParser(description="Extract text, tables and metadata from DOCX files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--workers", type=int, default=DOCX_WORKERS,
+                        help="Số process đọc DOCX khi có nhiều file (mặc định DOCX_WORKERS, 0 = theo số CPU)")
+    parser.add_argument("--parser", choices=DOCX_PARSERS, default=None,
+                        help="Bộ đọc DOCX (mặc định DOCX_PARSER hoặc auto)")
+    parser.add_argument("--no-cache", action="store_true", help="Bỏ qua cache kết quả")
+    parser.add_argument("--incremental", action="store_true",
+                        help="So với phiên bản trước của cùng tài liệu, trả về thêm diff theo khối (bộ đọc stream)")
+    parser.add_argument("--doc-id", action="append", default=None,
+                        help="Định danh tài liệu (vd. project + tên file), bắt buộc với --incremental, "
+                             "mỗi file một lần theo thứ tự")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--stream", action="store_true",
+                        help="In mỗi file một dòng JSON ngay khi xong (NDJSON)")
+    output.add_argument("--array", action="store_true",
+                        help="Luôn in một mảng JSON, kể cả khi chỉ có một file")
+    parser.add_argument("--metrics", action="store_true", default=None,
+                        help="Gắn thời gian/bộ nhớ từng bước vào metrics của mỗi file (mặc định EXTRACTION_METRICS)")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="Ghi các span ra file Chrome trace (mặc định EXTRACTION_TRACE)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.trace)
+    doc_ids = None
+    if args.doc_id and not args.incremental:
+        parser.error("--doc-id chỉ dùng cùng --incremental")
+    if args.incremental:
+        if args.parser == "python-docx":
+            parser.error("--incremental dùng bộ đọc stream, không dùng được với --parser python-docx")
+        # Không đoán từ tên file: hai project cùng upload spec.docx sẽ diff với tài liệu của nhau
+        if not args.doc_id or len(args.doc_id) != len(args.files):
+            parser.error("--incremental cần đúng một --doc-id cho mỗi file")
+        doc_ids = args.doc_id
+
+    workers = args.workers or os.cpu_count() or 1
+    workers = min(workers, len(args.files))
+
+    # Một file, không --array/--stream: in một object như trước
+    single = len(args.files) == 1 and not (args.array or args.stream)
+    writer = ResultWriter(stream=args.stream, indent=2)
+
+    started = time.perf_counter()
+    failed = 0
+    for result in extract_files(args.files, workers=workers, parser=args.parser,
+                                use_cache=not args.no_cache, doc_ids=doc_ids):
+        failed += bool(result.get("error"))
+        if single:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            writer.write(result)
+
+    if not single:
+        writer.close()
+    metrics.write_trace()
+
+    elapsed = time.perf_counter() - started
+    print(f"[DOCX] {len(args.files)} files in {elapsed:.2f}s (workers={workers}, failed={failed})", file=sys.stderr)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(json.dumps({
-            "text": None,
-            "confidence": 0,
-            "error": "Usage: python script.py <docx_path>",
-            "metadata": {}
-        }, ensure_ascii=False, indent=2))
-        sys.exit(1)
-    
-    docx_path = sys.argv[1]
-    result = extract_text(docx_path)
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    handle_cli()
@@ -25,6 +25,8 @@ export class OcrService {
         originalFilename: string;
         mimeType: string;
         rawText: string;
+        paragraphs?: string[];
+        ocrData?: any;
         metadata: any;
         confidenceScore: number;
         cleanedText?: string;
@@ -40,6 +42,8 @@ export class OcrService {
             mime_type: data.mimeType,
             raw_text: data.rawText,
             cleaned_text: data.rawText,
+            paragraphs: data.paragraphs || [],
+            ocr_data: data.ocrData || {},
             metadata: data.metadata,
             confidence_score: data.confidenceScore,
             quality_score: data.confidenceScore,
@@ -100,7 +104,7 @@ export class OcrService {
                 is_scanned: true,
                 created: new Date(),
                 modified: new Date(),
-                paragraphs_count: 0,
+                paragraphs_count: res?.paragraphs?.length || 0,
                 tables_count: 0,
                 headers: [],
                 footers: []
@@ -118,6 +122,8 @@ export class OcrService {
                 originalFilename: img.name,
                 mimeType: img.mimetype,
                 rawText: res?.raw_text || '',
+                paragraphs: res?.paragraphs || [],
+                ocrData: res?.ocr_data,
                 metadata,
                 confidenceScore: normalizedConfidence,
                 cleanedText: res?.raw_text || '',
@@ -167,6 +173,8 @@ export class OcrService {
 
     private async runOCR(imagePaths: string[]): Promise<any[]> {
         const scriptPath = path.join(__dirname, '../pythonScript/process_OCR.py');
+        // Layout mode (paragraphs, raw_text tách dòng/đoạn) chỉ bật khi đặt OCR_LAYOUT=1:
+        // process_OCR.py đọc biến này từ môi trường được kế thừa, mặc định raw_text như cũ
         const args = [scriptPath, ...imagePaths];
 
         return new Promise((resolve, reject) => {
@@ -9,114 +9,424 @@ Tự động phát hiện ngôn ngữ.
 import os
 import sys
 import io
-import cv2
-import pytesseract
-from PIL import Image
+import time
 import argparse
-import json
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langdetect import detect, DetectorFactory
+
+# Shared modules (OCR engine...) nằm ở command-ingress/shared/pythonScript
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "..", "..", "shared", "pythonScript"))
+
+from ocr_engine import get_ocr_engine, current_ocr_engine, DEFAULT_TESSERACT_LANG
+from result_cache import get_cache
+from image_preprocess import PreprocessPipeline, IMAGE_PIPELINE
+from cli_output import ResultWriter
+from lang_detect import detect_code, load_profiles, normalize_lang
+import metrics
 
 # Unicode stdout
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
-# Load env
+# Load env (TESSERACT_CMDS / OCR_SERVER_ADDR được ocr_engine đọc)
 load_dotenv()
-TESSERACT_PATHS = os.getenv("TESSERACT_CMDS", r"F:\Tesseract-OCR\tesseract.exe,/usr/bin/tesseract").split(",")
 
-# Setup Tesseract
-for cmd in TESSERACT_PATHS:
-    if os.path.exists(cmd.strip()):
-        pytesseract.pytesseract.tesseract_cmd = cmd.strip()
-        break
 
-# Langdetect ổn định
-DetectorFactory.seed = 0
+# Tăng khi logic OCR thay đổi để cache không trả kết quả cũ
+EXTRACTOR_VERSION = "3"
+TESSERACT_CONFIG = "--psm 6 --oem 1"
+# Chuỗi bước tiền xử lý (xem shared/pythonScript/image_preprocess.py)
+OCR_PREPROCESS = PreprocessPipeline.parse(os.getenv("OCR_PREPROCESS_PIPELINE", IMAGE_PIPELINE))
+# Số ảnh OCR đồng thời khi chạy nhiều ảnh (0 = theo số CPU)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+# Layout mode: nhóm từ thành dòng/đoạn/khối theo output Tesseract
+OCR_LAYOUT = os.getenv("OCR_LAYOUT", "0").lower() in ("1", "true", "on", "yes")
+# Tiling ảnh lớn: ngưỡng số pixel (sau upscale), chiều cao dải, phần chồng lấn (px ảnh gốc).
+# Ảnh được cắt thành dải ngang nguyên chiều rộng (không cắt dọc dòng chữ); ảnh rộng
+# hơn OCR_TILE_MAX_WIDTH dùng dải thấp hơn để mỗi dải không quá
+# OCR_TILE_SIZE * OCR_TILE_MAX_WIDTH pixel.
+# Bộ nhớ đỉnh vẫn tăng theo kích thước ảnh: ảnh gốc được giải mã nguyên (1 byte/pixel
+# nếu pipeline bắt đầu bằng gray). Tiling chỉ giới hạn phần upscale 2x, tiền xử lý
+# và Tesseract (lớn hơn ảnh gốc nhiều lần) ở tối đa tile_workers dải một lúc.
+OCR_TILE_MAX_PIXELS = int(float(os.getenv("OCR_TILE_MAX_PIXELS", "16e6")))
+OCR_TILE_SIZE = int(os.getenv("OCR_TILE_SIZE", "2048"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "160"))
+OCR_TILE_MAX_WIDTH = int(os.getenv("OCR_TILE_MAX_WIDTH", "4096"))
+# Hai bản nhận dạng của cùng một từ ở hai bên đường nối tile: IoU vượt ngưỡng này
+TILE_DEDUP_IOU = 0.3
+# Cột image_to_data giữ lại khi ghép kết quả các tile
+TILE_COLUMNS = ("block_num", "par_num", "line_num", "left", "top", "width", "height", "conf", "text")
+
+
+def _run_starts(*keys):
+    """Vị trí bắt đầu của các đoạn liên tiếp có cùng bộ khoá (dữ liệu đã theo thứ tự đọc)."""
+    import numpy as np
+    change = np.zeros(len(keys[0]), dtype=bool)
+    if len(change):
+        change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def _reduce_groups(starts, x0, y0, x1, y1, weighted_conf, weight):
+    """bbox hợp và tổng (conf * số ký tự), tổng số ký tự của từng nhóm."""
+    import numpy as np
+    return (
+        np.minimum.reduceat(x0, starts), np.minimum.reduceat(y0, starts),
+        np.maximum.reduceat(x1, starts), np.maximum.reduceat(y1, starts),
+        np.add.reduceat(weighted_conf, starts), np.add.reduceat(weight, starts),
+    )
+
+
+def _bbox(x0, y0, x1, y1):
+    return {"x": int(x0), "y": int(y0), "w": int(x1 - x0), "h": int(y1 - y0)}
+
+
+def image_size(path):
+    """(width, height) đọc từ header ảnh (không giải mã), None nếu không đọc được."""
+    from PIL import Image
+    try:
+        with Image.open(path) as im:
+            return im.width, im.height
+    except Image.DecompressionBombError:
+        # Ảnh vượt giới hạn của PIL: chắc chắn đủ lớn để tile
+        return OCR_TILE_MAX_PIXELS, OCR_TILE_MAX_PIXELS
+    except Exception:
+        return None
+
+
+def _tile_spans(length, size, overlap):
+    """[(start, end, core_start, core_end)]: các tile chồng lấn, core chia đôi phần chồng lấn."""
+    if length <= size:
+        return [(0, length, 0, length)]
+    step = max(1, size - overlap)
+    starts = list(range(0, length - size, step)) + [length - size]
+    ends = [start + size for start in starts]
+    # Ranh giới core giữa hai tile kề nhau là điểm giữa vùng chồng lấn
+    cuts = [0] + [(starts[i + 1] + ends[i]) // 2 for i in range(len(starts) - 1)] + [length]
+    return [(starts[i], ends[i], cuts[i], cuts[i + 1]) for i in range(len(starts))]
+
+
+def plan_tiles(height, width, size=None, overlap=None, max_width=None):
+    """
+    Dải ngang nguyên chiều rộng từ trên xuống: [((y0, y1, x0, x1), (cy0, cy1, cx0, cx1))].
+    Không cắt theo chiều ngang: từ của một dòng nằm chung một dải nên text
+    ghép theo thứ tự dải giữ đúng thứ tự đọc như khi không tile.
+    """
+    size = size or OCR_TILE_SIZE
+    overlap = OCR_TILE_OVERLAP if overlap is None else overlap
+    max_width = max_width or OCR_TILE_MAX_WIDTH
+    if width > max_width:
+        # Dải vẫn phải cao hơn hẳn phần chồng lấn
+        size = max(4 * overlap, size * max_width // width)
+    return [
+        ((y0, y1, 0, width), (cy0, cy1, 0, width))
+        for y0, y1, cy0, cy1 in _tile_spans(height, size, overlap)
+    ]
+
+
+def dedup_seam_words(data, cuts_x, cuts_y):
+    """
+    Bỏ bản trùng của các từ nằm vắt qua ranh giới core giữa hai tile (mỗi tile
+    nhận ra từ đó với bbox hơi lệch nên tâm rơi vào hai core khác nhau): giữa
+    hai bbox có IoU > TILE_DEDUP_IOU, giữ bản có confidence cao hơn.
+    """
+    import numpy as np
+    if not data["text"]:
+        return data
+    x0 = np.asarray(data["left"], dtype=np.float64)
+    y0 = np.asarray(data["top"], dtype=np.float64)
+    x1 = x0 + np.asarray(data["width"], dtype=np.float64)
+    y1 = y0 + np.asarray(data["height"], dtype=np.float64)
+    conf = np.asarray(data["conf"], dtype=np.float64)
+
+    crosses = np.zeros(len(x0), dtype=bool)
+    for cut in cuts_x:
+        crosses |= (x0 < cut) & (x1 > cut)
+    for cut in cuts_y:
+        crosses |= (y0 < cut) & (y1 > cut)
+    idx = np.flatnonzero(crosses)
+    if len(idx) < 2:
+        return data
+
+    ix0, iy0, ix1, iy1 = x0[idx], y0[idx], x1[idx], y1[idx]
+    inter_w = np.clip(np.minimum(ix1[:, None], ix1[None, :]) - np.maximum(ix0[:, None], ix0[None, :]), 0, None)
+    inter_h = np.clip(np.minimum(iy1[:, None], iy1[None, :]) - np.maximum(iy0[:, None], iy0[None, :]), 0, None)
+    inter = inter_w * inter_h
+    area = (ix1 - ix0) * (iy1 - iy0)
+    iou = inter / np.maximum(area[:, None] + area[None, :] - inter, 1e-9)
+    np.fill_diagonal(iou, 0)
+
+    drop = set()
+    for a, b in zip(*np.nonzero(np.triu(iou > TILE_DEDUP_IOU))):
+        if a in drop or b in drop:
+            continue
+        drop.add(b if conf[idx[a]] >= conf[idx[b]] else a)
+    if not drop:
+        return data
+    keep = np.setdiff1d(np.arange(len(x0)), idx[sorted(drop)])
+    return {column: [values[i] for i in keep] for column, values in data.items()}
 
 
 class ImageOCR:
-    def __init__(self, min_conf=20):
+    def __init__(self, min_conf=20, layout=False, tile_max_pixels=None, tile_workers=0):
         self.min_conf = min_conf
+        self.layout = layout
+        self.tile_max_pixels = OCR_TILE_MAX_PIXELS if tile_max_pixels is None else tile_max_pixels
+        # Số tile OCR đồng thời trong một ảnh (0 = theo số CPU)
+        self.tile_workers = tile_workers
+
+    def cache_config(self):
+        return {
+            "version": EXTRACTOR_VERSION,
+            "min_conf": self.min_conf,
+            "layout": self.layout,
+            "tiling": [self.tile_max_pixels, OCR_TILE_SIZE, OCR_TILE_OVERLAP, OCR_TILE_MAX_WIDTH],
+            "lang": DEFAULT_TESSERACT_LANG,
+            "tesseract_config": TESSERACT_CONFIG,
+            "preprocess": OCR_PREPROCESS.spec,
+        }
 
     def preprocess(self, img):
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        return cv2.adaptiveThreshold(
-            gray, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY, 31, 12
-        )
-
-    def extract_text(self, image_path):
+        return OCR_PREPROCESS(img)
+
+    def _tesseract(self, pre):
+        # Tesseract qua engine dùng chung (worker thường trú nếu có OCR_SERVER_ADDR)
+        result = get_ocr_engine().ocr_page(
+            pre,
+            engines=("tesseract",),
+            tesseract_config=TESSERACT_CONFIG,
+            detail=True
+        )["tesseract"]
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+        return result["data"]
+
+    def tesseract_data(self, image_path):
+        """Đọc, tiền xử lý và chạy Tesseract -> dict kiểu image_to_data."""
+        # OpenCV chỉ nạp khi thật sự OCR (cache hit không cần)
+        import cv2
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Không tồn tại ảnh: {image_path}")
 
-        img = cv2.imread(image_path)
+        # Quyết định tile từ header (trước khi giải mã), tính cả lần upscale 2x
+        tiled = False
+        size = image_size(image_path) if self.tile_max_pixels else None
+        if size:
+            width, height = size
+            upscale = height < 800 or width < 800
+            tiled = width * height * (4 if upscale else 1) > self.tile_max_pixels
+
+        # Ảnh lớn: đọc thẳng ảnh xám nếu pipeline bắt đầu bằng gray (1 byte/pixel)
+        flags = cv2.IMREAD_COLOR
+        if tiled and OCR_PREPROCESS.steps and OCR_PREPROCESS.steps[0][0] == "gray":
+            flags = cv2.IMREAD_GRAYSCALE
+        with metrics.span("decode"):
+            img = cv2.imread(image_path, flags)
         if img is None:
             raise ValueError(f"Không thể đọc ảnh: {image_path}")
 
-        # Resize nếu ảnh nhỏ
-        if img.shape[0] < 800 or img.shape[1] < 800:
+        # Resize nếu ảnh nhỏ (khi tile thì resize từng tile)
+        upscale = img.shape[0] < 800 or img.shape[1] < 800
+        if tiled:
+            return self.tiled_data(img, upscale)
+        if upscale:
             img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
 
-        pre = self.preprocess(img)
-
-        data = pytesseract.image_to_data(
-            Image.fromarray(pre),
-            lang="vie+eng",
-            config="--psm 6 --oem 1",
-            output_type=pytesseract.Output.DICT
-        )
-
-        segments, weighted_sum, total_weight = [], 0, 0
-        for i in range(len(data['text'])):
-            word = data['text'][i].strip()
-            conf = float(data['conf'][i]) if data['conf'][i] != "-1" else 0
-            if not word or conf < self.min_conf:
-                continue
-
-            weight = len(word)
-            weighted_sum += conf * weight
-            total_weight += weight
-
-            bbox = {
-                "x": int(data['left'][i]),
-                "y": int(data['top'][i]),
-                "w": int(data['width'][i]),
-                "h": int(data['height'][i]),
-            }
-
-            segments.append({
-                "text": word,
-                "confidence": round(conf, 2),
-                "bbox": bbox
-            })
-
-        avg_conf = weighted_sum / total_weight if total_weight > 0 else 0
-        text_full = " ".join([seg["text"] for seg in segments])
+        return self._tesseract(self.preprocess(img))
+
+    def _ocr_tile(self, img, upscale, tile, core, tile_index):
+        import numpy as np
+        import cv2
+        y0, y1, x0, x1 = tile
+        with metrics.span("tile", tile=tile_index):
+            # Copy: pipeline ghi đè tại chỗ, không được sửa vùng chồng lấn của tile bên cạnh
+            crop = img[y0:y1, x0:x1].copy()
+            if upscale:
+                crop = cv2.resize(crop, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+            pre = self.preprocess(crop)
+            del crop
+            scale = pre.shape[0] / (y1 - y0)
+            data = self._tesseract(pre)
+        metrics.count("tiles")
+
+        words = [i for i, word in enumerate(data["text"]) if str(word).strip()]
+        left = np.asarray(data["left"], dtype=np.float64)[words] + x0 * scale
+        top = np.asarray(data["top"], dtype=np.float64)[words] + y0 * scale
+        cx = left + np.asarray(data["width"], dtype=np.float64)[words] / 2
+        cy = top + np.asarray(data["height"], dtype=np.float64)[words] / 2
+        cy0, cy1, cx0, cx1 = (c * scale for c in core)
+        # Mỗi vị trí thuộc đúng một tile: giữ từ có tâm nằm trong core của tile này
+        owned = (cx >= cx0) & (cx < cx1) & (cy >= cy0) & (cy < cy1)
+
+        out = {column: [] for column in TILE_COLUMNS}
+        for k in np.flatnonzero(owned):
+            i = words[k]
+            # block_num theo tile để nhóm dòng/đoạn không trộn giữa các tile
+            out["block_num"].append(tile_index * 10000 + int(data["block_num"][i]))
+            out["par_num"].append(int(data["par_num"][i]))
+            out["line_num"].append(int(data["line_num"][i]))
+            out["left"].append(int(round(left[k])))
+            out["top"].append(int(round(top[k])))
+            out["width"].append(int(data["width"][i]))
+            out["height"].append(int(data["height"][i]))
+            out["conf"].append(float(data["conf"][i]))
+            out["text"].append(data["text"][i])
+        return out, scale
+
+    def tiled_data(self, img, upscale):
+        """
+        OCR ảnh lớn theo các dải chồng lấn (song song), ghép thành một dict kiểu
+        image_to_data với bbox theo toạ độ của ảnh nguyên (như khi không tile).
+        img là ảnh gốc đã giải mã nguyên; từng dải được cắt, upscale và tiền xử lý
+        riêng nên chỉ tối đa tile_workers dải có buffer làm việc cùng lúc.
+        """
+        tiles = plan_tiles(img.shape[0], img.shape[1])
+        print(f"[OCR] Tiling {img.shape[1]}x{img.shape[0]} into {len(tiles)} tiles", file=sys.stderr)
+
+        # bind: tile chạy trên thread pool vẫn ghi vào recorder của ảnh này
+        @metrics.bind
+        def run(item):
+            index, (tile, core) = item
+            return self._ocr_tile(img, upscale, tile, core, index)
+
+        workers = max(1, min(self.tile_workers or os.cpu_count() or 1, len(tiles)))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                parts = list(executor.map(run, enumerate(tiles)))
+        else:
+            parts = [run(item) for item in enumerate(tiles)]
+
+        data = {column: [] for column in TILE_COLUMNS}
+        for part, _ in parts:
+            for column in TILE_COLUMNS:
+                data[column].extend(part[column])
+
+        scale = parts[0][1] if parts else 1
+        cuts_y = sorted({core[0] * scale for _, core in tiles if core[0] > 0})
+        return dedup_seam_words(data, [], cuts_y)
+
+    def analyze(self, image_path):
+        """
+        OCR một ảnh -> {"text", "confidence", "segments", "language", "layout"}.
+
+        Lọc từ và tính confidence trên mảng NumPy của cả trang. Ở layout mode,
+        từ được nhóm theo (block_num, par_num, line_num) của Tesseract thành
+        dòng -> đoạn -> khối, kèm bbox, confidence (trung bình theo số ký tự)
+        và thứ tự đọc; text là các dòng nối bằng xuống dòng, các đoạn cách
+        nhau một dòng trống.
+        """
+        import numpy as np
+        data = self.tesseract_data(image_path)
+
+        words = [str(w).strip() for w in data["text"]]
+        n_chars = np.fromiter((len(w) for w in words), dtype=np.int64, count=len(words))
+        conf = np.asarray(data["conf"], dtype=np.float64)
+        conf[conf == -1] = 0
+        keep = np.flatnonzero((n_chars > 0) & (conf >= self.min_conf))
+
+        words = [words[i] for i in keep]
+        n_chars, conf = n_chars[keep], conf[keep]
+        left, top, width, height = (np.asarray(data[k], dtype=np.int64)[keep] for k in ("left", "top", "width", "height"))
+
+        segments = [
+            {"text": word, "confidence": c, "bbox": {"x": x, "y": y, "w": w, "h": h}}
+            for word, c, x, y, w, h in zip(
+                words, np.round(conf, 2).tolist(),
+                left.tolist(), top.tolist(), width.tolist(), height.tolist()
+            )
+        ]
+
+        weighted = conf * n_chars
+        total_weight = int(n_chars.sum())
+        avg_conf = float(weighted.sum()) / total_weight if total_weight > 0 else 0
+
+        layout = None
+        if self.layout:
+            with metrics.span("layout"):
+                layout = self._layout(data, keep, words, left, top, left + width, top + height, weighted, n_chars)
+            paragraphs = [p["text"] for b in layout["blocks"] for p in b["paragraphs"]]
+            text_full = "\n\n".join(paragraphs)
+        else:
+            text_full = " ".join(words)
 
         # Detect language từ text_full
         detected_lang = None
         try:
             if text_full.strip():
-                detected_lang = detect(text_full)  # "vi", "en", "fr"...
+                detected_lang = detect_code(text_full)  # "vi", "en", "fr"...
         except Exception:
             detected_lang = None
 
-        return text_full.strip(), round(avg_conf, 2), segments, detected_lang
+        return {
+            "text": text_full.strip(),
+            "confidence": round(avg_conf, 2),
+            "segments": segments,
+            "language": detected_lang,
+            "layout": layout,
+        }
+
+    def _layout(self, data, keep, words, x0, y0, x1, y1, weighted, n_chars):
+        import numpy as np
+        if not len(keep):
+            return {"blocks": [], "lines_count": 0, "paragraphs_count": 0}
+        block, par, line = (np.asarray(data[k], dtype=np.int64)[keep] for k in ("block_num", "par_num", "line_num"))
+
+        # Dòng: các từ liên tiếp cùng (block, par, line)
+        line_starts = _run_starts(block, par, line)
+        line_ends = np.append(line_starts[1:], len(words))
+        lx0, ly0, lx1, ly1, lw, ln = _reduce_groups(line_starts, x0, y0, x1, y1, weighted, n_chars)
+
+        # Đoạn: các dòng liên tiếp cùng (block, par); khối: các đoạn cùng block
+        par_starts = _run_starts(block[line_starts], par[line_starts])
+        par_ends = np.append(par_starts[1:], len(line_starts))
+        px0, py0, px1, py1, pw, pn = _reduce_groups(par_starts, lx0, ly0, lx1, ly1, lw, ln)
+        block_starts = _run_starts(block[line_starts][par_starts])
+        block_ends = np.append(block_starts[1:], len(par_starts))
+        bx0, by0, bx1, by1, bw, bn = _reduce_groups(block_starts, px0, py0, px1, py1, pw, pn)
+
+        line_conf = np.round(lw / ln, 2).tolist()
+        par_conf = np.round(pw / pn, 2).tolist()
+        block_conf = np.round(bw / bn, 2).tolist()
+
+        lines = [{
+            "order": i,
+            "text": " ".join(words[start:end]),
+            "confidence": line_conf[i],
+            "bbox": _bbox(lx0[i], ly0[i], lx1[i], ly1[i]),
+            "segments": [int(start), int(end)],  # khoảng chỉ số trong ocr_data.segments
+        } for i, (start, end) in enumerate(zip(line_starts, line_ends))]
+
+        paragraphs = [{
+            "order": j,
+            "text": "\n".join(l["text"] for l in lines[start:end]),
+            "confidence": par_conf[j],
+            "bbox": _bbox(px0[j], py0[j], px1[j], py1[j]),
+            "lines": lines[start:end],
+        } for j, (start, end) in enumerate(zip(par_starts, par_ends))]
+
+        blocks = [{
+            "order": k,
+            "confidence": block_conf[k],
+            "bbox": _bbox(bx0[k], by0[k], bx1[k], by1[k]),
+            "paragraphs": paragraphs[start:end],
+        } for k, (start, end) in enumerate(zip(block_starts, block_ends))]
+
+        return {"blocks": blocks, "lines_count": len(lines), "paragraphs_count": len(paragraphs)}
+
+    def extract_text(self, image_path):
+        result = self.analyze(image_path)
+        return result["text"], result["confidence"], result["segments"], result["language"]
 
 
-def build_document(path, text, conf, segs, detected_lang=None, error=None):
+def build_document(path, text, conf, segs, detected_lang=None, error=None, layout=None):
     """Mapping dữ liệu OCR -> schema 'inputs'"""
     stat = os.stat(path)
+    paragraphs = [p["text"] for b in layout["blocks"] for p in b["paragraphs"]] if layout else []
 
     # Map langdetect -> chuẩn code kiểu vi-VN
-    lang_map = {
-        "vi": "vi-VN",
-        "en": "en-US",
-        "fr": "fr-FR",
-        "de": "de-DE",
-    }
-    language_code = lang_map.get(detected_lang, detected_lang or "und")
+    language_code = normalize_lang(detected_lang, "und")
 
     return {
         "type": "image",
@@ -124,11 +434,12 @@ def build_document(path, text, conf, segs, detected_lang=None, error=None):
         "mime_type": "image/" + os.path.splitext(path)[1][1:],
 
         "raw_text": text,
-        "paragraphs": [],
+        "paragraphs": paragraphs,
         "tables": [],
 
         "ocr_data": {
             "segments": segs,
+            "layout": layout,
             "error": error
         },
 
@@ -137,7 +448,7 @@ def build_document(path, text, conf, segs, detected_lang=None, error=None):
             "pages": 1,
             "file_size": stat.st_size,
             "is_scanned": True,
-            "paragraphs_count": 0,
+            "paragraphs_count": len(paragraphs),
             "tables_count": 0,
         },
 
@@ -151,23 +462,92 @@ def build_document(path, text, conf, segs, detected_lang=None, error=None):
     }
 
 
-def handle_cli():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('images', nargs='+')
-    args = parser.parse_args()
-
-    ocr = ImageOCR()
-    results = []
-
-    for path in args.images:
+def process_image(ocr, path, use_cache=True):
+    """OCR một ảnh -> (document theo schema 'inputs', cache hit)."""
+    hit = False
+    with metrics.recording() as recorder:
         try:
-            text, conf, segs, detected_lang = ocr.extract_text(path)
-            doc = build_document(path, text, conf, segs, detected_lang, error=None)
+            if not use_cache:
+                output = ocr.analyze(path)
+            else:
+                # Cache theo nội dung ảnh; build_document luôn chạy lại để lấy path/stat hiện tại
+                output, hit = get_cache().get_or_compute(
+                    "image", path, ocr.cache_config(),
+                    lambda: ocr.analyze(path)
+                )
+            doc = build_document(
+                path, output["text"], output["confidence"], output["segments"],
+                output["language"], error=None, layout=output["layout"]
+            )
         except Exception as e:
             doc = build_document(path, "", 0, [], None, error=str(e))
-        results.append(doc)
+    if metrics.METRICS_ENABLED:
+        doc["metrics"] = recorder.to_dict()
+    return doc, hit
+
+
+def process_images(ocr, paths, workers=1, use_cache=True):
+    """
+    Sinh (document, cache hit) theo đúng thứ tự `paths`. Với workers > 1 các ảnh
+    được OCR đồng thời trên thread pool: cv2 và Tesseract (tesserocr hoặc
+    subprocess của pytesseract) đều chạy ngoài GIL.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield process_image(ocr, path, use_cache)
+        return
+
+    # Tesseract tự dùng OpenMP; mỗi ảnh một thread để không tranh CPU giữa các worker
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    # Khởi tạo trước khi vào thread: engine dùng chung và profile langdetect
+    get_ocr_engine()
+    load_profiles()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(lambda path: process_image(ocr, path, use_cache), paths)
 
-    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+def handle_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', nargs='+')
+    parser.add_argument('--no-cache', action='store_true', help='Bỏ qua cache kết quả')
+    parser.add_argument('--stream', action='store_true',
+                        help='In mỗi ảnh một dòng JSON ngay khi xong (NDJSON) thay vì một mảng cuối cùng')
+    parser.add_argument('--layout', action='store_true', default=OCR_LAYOUT,
+                        help='Nhóm từ thành dòng/đoạn/khối, điền paragraphs và ocr_data.layout')
+    parser.add_argument('--workers', type=int, default=OCR_WORKERS,
+                        help='Số ảnh OCR đồng thời (mặc định OCR_WORKERS, 0 = theo số CPU)')
+    parser.add_argument('--metrics', action='store_true', default=None,
+                        help='Gắn thời gian/bộ nhớ từng bước vào metrics của mỗi ảnh (mặc định EXTRACTION_METRICS)')
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help='Ghi các span ra file Chrome trace (mặc định EXTRACTION_TRACE)')
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.trace)
+
+    workers = args.workers or os.cpu_count() or 1
+    workers = min(workers, len(args.images))
+
+    # Chạy nhiều ảnh song song thì mỗi ảnh lớn chỉ dùng phần CPU còn lại cho tile
+    ocr = ImageOCR(layout=args.layout, tile_workers=max(1, (os.cpu_count() or 1) // workers))
+    writer = ResultWriter(stream=args.stream, indent=2)
+
+    started = time.perf_counter()
+    hits = failed = 0
+    for doc, hit in process_images(ocr, args.images, workers=workers, use_cache=not args.no_cache):
+        hits += hit
+        failed += doc["processing_status"] == "failed"
+        writer.write(doc)
+
+    writer.close()
+    metrics.write_trace()
+
+    elapsed = time.perf_counter() - started
+    # Không tạo engine chỉ để in (mọi ảnh cache hit thì chưa có engine)
+    engine = current_ocr_engine()
+    print(f"[OCR] {len(args.images)} images in {elapsed:.2f}s = "
+          f"{len(args.images) / max(elapsed, 1e-6):.2f} images/s "
+          f"(workers={workers}, cache_hits={hits}, failed={failed}, "
+          f"tesseract={engine.tesseract_backend if engine else 'unused'})", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -2,45 +2,25 @@ import sys
 import fitz  # PyMuPDF
 import io
 import os
-import json
-from PIL import Image, ImageEnhance, ImageFilter
-import pytesseract
-import easyocr
-import numpy as np
+import argparse
+import math
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from langdetect import detect, DetectorFactory
 from datetime import datetime
 
-# =========================
-# Setup Tesseract (Windows)
-# =========================
-def setup_tesseract():
-    if os.name == 'nt':  # Windows
-        manual_path = os.getenv("TESSERACT_CMD")
-        if manual_path and os.path.exists(manual_path):
-            pytesseract.pytesseract.tesseract_cmd = manual_path
-            print(f"[DEBUG] Using Tesseract from TESSERACT_CMD: {manual_path}", file=sys.stderr)
-            return True
-
-        username = os.getenv("USERNAME")
-        common_paths = [
-            r"F:\Tesseract-OCR\tesseract.exe",
-            fr"C:\Users\{username}\AppData\Local\Tesseract-OCR\tesseract.exe",
-            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-        ]
+# Shared modules (OCR engine...) nằm ở command-ingress/shared/pythonScript.
+# numpy/OpenCV/Tesseract/EasyOCR chỉ được nạp khi có trang cần OCR.
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "..", "..", "shared", "pythonScript"))
 
-        for path in common_paths:
-            if os.path.exists(path):
-                pytesseract.pytesseract.tesseract_cmd = path
-                print(f"[DEBUG] Using Tesseract at: {path}", file=sys.stderr)
-                return True
-
-        print("[WARNING] Tesseract not found, OCR may not work properly", file=sys.stderr)
-        return False
-    return True
-
-setup_tesseract()
+from ocr_engine import get_ocr_engine, reset_ocr_engine, DEFAULT_TESSERACT_CONFIG
+from result_cache import get_cache, bytes_sha256, make_key
+from image_preprocess import PreprocessPipeline, PDF_PIPELINE
+from cli_output import ResultWriter
+from lang_detect import detect_language
+import metrics
 
 # =========================
 # Unicode stdout/stderr
@@ -49,34 +29,107 @@ sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding="utf-8")
 
 # =========================
-# Env + langdetect
+# Env
 # =========================
 load_dotenv()
-DetectorFactory.seed = 0
-
-# Mapping ISO-639-1 -> locale phổ biến
-LANG_MAP = {
-    "vi": "vi-VN",
-    "en": "en-US",
-    "fr": "fr-FR",
-    "de": "de-DE",
-    "es": "es-ES",
-    "it": "it-IT",
-    "pt": "pt-PT",
-    "ru": "ru-RU",
-    "ja": "ja-JP",
-    "ko": "ko-KR",
-    "zh-cn": "zh-CN",
-    "zh-tw": "zh-TW",
-}
 
-def normalize_lang(lang_code: str) -> str:
-    return LANG_MAP.get(lang_code.lower(), lang_code)
+# =========================
+# OCR config (scanned PDF)
+# =========================
+# Tăng khi logic trích xuất thay đổi để cache không trả kết quả cũ
+EXTRACTOR_VERSION = "9"
+OCR_ENGINES = ("easyocr", "tesseract")
+# both: chạy cả EasyOCR và Tesseract trên mọi trang (hành vi cũ)
+# cascade: Tesseract trước, chỉ chạy EasyOCR cho dòng/trang có confidence thấp
+PDF_OCR_MODE = os.getenv("PDF_OCR_MODE", "both")
+OCR_MODES = ("both", "cascade")
+CASCADE_LINE_CONF = float(os.getenv("PDF_OCR_CASCADE_LINE_CONF", "60"))
+CASCADE_PAGE_CONF = float(os.getenv("PDF_OCR_CASCADE_PAGE_CONF", "40"))
+CASCADE_REGION_PAD = 8
+# Tốc độ EasyOCR (ms / megapixel) dùng ước lượng khi tài liệu không có vùng nào chạy EasyOCR;
+# đo lại trên máy chủ bằng PDF_OCR_MODE=both và chỉnh theo easyocr_ms / pixels
+CASCADE_EASYOCR_MS_PER_MPX = float(os.getenv("PDF_OCR_EASYOCR_MS_PER_MPX", "1500"))
+OCR_DPI = 400
+# fixed: luôn render OCR_DPI rồi phóng 2x (hành vi cũ)
+# adaptive: đo cỡ chữ trên bản render dpi thấp, chọn dpi nhỏ nhất đạt x-height mục tiêu
+PDF_OCR_DPI_MODE = os.getenv("PDF_OCR_DPI_MODE", "fixed")
+DPI_MODES = ("fixed", "adaptive")
+PROBE_DPI = 100
+TARGET_XHEIGHT_PX = int(os.getenv("PDF_OCR_TARGET_XHEIGHT", "20"))
+MIN_OCR_DPI = int(os.getenv("PDF_OCR_MIN_DPI", "150"))
+# Chuỗi bước tiền xử lý (xem shared/pythonScript/image_preprocess.py)
+PDF_PREPROCESS = PreprocessPipeline.parse(os.getenv("PDF_PREPROCESS_PIPELINE", PDF_PIPELINE))
+# workers <= 1: OCR tuần tự trong process hiện tại; 0: dùng tất cả CPU
+PDF_OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", "1"))
+PDF_OCR_CHUNK_SIZE = int(os.getenv("PDF_OCR_CHUNK_SIZE", "4"))
+# fail_fast: dừng ở trang lỗi đầu tiên (hành vi cũ); collect: ghi lỗi từng trang vào metadata
+PDF_OCR_ON_ERROR = os.getenv("PDF_OCR_ON_ERROR", "fail_fast")
+ON_ERROR_MODES = ("fail_fast", "collect")
+# Số trang đọc text layer giữa hai lần xả bộ nhớ đệm (font, ảnh) của MuPDF
+STORE_SHRINK_EVERY = 64
+# Dùng lại kết quả OCR của trang đã gặp (cùng fingerprint + cấu hình OCR), kể cả ở file khác
+PDF_PAGE_CACHE = os.getenv("PDF_PAGE_CACHE", "1").lower() not in ("0", "false", "off", "no")
+PAGE_CACHE_NAMESPACE = "pdf-page"
+# content: hash content stream + ảnh/XObject (không giải mã ảnh);
+# thumbnail: hash bản render xám dpi thấp (chịu được file bị ghi lại với stream khác)
+PDF_PAGE_FINGERPRINT = os.getenv("PDF_PAGE_FINGERPRINT", "content")
+FINGERPRINT_MODES = ("content", "thumbnail")
+THUMBNAIL_DPI = 36
 
 # =========================
-# Init EasyOCR reader
+# Open PDF / chọn trang
 # =========================
-easyocr_reader = easyocr.Reader(["vi", "en"], gpu=False)
+def open_pdf(pdf_path: str, data: bytes = None):
+    """
+    Mở từ đường dẫn (MuPDF đọc file theo nhu cầu, không nạp cả file vào RAM)
+    hoặc từ bytes trong bộ nhớ (stdin).
+    """
+    if data is not None:
+        return fitz.open(stream=data, filetype="pdf")
+    return fitz.open(pdf_path)
+
+def release_page_cache():
+    """Xả bộ nhớ đệm tài nguyên của MuPDF (font, ảnh đã giải mã) giữa các trang."""
+    fitz.TOOLS.store_shrink(100)
+
+def parse_page_spec(spec: str) -> list:
+    """
+    "1-20,25,40-" -> [(1, 20), (25, 25), (40, None)] (đánh số từ 1, None = hết
+    tài liệu). Rỗng/None -> mọi trang.
+    """
+    if not spec:
+        return []
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start = int(start) if start.strip() else 1
+                end = int(end) if end.strip() else None
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page range {part!r} in {spec!r}")
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"Invalid page range {part!r} in {spec!r}")
+        ranges.append((start, end))
+    return ranges
+
+def select_pages(page_count: int, ranges: list = None, max_pages: int = None) -> list:
+    """Chỉ số trang (từ 0, tăng dần, không trùng) theo ranges, giữ tối đa max_pages trang đầu."""
+    if ranges:
+        selected = set()
+        for start, end in ranges:
+            selected.update(range(start - 1, min(end or page_count, page_count)))
+        indexes = sorted(selected)
+    else:
+        indexes = list(range(page_count))
+    if max_pages:
+        indexes = indexes[:max_pages]
+    return indexes
 
 # =========================
 # Parse PDF datetime
@@ -100,54 +153,438 @@ def parse_pdf_date(pdf_date: str):
 # =========================
 # Preprocess image
 # =========================
-def preprocess_image(image: Image.Image) -> Image.Image:
-    image = image.convert("L")
-    image = image.resize((image.width * 2, image.height * 2), Image.LANCZOS)
-    image = ImageEnhance.Contrast(image).enhance(3.0)
-    image = ImageEnhance.Sharpness(image).enhance(2.0)
-    image = image.filter(ImageFilter.MedianFilter(size=3))
-    try:
-        image = image.point(lambda x: 0 if x < 180 else 255, mode="1")
-    except Exception:
-        pass
-    return image
+def pixmap_to_gray(pix) -> "np.ndarray":
+    """Pixmap xám (csGRAY) -> mảng uint8 HxW, không qua encode/decode PNG."""
+    import numpy as np
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def preprocess_image(image: "np.ndarray", scale: int = 2) -> "np.ndarray":
+    return PDF_PREPROCESS.with_step("resize", scale)(image)
 
 # =========================
-# OCR with EasyOCR
+# OCR one page (EasyOCR + Tesseract)
 # =========================
-def ocr_with_easyocr(image: Image.Image) -> str:
-    try:
-        np_img = np.array(image)
-        result = easyocr_reader.readtext(np_img)
-        return "\n".join([line[1] for line in result])
-    except Exception as e:
-        print(f"[EasyOCR] Error: {e}", file=sys.stderr)
-        return ""
+def ocr_image(image: "np.ndarray") -> dict:
+    # EasyOCR reader dùng chung qua ocr_engine (worker thường trú nếu có OCR_SERVER_ADDR)
+    results = get_ocr_engine().ocr_page(image, engines=OCR_ENGINES)
+    text_easyocr = results["easyocr"]["text"]
+    text_tesseract = results["tesseract"]["text"]
+
+    if text_easyocr.strip() and not text_tesseract.strip():
+        chosen_text = text_easyocr
+    elif text_tesseract.strip() and not text_easyocr.strip():
+        chosen_text = text_tesseract
+    else:
+        texts = [t.strip() for t in [text_easyocr, text_tesseract] if t.strip()]
+        chosen_text = "\n".join(set(texts))
+
+    return {
+        "text": chosen_text,
+        "engine": "easyocr+tesseract",
+        "ocr_ms": {name: results[name]["ms"] for name in OCR_ENGINES},
+    }
 
 # =========================
-# OCR with Tesseract
+# OCR cascade (Tesseract -> EasyOCR theo confidence)
 # =========================
-def ocr_with_tesseract(image: Image.Image) -> str:
-    try:
-        config = "--oem 3 --psm 6"
-        return pytesseract.image_to_string(image, lang="vie+eng", config=config)
-    except Exception as e:
-        print(f"[Tesseract] Error: {e}", file=sys.stderr)
-        return ""
+def tesseract_lines(data: dict) -> list:
+    """Gom từ của image_to_data thành dòng: text, confidence (0-100, theo độ dài từ), bbox."""
+    lines = {}
+    for i, word in enumerate(data.get("text", [])):
+        word = str(word).strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        x0, y0 = int(data["left"][i]), int(data["top"][i])
+        x1, y1 = x0 + int(data["width"][i]), y0 + int(data["height"][i])
+        line = lines.setdefault(key, {"words": [], "weighted": 0.0, "weight": 0, "box": [x0, y0, x1, y1]})
+        line["words"].append(word)
+        line["weighted"] += conf * len(word)
+        line["weight"] += len(word)
+        box = line["box"]
+        line["box"] = [min(box[0], x0), min(box[1], y0), max(box[2], x1), max(box[3], y1)]
+
+    return [{
+        "text": " ".join(line["words"]),
+        "confidence": line["weighted"] / line["weight"],
+        "weight": line["weight"],
+        "bbox": {"x": line["box"][0], "y": line["box"][1],
+                 "w": line["box"][2] - line["box"][0], "h": line["box"][3] - line["box"][1]},
+    } for line in lines.values()]
+
+def _bbox_overlap(a: dict, b: dict) -> float:
+    """Diện tích giao / diện tích bbox nhỏ hơn."""
+    ix = max(0, min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"]))
+    iy = max(0, min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"]))
+    smaller = min(a["w"] * a["h"], b["w"] * b["h"])
+    return (ix * iy) / smaller if smaller > 0 else 0.0
+
+def merge_lines_by_position(lines: list) -> str:
+    """Sắp xếp dòng theo vị trí: gom các dòng cùng hàng (tâm dọc gần nhau), trái sang phải."""
+    rows = []
+    for line in sorted(lines, key=lambda l: (l["bbox"]["y"] + l["bbox"]["h"] / 2, l["bbox"]["x"])):
+        center = line["bbox"]["y"] + line["bbox"]["h"] / 2
+        if rows and abs(center - rows[-1]["center"]) <= max(4, min(line["bbox"]["h"], rows[-1]["h"]) / 2):
+            rows[-1]["items"].append(line)
+        else:
+            rows.append({"center": center, "h": line["bbox"]["h"], "items": [line]})
+    return "\n".join(
+        " ".join(item["text"] for item in sorted(row["items"], key=lambda l: l["bbox"]["x"]))
+        for row in rows
+    )
+
+def _easyocr_lines(result: dict, dx: int = 0, dy: int = 0) -> list:
+    return [{
+        "text": line["text"],
+        "confidence": line["confidence"] * 100,
+        "bbox": {**line["bbox"], "x": line["bbox"]["x"] + dx, "y": line["bbox"]["y"] + dy},
+    } for line in result.get("lines", []) if line["text"].strip()]
+
+def ocr_image_cascade(image: "np.ndarray") -> dict:
+    engine = get_ocr_engine()
+    height, width = image.shape[:2]
+
+    tesseract = engine.ocr_page(image, engines=("tesseract",), detail=True)["tesseract"]
+    ocr_ms = {"tesseract": tesseract["ms"], "easyocr": 0.0}
+    lines = tesseract_lines(tesseract.get("data") or {})
+    total_weight = sum(line["weight"] for line in lines)
+    page_conf = sum(line["confidence"] * line["weight"] for line in lines) / total_weight if total_weight else 0.0
+
+    regions, easyocr_pixels = 0, 0
+    if page_conf < CASCADE_PAGE_CONF:
+        # Cả trang kém: EasyOCR toàn trang, giữ dòng Tesseract tốt không trùng vị trí
+        easy = engine.ocr_page(image, engines=("easyocr",))["easyocr"]
+        ocr_ms["easyocr"] += easy["ms"]
+        easyocr_pixels = height * width
+        easy_lines = _easyocr_lines(easy)
+        kept = [
+            line for line in lines
+            if line["confidence"] >= CASCADE_LINE_CONF
+            and not any(_bbox_overlap(line["bbox"], e["bbox"]) > 0.5 for e in easy_lines)
+        ]
+        final = kept + easy_lines
+        used = "easyocr" if easy_lines else "tesseract"
+    else:
+        # Chỉ OCR lại các vùng dòng có confidence thấp
+        final = []
+        for line in lines:
+            if line["confidence"] >= CASCADE_LINE_CONF:
+                final.append(line)
+                continue
+            box = line["bbox"]
+            x0, y0 = max(0, box["x"] - CASCADE_REGION_PAD), max(0, box["y"] - CASCADE_REGION_PAD)
+            x1 = min(width, box["x"] + box["w"] + CASCADE_REGION_PAD)
+            y1 = min(height, box["y"] + box["h"] + CASCADE_REGION_PAD)
+            easy = engine.ocr_page(image[y0:y1, x0:x1], engines=("easyocr",))["easyocr"]
+            ocr_ms["easyocr"] += easy["ms"]
+            easyocr_pixels += (y1 - y0) * (x1 - x0)
+            regions += 1
+            easy_lines = _easyocr_lines(easy, x0, y0)
+            final.extend(easy_lines or [line])
+        used = "tesseract+easyocr" if regions else "tesseract"
+
+    return {
+        "text": merge_lines_by_position(final),
+        "engine": used,
+        "ocr_ms": ocr_ms,
+        "easyocr_regions": regions,
+        "easyocr_pixels": easyocr_pixels,
+        "pixels": height * width,
+    }
+
+def cascade_summary(page_ocrs: list) -> dict:
+    """
+    Thống kê engine theo trang và thời gian EasyOCR ước tính đã tiết kiệm so với
+    chạy EasyOCR toàn bộ các trang. Tốc độ ms/pixel lấy từ các vùng EasyOCR đã chạy
+    trong tài liệu này ("measured"); nếu EasyOCR không chạy lần nào (mọi trang
+    Tesseract đều đạt) thì dùng CASCADE_EASYOCR_MS_PER_MPX ("configured").
+    """
+    engines = {}
+    for item in page_ocrs:
+        engines[item["engine"]] = engines.get(item["engine"], 0) + 1
+    easyocr_ms = sum(item["ocr_ms"]["easyocr"] for item in page_ocrs)
+    easyocr_pixels = sum(item["easyocr_pixels"] for item in page_ocrs)
+    total_pixels = sum(item["pixels"] for item in page_ocrs)
+
+    if easyocr_pixels:
+        ms_per_pixel, basis = easyocr_ms / easyocr_pixels, "measured"
+    else:
+        ms_per_pixel, basis = CASCADE_EASYOCR_MS_PER_MPX / 1_000_000, "configured"
+    saved = round(max(0.0, ms_per_pixel * total_pixels - easyocr_ms), 1)
+    return {
+        "pages_by_engine": engines,
+        "tesseract_ms": round(sum(item["ocr_ms"]["tesseract"] for item in page_ocrs), 1),
+        "easyocr_ms": round(easyocr_ms, 1),
+        "easyocr_regions": sum(item["easyocr_regions"] for item in page_ocrs),
+        "estimated_easyocr_saved_ms": saved,
+        "estimate_basis": basis,
+    }
 
 # =========================
 # Check if PDF has text
 # =========================
-def has_real_text(text: str) -> bool:
+def has_real_text(text: str, min_chars: int = 50) -> bool:
     extracted = "".join(ch for ch in text if ch.isalnum())
-    return len(extracted) > 50
+    return len(extracted) > min_chars
+
+# Trang có ít hơn ngưỡng này ký tự chữ/số coi như không có text layer
+PAGE_TEXT_MIN_CHARS = int(os.getenv("PDF_PAGE_TEXT_MIN_CHARS", "20"))
+
+def page_needs_ocr(page_text: str, doc_has_text: bool, has_images: bool) -> bool:
+    """
+    Phân loại từng trang: chỉ OCR trang thiếu text layer.
+    Trong PDF có text, trang ít chữ chỉ được OCR nếu có ảnh (trang scan chèn vào);
+    trang trắng / trang bìa vector vẫn giữ nguyên text.
+    """
+    if has_real_text(page_text, PAGE_TEXT_MIN_CHARS):
+        return False
+    if not doc_has_text:
+        return True
+    return has_images
+
+# =========================
+# Page fingerprint (dùng lại OCR của trang không đổi)
+# =========================
+def page_fingerprint(doc, page, mode: str = None) -> str:
+    """
+    sha256 nội dung một trang: kích thước, góc xoay và content stream cùng
+    stream thô + khai báo của mọi ảnh/Form XObject (mode "content"), hoặc
+    pixel bản render THUMBNAIL_DPI (mode "thumbnail").
+    """
+    digest = hashlib.sha256(f"{tuple(page.rect)}|{page.rotation}".encode())
+    if (mode or PDF_PAGE_FINGERPRINT) == "thumbnail":
+        pix = page.get_pixmap(dpi=THUMBNAIL_DPI, colorspace=fitz.csGRAY)
+        digest.update(pix.samples)
+        return digest.hexdigest()
+
+    digest.update(page.read_contents())
+    xrefs = {img[0] for img in page.get_images(full=True)} | {x[0] for x in page.get_xobjects()}
+    for xref in sorted(xrefs):
+        digest.update(doc.xref_object(xref, compressed=True).encode())
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    return digest.hexdigest()
+
+def find_reused_pages(doc, page_indexes: list, config: dict, page_ms: dict) -> tuple:
+    """
+    ({page_index: cache key}, {page_index: page_ocr đã lưu}) cho các trang cần
+    OCR. Thời gian tính fingerprint được cộng vào page_ms của trang.
+    """
+    cache = get_cache()
+    keys, found = {}, {}
+    for i in page_indexes:
+        started = time.perf_counter()
+        with metrics.span("fingerprint", page=i + 1):
+            page = doc[i]
+            keys[i] = make_key(PAGE_CACHE_NAMESPACE, page_fingerprint(doc, page), config)
+            del page
+        cached = cache.get(PAGE_CACHE_NAMESPACE, keys[i])
+        if cached is not None:
+            found[i] = cached
+        page_ms[i] += (time.perf_counter() - started) * 1000
+    return keys, found
+
+# =========================
+# OCR pages (sequential / process pool)
+# =========================
+def estimate_xheight(page, probe_dpi: int = PROBE_DPI):
+    """
+    Ước lượng x-height (px ở probe_dpi) từ bản render xám dpi thấp:
+    các dải hàng liên tiếp có mực là dòng chữ, x-height ~ 0.5 chiều cao dòng.
+    Trả về None nếu không tìm thấy dòng chữ nào.
+    """
+    import numpy as np
+    with metrics.span("xheight_probe"):
+        pix = page.get_pixmap(dpi=probe_dpi, colorspace=fitz.csGRAY)
+        gray = pixmap_to_gray(pix)
+        width = pix.width
+        del pix
+        ink_rows = (gray < 128).sum(axis=1) > max(2, width // 200)
+
+    # Độ dài các dải hàng có mực (run-length trên mảng bool)
+    edges = np.diff(np.concatenate(([0], ink_rows.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    heights = ends - starts
+    heights = heights[heights >= 2]
+    if heights.size == 0:
+        return None
+    return float(np.median(heights)) * 0.5
+
+def choose_render_dpi(page, dpi_mode: str):
+    """Trả về (dpi render, hệ số phóng trong preprocess_image)."""
+    if dpi_mode != "adaptive":
+        return OCR_DPI, 2
+
+    xheight = estimate_xheight(page)
+    if not xheight:
+        return OCR_DPI, 2
+
+    needed = PROBE_DPI * TARGET_XHEIGHT_PX / xheight
+    if needed > OCR_DPI:
+        # Chữ quá nhỏ: render tối đa rồi mới phóng 2x như cũ
+        return OCR_DPI, 2
+    # Làm tròn lên bội số 25 dpi để kết quả ổn định giữa các trang
+    dpi = max(MIN_OCR_DPI, int(math.ceil(needed / 25.0)) * 25)
+    return min(dpi, OCR_DPI), 1
+
+def ocr_pdf_page(page, page_index: int, page_count: int, ocr_options: dict) -> dict:
+    print(f"[DEBUG] Processing page {page_index+1}/{page_count}", file=sys.stderr)
+    started = time.perf_counter()
+    with metrics.span("ocr_page", page=page_index + 1):
+        dpi, scale = choose_render_dpi(page, ocr_options["dpi_mode"])
+        with metrics.span("render", dpi=dpi):
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            image = pixmap_to_gray(pix)
+            del pix
+        image = preprocess_image(image, scale=scale)
+
+        if ocr_options["ocr_mode"] == "cascade":
+            page_ocr = ocr_image_cascade(image)
+        else:
+            page_ocr = ocr_image(image)
+    metrics.count("pages_ocr")
+    page_ocr.update({"dpi": dpi, "scale": scale, "ms": round((time.perf_counter() - started) * 1000, 1)})
+    print(f"[DEBUG] Page {page_index+1}: {len(page_ocr['text'])} chars "
+          f"(dpi={dpi}, scale={scale}, engine={page_ocr['engine']})", file=sys.stderr)
+    return page_ocr
+
+# PDF đọc từ stdin: bytes được gửi cho mỗi worker một lần qua initializer
+_worker_pdf_data = None
+
+def _init_ocr_worker(threads: int, data: bytes = None):
+    global _worker_pdf_data
+    # Tránh oversubscription: mỗi worker chỉ dùng phần CPU của nó (torch/EasyOCR + Tesseract)
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["OMP_THREAD_LIMIT"] = str(threads)
+    _worker_pdf_data = data
+    # Pool fork: engine / kết nối OCR server kế thừa từ process cha không dùng chung được
+    reset_ocr_engine()
+
+def _ocr_page_list(doc, page_indexes: list, fail_fast: bool, ocr_options: dict, on_result=None) -> list:
+    results = []
+    for i in page_indexes:
+        page = doc[i]
+        try:
+            results.append((i, ocr_pdf_page(page, i, doc.page_count, ocr_options), None))
+        except Exception as e:
+            results.append((i, None, str(e)))
+        finally:
+            # Không giữ page / pixmap của trang đã xong
+            del page
+            release_page_cache()
+        if on_result:
+            on_result(results[-1])
+        if fail_fast and results[-1][2]:
+            break
+    return results
+
+def _ocr_page_chunk(pdf_path: str, page_indexes: list, fail_fast: bool, ocr_options: dict) -> tuple:
+    """
+    Chạy trong process con: tự mở PDF và OCR các trang của chunk.
+    Trả về (kết quả, metrics của chunk) để process cha gộp vào recorder của file.
+    """
+    enabled, trace = ocr_options.get("metrics", (False, False))
+    with metrics.recording(enabled=enabled, trace=trace) as recorder:
+        with open_pdf(pdf_path, _worker_pdf_data) as doc:
+            results = _ocr_page_list(doc, page_indexes, fail_fast, ocr_options)
+    return results, recorder.to_dict(events=True)
+
+def _terminate_pool(executor):
+    """Huỷ chunk chưa chạy và dừng ngay các worker đang OCR (không để chạy mồ côi)."""
+    terminate = getattr(executor, "terminate_workers", None)  # Python 3.14+
+    if terminate is not None:
+        terminate()
+        return
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+def ocr_pages(pdf_path: str, doc, page_indexes: list, workers: int, chunk_size: int,
+              fail_fast: bool, ocr_options: dict, on_result=None, data: bytes = None) -> list:
+    """
+    OCR các trang, trả về [(page_index, page_ocr, error)] theo đúng thứ tự trang;
+    page_ocr gồm text, engine, ocr_ms, dpi, scale. on_result được gọi cho từng
+    trang ngay khi có kết quả (với process pool: khi chunk chứa trang đó xong).
+    """
+    if workers <= 1 or len(page_indexes) <= 1:
+        return _ocr_page_list(doc, page_indexes, fail_fast, ocr_options, on_result)
+
+    chunks = [page_indexes[k:k + chunk_size] for k in range(0, len(page_indexes), chunk_size)]
+    workers = min(workers, len(chunks))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"[DEBUG] OCR {len(page_indexes)} pages with {workers} workers, chunk size {chunk_size}", file=sys.stderr)
+
+    recorder = metrics.current()
+    ocr_options = {**ocr_options, "metrics": (recorder.enabled, recorder.trace)}
+    results = []
+    stopped = False
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker, initargs=(threads, data))
+    try:
+        futures = [executor.submit(_ocr_page_chunk, pdf_path, chunk, fail_fast, ocr_options) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                chunk_results, chunk_metrics = future.result()
+                recorder.merge(chunk_metrics)
+            except Exception as e:
+                # Worker chết (BrokenProcessPool, bị OOM kill...) hoặc kết quả không pickle được:
+                # mọi trang của chunk là lỗi, các chunk khác vẫn tiếp tục (trừ fail_fast)
+                error = str(e) or type(e).__name__
+                print(f"[DEBUG] OCR chunk {chunk[0] + 1}-{chunk[-1] + 1} failed: {error}", file=sys.stderr)
+                chunk_results = [(i, None, error) for i in chunk]
+            results.extend(chunk_results)
+            if on_result:
+                for item in chunk_results:
+                    on_result(item)
+            if fail_fast and any(error for _, _, error in chunk_results):
+                # Huỷ các chunk chưa chạy và dừng các chunk đang chạy
+                _terminate_pool(executor)
+                stopped = True
+                break
+    finally:
+        if not stopped:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return sorted(results, key=lambda r: r[0])
 
 # =========================
 # Main extract function
 # =========================
-def extract_text_from_pdf(pdf_path: str) -> dict:
+def extract_text_from_pdf(pdf_path: str, workers: int = None, chunk_size: int = None, on_error: str = None,
+                          dpi_mode: str = None, ocr_mode: str = None, on_page=None,
+                          pages: str = None, max_pages: int = None, data: bytes = None,
+                          page_cache: bool = None) -> dict:
+    """
+    on_page(event) (tuỳ chọn) nhận {"page", "source", "text"[, "error"]} của từng
+    trang ngay khi trang đó xong, dùng cho chế độ --stream --stream-partial.
+    pages ("1-20,25") / max_pages giới hạn các trang được trích xuất; data: nội
+    dung PDF trong bộ nhớ thay cho đọc từ pdf_path. page_cache: dùng lại OCR
+    của trang có cùng fingerprint (mặc định PDF_PAGE_CACHE), pages_detail[].reused.
+    """
+    workers = PDF_OCR_WORKERS if workers is None else workers
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    chunk_size = max(1, chunk_size or PDF_OCR_CHUNK_SIZE)
+    on_error = on_error or PDF_OCR_ON_ERROR
+    if on_error not in ON_ERROR_MODES:
+        raise ValueError(f"on_error must be one of {ON_ERROR_MODES}, got {on_error!r}")
+    dpi_mode = dpi_mode or PDF_OCR_DPI_MODE
+    if dpi_mode not in DPI_MODES:
+        raise ValueError(f"dpi_mode must be one of {DPI_MODES}, got {dpi_mode!r}")
+    ocr_mode = ocr_mode or PDF_OCR_MODE
+    if ocr_mode not in OCR_MODES:
+        raise ValueError(f"ocr_mode must be one of {OCR_MODES}, got {ocr_mode!r}")
+    ocr_options = {"dpi_mode": dpi_mode, "ocr_mode": ocr_mode}
+    page_cache = PDF_PAGE_CACHE if page_cache is None else page_cache
+    if PDF_PAGE_FINGERPRINT not in FINGERPRINT_MODES:
+        raise ValueError(f"PDF_PAGE_FINGERPRINT must be one of {FINGERPRINT_MODES}, got {PDF_PAGE_FINGERPRINT!r}")
+    page_ranges = parse_page_spec(pages)
+    if max_pages is not None and max_pages < 1:
+        raise ValueError(f"max_pages must be >= 1, got {max_pages!r}")
+
     try:
-        doc = fitz.open(pdf_path)
+        with metrics.span("open"):
+            doc = open_pdf(pdf_path, data)
     except Exception as e:
         return {
             "text": None,
@@ -156,47 +593,117 @@ def extract_text_from_pdf(pdf_path: str) -> dict:
             "metadata": {}
         }
 
-    raw_text = ""
-    is_scanned = False
-
-    for page in doc:
-        raw_text += page.get_text("text")
-
-    if not has_real_text(raw_text):
-        is_scanned = True
-        raw_text = ""
-        print(f"[DEBUG] PDF is scanned, OCR {doc.page_count} pages", file=sys.stderr)
-
-        for i, page in enumerate(doc):
-            try:
-                print(f"[DEBUG] Processing page {i+1}/{doc.page_count}", file=sys.stderr)
-                pix = page.get_pixmap(dpi=400)
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
-                image = preprocess_image(image)
-
-                text_easyocr = ocr_with_easyocr(image)
-                text_tesseract = ocr_with_tesseract(image)
-
-                if text_easyocr.strip() and not text_tesseract.strip():
-                    chosen_text = text_easyocr
-                elif text_tesseract.strip() and not text_easyocr.strip():
-                    chosen_text = text_tesseract
-                else:
-                    texts = [t.strip() for t in [text_easyocr, text_tesseract] if t.strip()]
-                    chosen_text = "\n".join(set(texts))
-
-                print(f"[DEBUG] Page {i+1}: {len(chosen_text)} chars", file=sys.stderr)
-                raw_text += chosen_text + "\n"
-
-            except Exception as e:
-                print(f"[DEBUG] OCR error on page {i+1}: {str(e)}", file=sys.stderr)
+    page_errors = []
+    ocr_done = []
+
+    # Bước 1: một lượt qua các trang được chọn: text layer, có ảnh không, thời gian
+    selected = select_pages(doc.page_count, page_ranges, max_pages)
+    page_texts, has_images, page_ms = {}, {}, {}
+    for n, i in enumerate(selected, 1):
+        started = time.perf_counter()
+        with metrics.span("text_layer", page=i + 1):
+            page = doc[i]
+            page_texts[i] = page.get_text("text")
+            # Chỉ trang ít chữ mới cần biết có ảnh hay không (xem page_needs_ocr)
+            has_images[i] = (not has_real_text(page_texts[i], PAGE_TEXT_MIN_CHARS)
+                             and bool(page.get_images(full=True)))
+            del page
+        if n % STORE_SHRINK_EVERY == 0:
+            release_page_cache()
+        page_ms[i] = (time.perf_counter() - started) * 1000
+
+    doc_has_text = has_real_text("".join(page_texts.values()))
+    ocr_indexes = [i for i in selected if page_needs_ocr(page_texts[i], doc_has_text, has_images[i])]
+    metrics.count("pages_text", len(selected) - len(ocr_indexes))
+    pages_detail = {
+        i: {"page": i + 1, "source": "text", "chars": len(page_texts[i].strip()),
+            "extract_ms": round(page_ms[i], 1), "reused": False}
+        for i in selected
+    }
+    if on_page:
+        ocr_set = set(ocr_indexes)
+        for i in selected:
+            if i not in ocr_set:
+                on_page({"page": i + 1, "source": "text", "text": page_texts[i]})
+
+    def emit_ocr_page(item):
+        i, page_ocr, error = item
+        if error is None:
+            on_page({"page": i + 1, "source": "ocr", "text": page_ocr["text"]})
+        else:
+            on_page({"page": i + 1, "source": "ocr", "text": None, "error": error})
+
+    # Bước 2: trang thiếu text layer đã OCR trước đây (cùng fingerprint, cùng cấu hình OCR) thì dùng lại
+    page_keys, reused = {}, {}
+    if ocr_indexes and page_cache and get_cache().enabled:
+        page_config = page_cache_config(dpi_mode, ocr_mode)
+        page_keys, reused = find_reused_pages(doc, ocr_indexes, page_config, page_ms)
+        metrics.count("pages_reused", len(reused))
+        if on_page:
+            for i in sorted(reused):
+                emit_ocr_page((i, reused[i], None))
+    pending = [i for i in ocr_indexes if i not in reused]
+
+    # Bước 3: chỉ rasterise + OCR các trang thiếu text layer còn lại
+    if ocr_indexes:
+        print(f"[DEBUG] OCR {len(pending)}/{doc.page_count} pages without text layer "
+              f"({len(reused)} reused)", file=sys.stderr)
+
+        page_results = []
+        if pending:
+            page_results = ocr_pages(
+                pdf_path, doc, pending,
+                workers=workers, chunk_size=chunk_size, fail_fast=(on_error == "fail_fast"),
+                ocr_options=ocr_options, on_result=emit_ocr_page if on_page else None, data=data
+            )
+        page_results = sorted(page_results + [(i, reused[i], None) for i in reused], key=lambda r: r[0])
+
+        stored = 0
+        for i, page_ocr, error in page_results:
+            pages_detail[i]["source"] = "ocr"
+            if error is None:
+                page_texts[i] = page_ocr["text"] + "\n"
+                pages_detail[i].update({
+                    "chars": len(page_ocr["text"].strip()),
+                    "dpi": page_ocr["dpi"],
+                    "upscale": page_ocr["scale"],
+                    "ocr_engine": page_ocr["engine"],
+                })
+                if "easyocr_regions" in page_ocr:
+                    pages_detail[i]["easyocr_regions"] = page_ocr["easyocr_regions"]
+                if i in reused:
+                    pages_detail[i]["reused"] = True
+                    pages_detail[i]["extract_ms"] = round(page_ms[i], 1)
+                    continue
+                pages_detail[i]["ocr_ms"] = page_ocr["ocr_ms"]
+                pages_detail[i]["extract_ms"] = round(page_ms[i] + page_ocr["ms"], 1)
+                ocr_done.append(page_ocr)
+                if i in page_keys:
+                    get_cache().put(PAGE_CACHE_NAMESPACE, page_keys[i], page_ocr, page_config, evict=False)
+                    stored += 1
+                continue
+
+            print(f"[DEBUG] OCR error on page {i+1}: {error}", file=sys.stderr)
+            if on_error == "fail_fast":
+                doc.close()
                 return {
                     "text": None,
                     "confidence": 0,
-                    "error": f"OCR error on page {i+1}: {str(e)}",
+                    "error": f"OCR error on page {i+1}: {error}",
                     "metadata": {}
                 }
+            page_texts[i] = ""
+            pages_detail[i]["chars"] = 0
+            pages_detail[i]["error"] = error
+            page_errors.append({"page": i + 1, "error": error})
+
+        if stored:
+            get_cache().evict()
+
+    raw_text = "".join(page_texts[i] for i in selected)
+    # Như trước khi phân loại theo trang: chỉ PDF không có text layer mới là scan (Node dựa vào cờ này
+    # để refine cả tài liệu); PDF hỗn hợp báo trang OCR qua ocr_pages / pages_detail[].source
+    is_scanned = not doc_has_text
 
     try:
         info = doc.metadata if doc else {}
@@ -207,43 +714,146 @@ def extract_text_from_pdf(pdf_path: str) -> dict:
         "author": info.get("author"),
         "created": parse_pdf_date(info.get("creationDate")),
         "modified": parse_pdf_date(info.get("modDate")),
-        "file_size": os.path.getsize(pdf_path),
+        "file_size": len(data) if data is not None else os.path.getsize(pdf_path),
         "pages": doc.page_count,
         "language": None,
         "is_scanned": is_scanned,
+        "ocr_pages": len(ocr_indexes),
+        "pages_reused": len(reused),
+        "pages_detail": [pages_detail[i] for i in selected],
     }
+    if page_ranges or max_pages:
+        metadata["page_selection"] = {"pages": pages, "max_pages": max_pages, "extracted": len(selected)}
+    if page_errors:
+        metadata["page_errors"] = page_errors
+    if ocr_mode == "cascade" and ocr_done:
+        metadata["ocr_cascade"] = cascade_summary(ocr_done)
 
     doc.close()
 
-    # Detect language & normalize
+    # Detect language (lấy mẫu phân tầng, span theo offset trong text trả về)
+    text = raw_text.strip()
     try:
-        lang_code = detect(raw_text[:5000]) if raw_text else None
-        language = normalize_lang(lang_code) if lang_code else None
+        detected = detect_language(text)
     except Exception:
-        language = None
-    metadata["language"] = language
+        detected = {"language": None, "spans": []}
+    metadata["language"] = detected["language"]
+    metadata["language_spans"] = detected["spans"]
 
     return {
-        "text": raw_text.strip(),
+        "text": text,
         "confidence": 1.0 if raw_text else 0.0,
         "error": None,
         "metadata": metadata,
     }
 
+# =========================
+# Result cache
+# =========================
+def page_cache_config(dpi_mode: str = None, ocr_mode: str = None) -> dict:
+    """Mọi thứ ảnh hưởng tới kết quả OCR của một trang."""
+    return {
+        "version": EXTRACTOR_VERSION,
+        "ocr_dpi": OCR_DPI,
+        "engines": list(OCR_ENGINES),
+        "tesseract_config": DEFAULT_TESSERACT_CONFIG,
+        "dpi_mode": dpi_mode or PDF_OCR_DPI_MODE,
+        "target_xheight": TARGET_XHEIGHT_PX,
+        "min_dpi": MIN_OCR_DPI,
+        "preprocess": PDF_PREPROCESS.spec,
+        "ocr_mode": ocr_mode or PDF_OCR_MODE,
+        "cascade_conf": [CASCADE_LINE_CONF, CASCADE_PAGE_CONF],
+        "fingerprint": PDF_PAGE_FINGERPRINT,
+    }
+
+def cache_config(dpi_mode: str = None, ocr_mode: str = None, pages: str = None, max_pages: int = None) -> dict:
+    return {
+        **page_cache_config(dpi_mode, ocr_mode),
+        "page_text_min_chars": PAGE_TEXT_MIN_CHARS,
+        "pages": [list(r) for r in parse_page_spec(pages)],
+        "max_pages": max_pages,
+    }
+
+def is_cacheable(result: dict) -> bool:
+    return not result.get("error") and not result.get("metadata", {}).get("page_errors")
+
+def extract_with_cache(pdf_path: str, use_cache: bool = True, **kwargs) -> dict:
+    if not use_cache:
+        # --no-cache: không dùng lại cả kết quả OCR theo trang
+        kwargs.setdefault("page_cache", False)
+        return extract_text_from_pdf(pdf_path, **kwargs)
+    data = kwargs.get("data")
+    result, _ = get_cache().get_or_compute(
+        "pdf", pdf_path,
+        cache_config(kwargs.get("dpi_mode"), kwargs.get("ocr_mode"), kwargs.get("pages"), kwargs.get("max_pages")),
+        lambda: extract_text_from_pdf(pdf_path, **kwargs),
+        is_cacheable=is_cacheable,
+        content_hash=bytes_sha256(data) if data is not None else None,
+    )
+    return result
+
 # =========================
 # CLI
 # =========================
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python process_pdf.py <file1.pdf> <file2.pdf> ...", file=sys.stderr)
-        sys.exit(1)
-
-    all_results = []
-    for file_path in sys.argv[1:]:
-        result = extract_text_from_pdf(file_path)
-        all_results.append({
-            "file": os.path.basename(file_path),
+    parser = argparse.ArgumentParser(description="Extract text from PDF files (OCR for scanned pages)")
+    parser.add_argument("files", nargs="+", help="PDF paths; '-' reads one PDF from stdin")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="OCR worker processes for scanned PDFs (0 = all CPUs, default PDF_OCR_WORKERS or 1)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Pages per worker task (default PDF_OCR_CHUNK_SIZE or 4)")
+    parser.add_argument("--on-error", choices=ON_ERROR_MODES, default=None,
+                        help="fail_fast: stop at the first failed page; collect: keep going, list errors in metadata")
+    parser.add_argument("--dpi-mode", choices=DPI_MODES, default=None,
+                        help="fixed: render 400 dpi + 2x upscale; adaptive: pick dpi from measured glyph size")
+    parser.add_argument("--ocr-mode", choices=OCR_MODES, default=None,
+                        help="both: EasyOCR + Tesseract on every page; cascade: Tesseract first, EasyOCR only for low-confidence lines/pages")
+    parser.add_argument("--pages", default=None,
+                        help="Pages to extract, 1-based ranges such as 1-20,25,40- (default: all pages)")
+    parser.add_argument("--max-pages", type=int, default=None,
+                        help="Extract at most this many pages (the first ones of the selection)")
+    parser.add_argument("--stdin-name", default="stdin.pdf",
+                        help="File name reported for a PDF read from stdin")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the extraction result cache")
+    parser.add_argument("--stream", action="store_true",
+                        help="Emit one compact JSON line per file as soon as it is done (NDJSON)")
+    parser.add_argument("--stream-partial", action="store_true",
+                        help="With --stream, also emit {\"event\": \"page\", ...} lines per page")
+    parser.add_argument("--metrics", action="store_true", default=None,
+                        help="Attach per-stage timings/memory under result.metrics (default EXTRACTION_METRICS)")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="Write all stage spans to a Chrome trace file (default EXTRACTION_TRACE)")
+    args = parser.parse_args()
+    metrics.configure(args.metrics, args.trace)
+    try:
+        parse_page_spec(args.pages)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.max_pages is not None and args.max_pages < 1:
+        parser.error("--max-pages must be >= 1")
+
+    writer = ResultWriter(stream=args.stream, partial=args.stream_partial, indent=4)
+    if args.files.count("-") > 1:
+        parser.error("stdin ('-') can only be given once")
+    for file_path in args.files:
+        # '-': Node ghi thẳng nội dung upload vào stdin, không cần file tạm
+        data = sys.stdin.buffer.read() if file_path == "-" else None
+        name = args.stdin_name if file_path == "-" else os.path.basename(file_path)
+        on_page = (lambda event, name=name: writer.event("page", {"file": name, **event})) if writer.partial else None
+        with metrics.recording() as recorder:
+            result = extract_with_cache(
+                name if data is not None else file_path, use_cache=not args.no_cache,
+                workers=args.workers, chunk_size=args.chunk_size, on_error=args.on_error,
+                dpi_mode=args.dpi_mode, ocr_mode=args.ocr_mode, on_page=on_page,
+                pages=args.pages, max_pages=args.max_pages, data=data
+            )
+        if metrics.METRICS_ENABLED:
+            # Gắn sau khi tra cache: metrics là của lần chạy này, không được lưu vào cache
+            result = {**result, "metrics": recorder.to_dict()}
+        writer.write({
+            "file": name,
             "result": result
         })
 
-    print(json.dumps(all_results, ensure_ascii=False, indent=4))
+    writer.close()
+    metrics.write_trace()
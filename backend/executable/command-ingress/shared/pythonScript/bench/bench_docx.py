@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+So sánh hai bộ đọc DOCX của process_docx.py (python-docx và stream) trên các
+file DOCX lớn được sinh ra: thời gian, peak RSS và kết quả có trùng khớp không.
+
+    python bench_docx.py [--pages 50,500] [--repeat 3] [--docx a.docx ...] [--json out.json]
+
+Fixture ~ một trang spec: vài paragraph (có hyperlink, tab, xuống dòng) và một
+bảng có ô gộp ngang (gridSpan) và gộp dọc (vMerge), kèm header/footer và hai
+section. Mỗi bộ đọc chạy trong process riêng; không tính detect ngôn ngữ.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+from bench_utils import add_script_paths, measure_isolated, print_table
+
+add_script_paths("docx")
+
+NS = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+)
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/header1.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml"/>
+<Override PartName="/word/footer1.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml"/>
+<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>
+</Types>"""
+
+PACKAGE_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>
+</Relationships>"""
+
+DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/header" Target="header1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/footer" Target="footer1.xml"/>
+<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink" Target="https://example.com" TargetMode="External"/>
+</Relationships>"""
+
+CORE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+<dc:title>Đặc tả yêu cầu SmartSpec</dc:title><dc:creator>bench</dc:creator><cp:lastModifiedBy>bench</cp:lastModifiedBy>
+<dcterms:created xsi:type="dcterms:W3CDTF">2024-01-02T03:04:05Z</dcterms:created>
+<dcterms:modified xsi:type="dcterms:W3CDTF">2024-02-03T04:05:06Z</dcterms:modified>
+</cp:coreProperties>"""
+
+SECT_PR = '<w:sectPr><w:headerReference w:type="default" r:id="rId1"/><w:footerReference w:type="default" r:id="rId2"/></w:sectPr>'
+
+
+def _p(text: str, extra: str = "") -> str:
+    return f'<w:p>{extra}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def _tc(text: str, props: str = "") -> str:
+    return f"<w:tc>{'<w:tcPr>' + props + '</w:tcPr>' if props else ''}{_p(text)}</w:tc>"
+
+
+def page_xml(n: int) -> str:
+    """Một "trang" spec: tiêu đề, paragraph nhiều run và một bảng 8x4 có ô gộp."""
+    parts = [
+        _p(f"{n}. Yêu cầu chức năng REQ-{n:04d}"),
+        "<w:p><w:r><w:t>Hệ thống phải xử lý</w:t><w:tab/><w:t>yêu cầu</w:t></w:r>"
+        f'<w:hyperlink r:id="rId3"><w:r><w:t xml:space="preserve"> tài liệu {n}</w:t></w:r></w:hyperlink>'
+        "<w:r><w:br/><w:t>trong vòng 2 giây.</w:t></w:r></w:p>",
+        _p(""),
+        _p("The system shall keep an audit log of every change. " * 3),
+    ]
+    rows = ["<w:tr>" + "".join(_tc(h) for h in ("ID", "Mô tả", "Ưu tiên", "Trạng thái")) + "</w:tr>"]
+    for r in range(7):
+        if r % 3 == 0:
+            cells = _tc(f"R{n}.{r}") + _tc(f"Mô tả gộp ngang {r}", '<w:gridSpan w:val="2"/>') + _tc("Mới", '<w:vMerge w:val="restart"/>')
+        else:
+            cells = _tc(f"R{n}.{r}") + _tc(f"Chi tiết {r}") + _tc("Cao" if r % 2 else "Thấp") + _tc("", "<w:vMerge/>")
+        rows.append(f"<w:tr>{cells}</w:tr>")
+    parts.append(f"<w:tbl><w:tblGrid>{'<w:gridCol/>' * 4}</w:tblGrid>{''.join(rows)}</w:tbl>")
+    return "".join(parts)
+
+
+def make_docx(path: str, pages: int):
+    body = []
+    for n in range(pages):
+        body.append(page_xml(n))
+        if n == pages // 2:
+            # Section break giữa tài liệu: section sau dùng lại header/footer
+            body.append(_p("", f"<w:pPr>{SECT_PR}</w:pPr>"))
+    document = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:document {NS}><w:body>'
+        + "".join(body)
+        + '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/></w:sectPr></w:body></w:document>'
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES)
+        zf.writestr("_rels/.rels", PACKAGE_RELS)
+        zf.writestr("word/_rels/document.xml.rels", DOCUMENT_RELS)
+        zf.writestr("word/document.xml", document)
+        zf.writestr("word/header1.xml", f"<w:hdr {NS}>{_p('SmartSpec - Tài liệu đặc tả')}</w:hdr>")
+        zf.writestr("word/footer1.xml", f"<w:ftr {NS}>{_p('Bảo mật nội bộ')}{_p('')}</w:ftr>")
+        zf.writestr("docProps/core.xml", CORE)
+
+
+def run_parser(parser: str, path: str) -> dict:
+    if parser == "stream":
+        from docx_stream import read_docx
+        content = read_docx(path)
+    else:
+        from process_docx import read_python_docx
+        content = read_python_docx(path)
+    for key in ("created", "modified"):
+        value = content["core"][key]
+        content["core"][key] = value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+    return content
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="50,500", help="Kích thước fixture sinh ra (số trang, phân tách bằng dấu phẩy)")
+    parser.add_argument("--docx", nargs="*", default=[], help="Đo thêm các file DOCX có sẵn")
+    parser.add_argument("--parsers", default="python-docx,stream")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    parsers = [name.strip() for name in args.parsers.split(",") if name.strip()]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        files = list(args.docx)
+        for pages in [int(p) for p in args.pages.split(",") if p.strip()]:
+            path = os.path.join(tmp, f"spec_{pages}p.docx")
+            make_docx(path, pages)
+            files.append(path)
+
+        for path in files:
+            reference = None
+            for name in parsers:
+                out = measure_isolated(run_parser, (name, path), repeat=args.repeat)
+                if not out["ok"]:
+                    print(f"[{name}] {os.path.basename(path)} failed: {out['error']}", file=sys.stderr)
+                    continue
+                if reference is None:
+                    reference = out["result"]
+                rows.append({
+                    "file": os.path.basename(path),
+                    "size_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+                    "parser": name,
+                    "paragraphs": len(out["result"]["paragraphs"]),
+                    "tables": len(out["result"]["tables"]),
+                    "wall_s": out["wall_s"],
+                    "peak_rss_mb": out["peak_rss_mb"],
+                    "peak_rss_delta_mb": out["peak_rss_delta_mb"],
+                    "same_output": out["result"] == reference,
+                })
+
+    print_table(rows, [
+        ("file", "file"),
+        ("size_mb", "size_mb"),
+        ("parser", "parser"),
+        ("paragraphs", "paragraphs"),
+        ("tables", "tables"),
+        ("wall_s", "wall_s (best)"),
+        ("peak_rss_mb", "peak_rss_mb"),
+        ("peak_rss_delta_mb", "rss_delta_mb"),
+        ("same_output", f"same_as_{parsers[0]}"),
+    ])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thời gian khởi động lạnh của các script trích xuất trên đường nhanh (không
+OCR / không nạp model), đo bằng `python -X importtime`.
+
+    python bench_import_time.py [--repeat 3] [--pdf text_layer.pdf] [--docx file.docx]
+                                [--top 8] [--json out.json]
+
+Mỗi lần đo chạy một interpreter mới:
+    pdf    import process_pdf + extract_text_from_pdf() trên PDF có text layer
+    docx   import process_docx + extract_text() (nếu có --docx)
+    image  import process_OCR (đường cache hit)
+    audio  import process_STT (đường cache hit)
+
+In wall time của cả process, tổng thời gian import (cumulative của các module
+cấp cao nhất), các module nặng bị nạp (torch, cv2, easyocr...) và các module
+tốn nhiều thời gian nhất.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from bench_utils import SCRIPT_DIRS, FEATURES_DIR, print_table
+
+DEFAULT_PDF = os.path.abspath(os.path.join(FEATURES_DIR, "..", "uploads_pdf", "CMUIS401_Practise_2.pdf"))
+
+# Module không được xuất hiện trên đường nhanh
+HEAVY_MODULES = (
+    "torch", "whisper", "faster_whisper", "easyocr", "cv2", "numpy",
+    "noisereduce", "librosa", "pytesseract", "tesserocr", "PIL",
+)
+
+
+def fast_path_code(script: str, sample: str = None) -> str:
+    """Đoạn code chạy trong interpreter mới cho đường nhanh của từng script."""
+    module = {"pdf": "process_pdf", "docx": "process_docx", "image": "process_OCR", "audio": "process_STT"}[script]
+    lines = ["import sys", f"sys.argv = [{module!r}]", f"import {module}"]
+    if script == "pdf" and sample:
+        lines.append(f"{module}.extract_text_from_pdf({sample!r})")
+    elif script == "docx" and sample:
+        lines.append(f"{module}.extract_text({sample!r})")
+    return "\n".join(lines)
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] từ output của -X importtime."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(script: str, sample: str = None) -> dict:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1", EXTRACTION_CACHE="0")
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", fast_path_code(script, sample)],
+        cwd=SCRIPT_DIRS[script], env=env, capture_output=True, text=True, encoding="utf-8", errors="replace",
+    )
+    wall_ms = (time.perf_counter() - started) * 1000
+    rows = parse_importtime(proc.stderr)
+    modules = {name for name, _, _, _ in rows}
+    return {
+        "ok": proc.returncode == 0,
+        "error": None if proc.returncode == 0 else proc.stderr.strip().splitlines()[-1:],
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": round(sum(cum for _, _, cum, depth in rows if depth == 0) / 1000, 1),
+        "heavy": sorted(m for m in HEAVY_MODULES if m in modules),
+        "top": sorted(((name, cum) for name, _, cum, depth in rows if depth == 0), key=lambda r: -r[1]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần đo, lấy lần nhanh nhất")
+    parser.add_argument("--pdf", default=DEFAULT_PDF if os.path.exists(DEFAULT_PDF) else None,
+                        help="PDF có text layer cho đường nhanh của process_pdf")
+    parser.add_argument("--docx", default=None, help="File DOCX cho đường nhanh của process_docx")
+    parser.add_argument("--scripts", default="pdf,docx,image,audio")
+    parser.add_argument("--top", type=int, default=8, help="Số module tốn thời gian nhất được in ra")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    samples = {"pdf": args.pdf, "docx": args.docx}
+    rows, details = [], {}
+    for script in [s.strip() for s in args.scripts.split(",") if s.strip()]:
+        runs = [measure(script, samples.get(script)) for _ in range(max(1, args.repeat))]
+        failed = [r for r in runs if not r["ok"]]
+        if failed:
+            print(f"[{script}] failed: {failed[0]['error']}", file=sys.stderr)
+            continue
+        best = min(runs, key=lambda r: r["wall_ms"])
+        details[script] = best
+        rows.append({
+            "script": script,
+            "sample": os.path.basename(samples.get(script) or "") or "-",
+            "wall_ms": best["wall_ms"],
+            "import_ms": best["import_ms"],
+            "heavy_modules": ",".join(best["heavy"]) or "-",
+        })
+
+    print_table(rows, [
+        ("script", "script"),
+        ("sample", "sample"),
+        ("wall_ms", "wall_ms (best)"),
+        ("import_ms", "import_ms"),
+        ("heavy_modules", "heavy modules loaded"),
+    ])
+    for script, best in details.items():
+        top = ", ".join(f"{name} {cum / 1000:.0f}ms" for name, cum in best["top"][:args.top])
+        print(f"{script}: {top}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "rows": rows, "details": details}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+So sánh cách detect ngôn ngữ cũ (langdetect trên 5000 ký tự đầu) với
+lang_detect.detect_language (lấy mẫu phân tầng) trên văn bản dài nhiều ngôn
+ngữ được sinh ra từ các đoạn mẫu.
+
+    python bench_lang_detect.py [--sizes 20000,200000,2000000] [--repeat 3]
+                                [--windows 10] [--window-chars 500] [--json out.json]
+
+Mỗi kịch bản có ngôn ngữ đúng theo từng ký tự:
+    cover-en    trang bìa/mục lục tiếng Anh (~8%), thân tiếng Việt
+    mixed       các chương xen kẽ vi/en/fr, tiếng Việt chiếm đa số
+    single-vi   toàn bộ tiếng Việt
+In thời gian, ngôn ngữ chính có đúng không và tỉ lệ ký tự có span đúng ngôn ngữ.
+"""
+
+import json
+import time
+import argparse
+
+from bench_utils import add_script_paths, print_table
+
+add_script_paths()
+
+SAMPLES = {
+    "vi": (
+        "Hệ thống phải cho phép người dùng tải lên tài liệu đặc tả và tự động trích xuất các yêu cầu chức năng. "
+        "Mỗi yêu cầu được gắn mã định danh, mức độ ưu tiên và trạng thái xử lý để nhóm phát triển theo dõi. "
+        "Khi tài liệu được cập nhật, hệ thống so sánh phiên bản mới với phiên bản trước và đánh dấu các thay đổi. "
+        "Người quản lý dự án có thể phê duyệt hoặc từ chối từng thay đổi trước khi phát hành. "
+    ),
+    "en": (
+        "The system shall allow users to upload specification documents and automatically extract functional requirements. "
+        "Each requirement is assigned an identifier, a priority and a processing status so the team can track it. "
+        "When a document is updated, the system compares the new version with the previous one and highlights changes. "
+        "Project managers can approve or reject every change before it is released. "
+    ),
+    "fr": (
+        "Le système doit permettre aux utilisateurs de téléverser des documents de spécification et d'extraire les exigences. "
+        "Chaque exigence reçoit un identifiant, une priorité et un état de traitement afin que l'équipe puisse la suivre. "
+        "Lorsqu'un document est mis à jour, le système compare la nouvelle version avec la précédente. "
+        "Les chefs de projet peuvent approuver ou refuser chaque modification avant sa publication. "
+    ),
+}
+
+
+def _fill(lang: str, chars: int) -> str:
+    sample = SAMPLES[lang]
+    return (sample * (chars // len(sample) + 1))[:chars]
+
+
+def make_text(scenario: str, size: int) -> tuple:
+    """(text, [(start, end, lang)]) theo kịch bản."""
+    if scenario == "cover-en":
+        plan = [("en", 0.08), ("vi", 0.92)]
+    elif scenario == "mixed":
+        plan = [("vi", 0.2), ("en", 0.15), ("vi", 0.25), ("fr", 0.1), ("vi", 0.2), ("en", 0.1)]
+    else:
+        plan = [("vi", 1.0)]
+    parts, truth, pos = [], [], 0
+    for lang, share in plan:
+        chunk = _fill(lang, int(size * share))
+        parts.append(chunk)
+        truth.append((pos, pos + len(chunk), lang))
+        pos += len(chunk)
+    return "".join(parts), truth
+
+
+def dominant(truth: list) -> str:
+    chars = {}
+    for start, end, lang in truth:
+        chars[lang] = chars.get(lang, 0) + end - start
+    return max(chars, key=chars.get)
+
+
+def span_accuracy(spans: list, truth: list, n: int) -> float:
+    """Tỉ lệ ký tự mà span trả về cùng ngôn ngữ với thực tế."""
+    from lang_detect import normalize_lang
+
+    correct = 0
+    for span in spans:
+        for start, end, lang in truth:
+            if span["language"] == normalize_lang(lang):
+                correct += max(0, min(span["end"], end) - max(span["start"], start))
+    return round(correct / n, 4) if n else 0.0
+
+
+def head_slice(text: str) -> str:
+    """Cách cũ của process_pdf / process_docx."""
+    from langdetect import detect
+    return detect(text[:5000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="20000,200000,2000000", help="Độ dài văn bản (ký tự)")
+    parser.add_argument("--scenarios", default="cover-en,mixed,single-vi")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--windows", type=int, default=None, help="Số cửa sổ (mặc định LANG_SAMPLE_WINDOWS)")
+    parser.add_argument("--window-chars", type=int, default=None, help="Ký tự mỗi cửa sổ (mặc định LANG_WINDOW_CHARS)")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    from lang_detect import detect_language, load_profiles, normalize_lang
+
+    started = time.perf_counter()
+    load_profiles()
+    print(f"profiles loaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    rows = []
+    for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            text, truth = make_text(scenario, size)
+            expected = normalize_lang(dominant(truth))
+
+            runs = {
+                "head-5000": lambda: {"language": normalize_lang(head_slice(text)), "spans": []},
+                "stratified": lambda: detect_language(text, args.windows, args.window_chars),
+            }
+            for method, run in runs.items():
+                times = []
+                for _ in range(max(1, args.repeat)):
+                    t0 = time.perf_counter()
+                    out = run()
+                    times.append(time.perf_counter() - t0)
+                rows.append({
+                    "scenario": scenario,
+                    "chars": len(text),
+                    "method": method,
+                    "ms": round(min(times) * 1000, 2),
+                    "language": out["language"],
+                    "correct": out["language"] == expected,
+                    "spans": len(out["spans"]) or "-",
+                    "span_accuracy": span_accuracy(out["spans"], truth, len(text)) if out["spans"] else "-",
+                })
+
+    print_table(rows, [
+        ("scenario", "scenario"),
+        ("chars", "chars"),
+        ("method", "method"),
+        ("ms", "ms (best)"),
+        ("language", "language"),
+        ("correct", "correct"),
+        ("spans", "spans"),
+        ("span_accuracy", "span_accuracy"),
+    ])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
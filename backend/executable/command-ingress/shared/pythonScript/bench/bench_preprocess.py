@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark: chuỗi PIL cũ của process_pdf.preprocess_image so với
+PreprocessPipeline (NumPy/OpenCV) trên một trang A4 400 dpi tổng hợp.
+
+    python bench_preprocess.py [--repeat 3] [--dpi 400] [--json out.json]
+
+Mỗi cách chạy trong process riêng để đo thời gian và peak RSS độc lập.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+from bench_utils import add_script_paths, measure_isolated, print_table
+
+add_script_paths()
+
+A4_INCHES = (8.27, 11.69)
+
+
+def make_page(path: str, dpi: int):
+    """Trang xám A4 có các dòng chữ, nền hơi xám và nhiễu như bản scan văn phòng."""
+    import numpy as np
+    import cv2
+
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    rng = np.random.default_rng(0)
+    page = np.full((height, width), 235, dtype=np.uint8)
+    scale = dpi / 100.0
+    line_gap = int(28 * scale)
+    for n, y in enumerate(range(int(120 * scale), height - int(120 * scale), line_gap)):
+        cv2.putText(page, f"Dong {n}: yeu cau he thong SmartSpec - requirement {n * 7 % 97}",
+                    (int(80 * scale), y), cv2.FONT_HERSHEY_SIMPLEX, 0.55 * scale, 30, max(1, int(scale)))
+    noise = rng.normal(0, 12, size=page.shape).astype(np.int16)
+    page = np.clip(page.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    np.save(path, page)
+
+
+def legacy_pil(path: str) -> dict:
+    """Bản sao chuỗi PIL trước đây trong process_pdf.py."""
+    import numpy as np
+    from PIL import Image, ImageEnhance, ImageFilter
+
+    image = Image.fromarray(np.load(path))
+    image = image.convert("L")
+    image = image.resize((image.width * 2, image.height * 2), Image.LANCZOS)
+    image = ImageEnhance.Contrast(image).enhance(3.0)
+    image = ImageEnhance.Sharpness(image).enhance(2.0)
+    image = image.filter(ImageFilter.MedianFilter(size=3))
+    image = image.point(lambda x: 0 if x < 180 else 255, mode="1")
+    return {"size": list(image.size)}
+
+
+def numpy_pipeline(path: str) -> dict:
+    import numpy as np
+    from image_preprocess import PreprocessPipeline, PDF_PIPELINE
+
+    out = PreprocessPipeline.parse(PDF_PIPELINE)(np.load(path))
+    return {"size": [out.shape[1], out.shape[0]]}
+
+
+def pixel_agreement(path: str) -> float:
+    """Tỉ lệ pixel đen/trắng trùng nhau giữa hai cách (kiểm tra tương đương)."""
+    import numpy as np
+    from PIL import Image, ImageEnhance, ImageFilter
+    from image_preprocess import PreprocessPipeline, PDF_PIPELINE
+
+    page = np.load(path)
+    image = Image.fromarray(page).resize((page.shape[1] * 2, page.shape[0] * 2), Image.LANCZOS)
+    image = ImageEnhance.Contrast(image).enhance(3.0)
+    image = ImageEnhance.Sharpness(image).enhance(2.0)
+    image = image.filter(ImageFilter.MedianFilter(size=3))
+    legacy = np.array(image) >= 180
+    new = PreprocessPipeline.parse(PDF_PIPELINE)(page) > 0
+    return float((legacy == new).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--dpi", type=int, default=400)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        page_path = os.path.join(tmp, "page.npy")
+        make_page(page_path, args.dpi)
+
+        rows = []
+        for name, target in (("pil_legacy", legacy_pil), ("numpy_pipeline", numpy_pipeline)):
+            out = measure_isolated(target, (page_path,), repeat=args.repeat)
+            if not out["ok"]:
+                print(f"[{name}] failed: {out['error']}", file=sys.stderr)
+                continue
+            out.pop("result", None)
+            rows.append({"path": name, **out})
+
+        agreement = pixel_agreement(page_path)
+
+    print_table(rows, [
+        ("path", "path"),
+        ("wall_s", "wall_s (best)"),
+        ("wall_median_s", "wall_s (median)"),
+        ("cpu_s", "cpu_s"),
+        ("peak_rss_delta_mb", "peak_rss_delta_mb"),
+    ])
+    if len(rows) == 2 and rows[1]["wall_s"]:
+        print(f"speedup: {rows[0]['wall_s'] / rows[1]['wall_s']:.2f}x")
+    print(f"pixel agreement: {agreement:.4f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"dpi": args.dpi, "rows": rows, "pixel_agreement": agreement}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
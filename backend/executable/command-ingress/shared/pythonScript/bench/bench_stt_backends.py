@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+So sánh các backend STT của process_STT.py (openai-whisper và faster-whisper
+int8) trên các clip mẫu: real-time factor và độ trùng khớp theo từ so với
+backend đầu tiên.
+
+    python bench_stt_backends.py [--backends openai,faster-whisper] [--model small]
+                                 [--compute-type int8] [--clips a.wav b.wav] [--json out.json]
+
+Mặc định lấy mỗi bản ghi một clip trong backend/uploads_Audio. Mỗi backend
+chạy trong process riêng; tiền xử lý không tính vào thời gian transcribe.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+from bench_utils import FEATURES_DIR, add_script_paths, measure_isolated, print_table, word_agreement
+
+add_script_paths("audio")
+
+SAMPLE_AUDIO_DIR = os.path.abspath(os.path.join(FEATURES_DIR, "..", "..", "..", "uploads_Audio"))
+
+
+def default_clips() -> list:
+    """Một clip cho mỗi bản ghi (tên file upload: <timestamp>_<tên>[_tmp][_clean].wav)."""
+    if not os.path.isdir(SAMPLE_AUDIO_DIR):
+        return []
+    clips = {}
+    for name in sorted(os.listdir(SAMPLE_AUDIO_DIR)):
+        if name.lower().endswith(".wav"):
+            recording = re.sub(r"(_tmp|_clean)*\.wav$", "", name.split("_", 1)[-1], flags=re.IGNORECASE)
+            clips.setdefault(recording, os.path.join(SAMPLE_AUDIO_DIR, name))
+    return list(clips.values())
+
+
+def run_backend(backend: str, model_name: str, compute_type, clips: list) -> dict:
+    from process_STT import preprocess_audio, get_device, DOWNLOAD_ROOT, SAMPLE_RATE
+    from stt_backends import make_backend
+
+    stt = make_backend(backend, model_name, get_device(), DOWNLOAD_ROOT, compute_type=compute_type).load()
+    rows = []
+    for clip in clips:
+        audio = preprocess_audio(clip)
+        started = time.perf_counter()
+        out = stt.transcribe(audio)
+        rows.append({
+            "clip": os.path.basename(clip),
+            "audio_s": round(len(audio) / SAMPLE_RATE, 2),
+            "transcribe_s": round(time.perf_counter() - started, 3),
+            "language": out["language"],
+            "text": out["text"].strip(),
+        })
+    return {"compute_type": stt.compute_type, "load_ms": stt.load_ms, "clips": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="openai,faster-whisper",
+                        help="Danh sách backend, backend đầu tiên làm chuẩn so sánh")
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--compute-type", default=None, help="Kiểu tính cho faster-whisper (mặc định int8 trên CPU)")
+    parser.add_argument("--clips", nargs="*", default=None)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    clips = args.clips or default_clips()
+    if not clips:
+        print(f"Không có clip mẫu (truyền --clips hoặc thêm file .wav vào {SAMPLE_AUDIO_DIR})", file=sys.stderr)
+        sys.exit(1)
+
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    runs = {}
+    for backend in backends:
+        out = measure_isolated(run_backend, (backend, args.model, args.compute_type, clips), repeat=1)
+        if not out["ok"]:
+            print(f"[{backend}] failed: {out['error']}", file=sys.stderr)
+            continue
+        runs[backend] = out
+
+    reference = runs.get(backends[0])
+    rows = []
+    for backend, out in runs.items():
+        result = out["result"]
+        audio_s = sum(c["audio_s"] for c in result["clips"])
+        transcribe_s = sum(c["transcribe_s"] for c in result["clips"])
+        agreement = None
+        if reference is not None:
+            scores = [
+                word_agreement(ref["text"], clip["text"])
+                for ref, clip in zip(reference["result"]["clips"], result["clips"])
+            ]
+            agreement = round(sum(scores) / len(scores), 4) if scores else None
+        rows.append({
+            "backend": backend,
+            "compute_type": result["compute_type"],
+            "load_ms": result["load_ms"],
+            "audio_s": round(audio_s, 1),
+            "transcribe_s": round(transcribe_s, 2),
+            # RTF < 1: nhanh hơn thời gian thực
+            "rtf": round(transcribe_s / audio_s, 3) if audio_s else None,
+            "peak_rss_mb": out["peak_rss_mb"],
+            "word_agreement": agreement,
+        })
+
+    print(f"model={args.model} clips={len(clips)} reference={backends[0]}")
+    print_table(rows, [
+        ("backend", "backend"),
+        ("compute_type", "compute"),
+        ("load_ms", "load_ms"),
+        ("audio_s", "audio_s"),
+        ("transcribe_s", "transcribe_s"),
+        ("rtf", "rtf"),
+        ("peak_rss_mb", "peak_rss_mb"),
+        ("word_agreement", "word_agreement"),
+    ])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": args.model,
+                "clips": clips,
+                "rows": rows,
+                "runs": {name: out["result"] for name, out in runs.items()},
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Tiện ích đo hiệu năng dùng chung cho các script trong bench/.
+
+measure_isolated() chạy hàm cần đo trong một process riêng (spawn) để số
+đo peak RSS không bị lẫn với bộ nhớ của process cha hay của lần đo trước.
+"""
+
+import os
+import re
+import sys
+import time
+import statistics
+import multiprocessing as mp
+
+BENCH_DIR = os.path.abspath(os.path.dirname(__file__))
+SHARED_DIR = os.path.dirname(BENCH_DIR)
+FEATURES_DIR = os.path.abspath(os.path.join(SHARED_DIR, "..", "..", "features"))
+
+SCRIPT_DIRS = {
+    "pdf": os.path.join(FEATURES_DIR, "handle_pdf", "pythonScript"),
+    "image": os.path.join(FEATURES_DIR, "handle_image", "pythonScript"),
+    "docx": os.path.join(FEATURES_DIR, "handle_docx", "pythonScript"),
+    "audio": os.path.join(FEATURES_DIR, "handle_audio", "pythonScript"),
+}
+
+MB = 1024 * 1024
+
+
+def add_script_paths(*names):
+    """Thêm shared/pythonScript và thư mục pythonScript của các feature vào sys.path."""
+    for path in [SHARED_DIR] + [SCRIPT_DIRS[name] for name in names]:
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def peak_rss_bytes():
+    """Peak RSS của process hiện tại (None nếu không đo được trên hệ điều hành này)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+def _cpu_seconds():
+    # Gồm cả process con (vd. tesseract được pytesseract gọi qua subprocess)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _measure_child(conn, target, args, repeat):
+    try:
+        base = peak_rss_bytes()
+        walls, cpus, result = [], [], None
+        for _ in range(repeat):
+            wall_started, cpu_started = time.perf_counter(), _cpu_seconds()
+            result = target(*args)
+            walls.append(time.perf_counter() - wall_started)
+            cpus.append(_cpu_seconds() - cpu_started)
+        peak = peak_rss_bytes()
+        conn.send({
+            "ok": True,
+            "wall_s": round(min(walls), 4),
+            "wall_median_s": round(statistics.median(walls), 4),
+            "cpu_s": round(min(cpus), 4),
+            "peak_rss_mb": round(peak / MB, 1) if peak else None,
+            "peak_rss_delta_mb": round((peak - base) / MB, 1) if peak and base else None,
+            "result": result,
+        })
+    except Exception as e:
+        conn.send({"ok": False, "error": repr(e)})
+    finally:
+        conn.close()
+
+
+def measure_isolated(target, args=(), repeat=3) -> dict:
+    """
+    Chạy target(*args) `repeat` lần trong process mới, trả về wall/cpu tốt nhất,
+    peak RSS và giá trị trả về của lần chạy cuối (phải pickle được).
+    """
+    ctx = mp.get_context("spawn")
+    receiver, sender = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_measure_child, args=(sender, target, args, repeat))
+    proc.start()
+    sender.close()
+    try:
+        out = receiver.recv()
+    except EOFError:
+        out = None
+    proc.join()
+    if out is None:
+        out = {"ok": False, "error": f"benchmark process exited with code {proc.exitcode}"}
+    return out
+
+
+def print_table(rows, columns):
+    """In bảng đơn giản ra stdout: rows là list dict, columns là list (key, tiêu đề)."""
+    widths = [max([len(title)] + [len(str(row.get(key, ""))) for row in rows]) for key, title in columns]
+    print("  ".join(title.ljust(w) for (_, title), w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(key, "")).ljust(w) for (key, _), w in zip(columns, widths)))
+
+
+def _words(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+def word_agreement(reference: str, hypothesis: str) -> float:
+    """1 - WER của hypothesis so với reference (khoảng cách edit theo từ), tối thiểu 0."""
+    ref, hyp = _words(reference), _words(hypothesis)
+    if not ref:
+        return 1.0 if not hyp else 0.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return max(0.0, 1.0 - previous[-1] / len(ref))
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark + kiểm tra hồi quy cho bốn pipeline trích xuất trên fixture sinh
+tại chỗ (không cần file mẫu):
+
+    pdf_text     PDF có text layer            extract_text_from_pdf
+    pdf_scanned  PDF ảnh render từ PDF text    extract_text_from_pdf (OCR)
+    image        ảnh PNG một trang văn bản     ImageOCR.extract_text
+    docx         DOCX lớn (xem bench_docx.py)  process_docx.extract_text
+    audio_tone   tone/im lặng tổng hợp         process_STT.transcribe
+    audio_speech giọng đọc espeak (nếu có)     process_STT.transcribe
+
+    python run_benchmarks.py [--pipelines pdf_text,docx] [--repeat 3]
+                             [--baseline baselines.json] [--update-baseline]
+                             [--threshold 0.25] [--json out.json]
+
+Mỗi pipeline chạy trong process riêng (bench_utils.measure_isolated), cache
+kết quả bị tắt. Ghi lại wall/CPU tốt nhất, peak RSS, thông lượng (trang/s,
+RTF...) và chỉ số chất lượng (độ trùng theo từ so với văn bản gốc...).
+
+Pipeline bị lỗi khi chạy luôn làm thoát mã 1; chỉ pipeline thiếu công cụ sinh
+fixture (vd. espeak) được bỏ qua. Có --baseline: so sánh với baseline, thoát
+mã 1 nếu wall_s/cpu_s/peak_rss_mb tăng quá --threshold (tương đối), quality
+giảm quá --quality-drop (tuyệt đối) hoặc pipeline có trong baseline không còn
+kết quả. --update-baseline ghi kết quả lần này làm baseline. Baseline phụ thuộc
+máy đo: chỉ so sánh baseline đo trên cùng máy.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+from bench_utils import add_script_paths, measure_isolated, print_table, word_agreement
+
+add_script_paths("pdf", "image", "docx", "audio")
+
+PIPELINES = ("pdf_text", "pdf_scanned", "image", "docx", "audio_tone", "audio_speech")
+
+# metric -> chiều tốt hơn; chỉ các metric này được kiểm tra hồi quy
+CHECKED_METRICS = {
+    "wall_s": "lower",
+    "cpu_s": "lower",
+    "peak_rss_mb": "lower",
+    "quality": "higher",
+}
+# Chênh lệch thời gian nhỏ hơn mức này coi là nhiễu đo
+MIN_TIME_DELTA_S = 0.05
+
+SPEECH_TEXT = (
+    "The system shall extract requirements from uploaded documents. "
+    "Each requirement has an identifier, a priority and a status."
+)
+
+
+# =========================
+# Fixtures
+# =========================
+def spec_lines(n: int) -> list:
+    verbs = ("validate", "store", "export", "index", "archive", "review")
+    nouns = ("document", "requirement", "version", "report", "attachment", "comment")
+    return [
+        f"REQ-{i:03d} The system shall {verbs[i % 6]} the {nouns[i * 5 % 6]} within {i % 9 + 1} seconds."
+        for i in range(n)
+    ]
+
+
+def make_text_pdf(path: str, pages: int, lines_per_page: int = 40) -> str:
+    import fitz
+
+    doc = fitz.open()
+    texts = []
+    for p in range(pages):
+        page = doc.new_page(width=595, height=842)  # A4
+        lines = spec_lines(lines_per_page * (p + 1))[-lines_per_page:]
+        for k, line in enumerate(lines):
+            page.insert_text((56, 64 + k * 18), line, fontsize=11)
+        texts.extend(lines)
+    doc.save(path)
+    doc.close()
+    return "\n".join(texts)
+
+
+def make_scanned_pdf(path: str, text_pdf: str, dpi: int = 200):
+    """Mỗi trang của text_pdf render thành ảnh xám rồi chèn vào PDF mới (không còn text layer)."""
+    import fitz
+
+    with fitz.open(text_pdf) as src, fitz.open() as out:
+        for page in src:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            new_page = out.new_page(width=page.rect.width, height=page.rect.height)
+            new_page.insert_image(new_page.rect, pixmap=pix)
+        out.save(path)
+
+
+def make_image(path: str, text_pdf: str, dpi: int = 300):
+    import fitz
+
+    with fitz.open(text_pdf) as src:
+        src[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY).save(path)
+
+
+def make_tone_wav(path: str, seconds: int = 30, rate: int = 16000):
+    """Các đoạn tone 0.8 s (tần số thay đổi) xen im lặng 0.4 s: đo tốc độ, không có lời."""
+    import wave
+    import numpy as np
+
+    t = np.arange(int(0.8 * rate)) / rate
+    parts, k = [], 0
+    while sum(len(p) for p in parts) < seconds * rate:
+        freq = 220 * (1 + k % 7)
+        envelope = np.sin(np.pi * t / t[-1])
+        parts.append(0.3 * envelope * np.sin(2 * np.pi * freq * t))
+        parts.append(np.zeros(int(0.4 * rate)))
+        k += 1
+    audio = np.concatenate(parts)[:seconds * rate]
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((audio * 32767).astype("<i2").tobytes())
+
+
+def make_speech_wav(path: str) -> bool:
+    espeak = shutil.which("espeak-ng") or shutil.which("espeak")
+    if not espeak:
+        return False
+    subprocess.run([espeak, "-v", "en", "-s", "150", "-w", path, SPEECH_TEXT], check=True, capture_output=True)
+    return True
+
+
+def build_fixtures(root: str, names: list, pdf_pages: int, docx_pages: int) -> dict:
+    """{pipeline: {"path", "expected"...}} hoặc {"skipped": lý do} nếu thiếu thư viện sinh fixture."""
+    fixtures = {}
+    text_pdf = os.path.join(root, f"text_{pdf_pages}p.pdf")
+
+    def build(name, fn):
+        try:
+            fixtures[name] = fn()
+        except Exception as e:
+            fixtures[name] = {"skipped": f"fixture: {e!r}"}
+
+    if any(n in names for n in ("pdf_text", "pdf_scanned", "image")):
+        build("pdf_text", lambda: {"path": text_pdf, "expected": make_text_pdf(text_pdf, pdf_pages), "pages": pdf_pages})
+    if "pdf_scanned" in names:
+        scanned = os.path.join(root, f"scanned_{pdf_pages}p.pdf")
+        build("pdf_scanned", lambda: (make_scanned_pdf(scanned, text_pdf),
+                                      {**fixtures["pdf_text"], "path": scanned})[1])
+    if "image" in names:
+        image = os.path.join(root, "page.png")
+        build("image", lambda: (make_image(image, text_pdf),
+                                {"path": image, "expected": "\n".join(spec_lines(40)), "pages": 1})[1])
+    if "docx" in names:
+        from bench_docx import make_docx
+        docx = os.path.join(root, f"spec_{docx_pages}p.docx")
+        build("docx", lambda: (make_docx(docx, docx_pages), {"path": docx, "pages": docx_pages})[1])
+    if "audio_tone" in names:
+        tone = os.path.join(root, "tone.wav")
+        build("audio_tone", lambda: (make_tone_wav(tone), {"path": tone, "expected": ""})[1])
+    if "audio_speech" in names:
+        speech = os.path.join(root, "speech.wav")
+        build("audio_speech", lambda: {"path": speech, "expected": SPEECH_TEXT} if make_speech_wav(speech)
+              else {"skipped": "espeak/espeak-ng not installed"})
+    return {name: fixtures[name] for name in names if name in fixtures}
+
+
+# =========================
+# Pipelines (chạy trong process con, trả về dict pickle được)
+# =========================
+def run_pdf(path: str) -> dict:
+    from process_pdf import extract_text_from_pdf
+
+    result = extract_text_from_pdf(path)
+    if result.get("error"):
+        raise RuntimeError(result["error"])
+    return {"text": result["text"], "pages": result["metadata"]["pages"],
+            "ocr_pages": result["metadata"]["ocr_pages"]}
+
+
+def run_image(path: str) -> dict:
+    from process_OCR import ImageOCR
+
+    text, confidence, _, _ = ImageOCR().extract_text(path)
+    return {"text": text, "confidence": confidence}
+
+
+def run_docx(path: str) -> dict:
+    from process_docx import extract_text
+
+    result = extract_text(path)
+    if result.get("error"):
+        raise RuntimeError(result["error"])
+    return {"paragraphs": result["metadata"]["paragraphs_count"], "tables": result["metadata"]["tables_count"]}
+
+
+def run_audio(path: str) -> dict:
+    from process_STT import transcribe
+
+    timing = {}
+    result = transcribe(path, timing=timing)
+    return {"text": result["text"], "audio_s": timing.get("audio_s")}
+
+
+RUNNERS = {
+    "pdf_text": run_pdf,
+    "pdf_scanned": run_pdf,
+    "image": run_image,
+    "docx": run_docx,
+    "audio_tone": run_audio,
+    "audio_speech": run_audio,
+}
+
+
+def summarize(name: str, fixture: dict, out: dict) -> dict:
+    """Metric chung + thông lượng và chất lượng riêng của từng pipeline."""
+    result = out["result"]
+    row = {
+        "pipeline": name,
+        "wall_s": out["wall_s"],
+        "cpu_s": out["cpu_s"],
+        "peak_rss_mb": out["peak_rss_mb"],
+    }
+    wall = max(out["wall_s"], 1e-6)
+    if name.startswith("pdf") or name == "image":
+        pages = result.get("pages", 1)
+        row["throughput"] = f"{pages / wall:.2f} pages/s"
+        row["quality"] = round(word_agreement(fixture["expected"], result["text"]), 4)
+    elif name == "docx":
+        row["throughput"] = f"{os.path.getsize(fixture['path']) / wall / 1024 / 1024:.2f} MB/s"
+        # Fixture: mỗi trang 3 paragraph có chữ + 1 bảng, thêm 1 paragraph section break (rỗng)
+        expected = (fixture["pages"] * 3, fixture["pages"])
+        row["quality"] = float((result["paragraphs"], result["tables"]) == expected)
+    else:
+        audio_s = result.get("audio_s") or 0
+        row["throughput"] = f"RTF {wall / audio_s:.3f}" if audio_s else "-"
+        if fixture["expected"]:
+            row["quality"] = round(word_agreement(fixture["expected"], result["text"]), 4)
+        else:
+            # Audio không có lời: mọi ký tự nhận được là ảo giác của model
+            row["quality"] = round(1.0 / (1 + len(result["text"].strip())), 4)
+    return row
+
+
+# =========================
+# Baseline
+# =========================
+def machine_info() -> dict:
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+
+
+def compare(rows: list, baseline: dict, threshold: float, quality_drop: float, measured: list) -> list:
+    """
+    Danh sách mô tả các hồi quy so với baseline. measured: các pipeline lần
+    này phải có kết quả (đã chọn và có fixture).
+    """
+    regressions = []
+    previous = {row["pipeline"]: row for row in baseline.get("rows", [])}
+    current = {row["pipeline"] for row in rows}
+    for name in measured:
+        if name in previous and name not in current:
+            regressions.append(f"{name}: no result (baseline has one)")
+    for row in rows:
+        base = previous.get(row["pipeline"])
+        if not base:
+            continue
+        for metric, better in CHECKED_METRICS.items():
+            new, old = row.get(metric), base.get(metric)
+            if new is None or old is None:
+                continue
+            if metric == "quality":
+                if old - new > quality_drop:
+                    regressions.append(f"{row['pipeline']}.{metric}: {old} -> {new}")
+                continue
+            if metric in ("wall_s", "cpu_s") and new - old < MIN_TIME_DELTA_S:
+                continue
+            if old > 0 and (new - old) / old > threshold:
+                regressions.append(f"{row['pipeline']}.{metric}: {old} -> {new} (+{(new - old) / old:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pipelines", default="pdf_text,pdf_scanned,image,docx,audio_tone,audio_speech")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi pipeline, lấy lần nhanh nhất")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--docx-pages", type=int, default=500)
+    parser.add_argument("--fixtures", default=None, help="Thư mục giữ fixture (mặc định thư mục tạm)")
+    parser.add_argument("--baseline", default=None, help="File JSON baseline để so sánh")
+    parser.add_argument("--update-baseline", action="store_true", help="Ghi kết quả lần này vào --baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Mức tăng tương đối tối đa của wall_s/cpu_s/peak_rss_mb (0.25 = 25%%)")
+    parser.add_argument("--quality-drop", type=float, default=0.02, help="Mức giảm tuyệt đối tối đa của quality")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.pipelines.split(",") if n.strip()]
+    unknown = [n for n in names if n not in PIPELINES]
+    if unknown:
+        parser.error(f"unknown pipelines: {', '.join(unknown)} (choose from {', '.join(PIPELINES)})")
+
+    # Đo pipeline, không đo cache
+    os.environ["EXTRACTION_CACHE"] = "0"
+
+    tmp = None
+    root = args.fixtures
+    if not root:
+        tmp = tempfile.TemporaryDirectory()
+        root = tmp.name
+    os.makedirs(root, exist_ok=True)
+
+    rows, skipped, failed = [], {}, {}
+    try:
+        fixtures = build_fixtures(root, names, args.pdf_pages, args.docx_pages)
+        for name in names:
+            fixture = fixtures[name]
+            if "skipped" in fixture:
+                skipped[name] = fixture["skipped"]
+                continue
+            out = measure_isolated(RUNNERS[name], (fixture["path"],), repeat=args.repeat)
+            if not out["ok"]:
+                failed[name] = out["error"]
+                continue
+            rows.append(summarize(name, fixture, out))
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+    print_table(rows, [
+        ("pipeline", "pipeline"),
+        ("wall_s", "wall_s (best)"),
+        ("cpu_s", "cpu_s"),
+        ("peak_rss_mb", "peak_rss_mb"),
+        ("throughput", "throughput"),
+        ("quality", "quality"),
+    ])
+    for name, reason in skipped.items():
+        print(f"[{name}] skipped: {reason}", file=sys.stderr)
+    for name, error in failed.items():
+        print(f"[{name}] FAILED: {error}", file=sys.stderr)
+
+    report = {"machine": machine_info(), "repeat": args.repeat, "rows": rows, "skipped": skipped,
+              "failed": failed}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if not args.baseline:
+        if failed:
+            sys.exit(1)
+        return
+    if args.update_baseline:
+        if failed:
+            print("baseline not written: some pipelines failed", file=sys.stderr)
+            sys.exit(1)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != report["machine"]:
+        print(f"[WARN] baseline was recorded on {baseline.get('machine')}", file=sys.stderr)
+    # Pipeline lỗi có trong baseline được compare báo là thiếu kết quả
+    measured = [name for name in names if name not in skipped]
+    regressions = compare(rows, baseline, args.threshold, args.quality_drop, measured)
+    in_baseline = {row["pipeline"] for row in baseline.get("rows", [])}
+    regressions += [f"{name}: failed" for name in failed if name not in in_baseline]
+    if regressions:
+        print("REGRESSIONS:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Ghi kết quả CLI cho các script trích xuất.
+
+- Mặc định (array): gom kết quả từng file, cuối cùng in một mảng JSON như trước.
+- stream: mỗi file một dòng JSON compact (NDJSON), flush ngay khi xong để
+  caller lưu dần và bộ nhớ không tăng theo số file.
+- partial (chỉ khi stream): thêm các dòng trung gian có khoá "event"
+  ("page", "segment"...). Caller phân biệt dòng kết quả file với dòng
+  trung gian bằng khoá này.
+"""
+
+import sys
+import json
+
+
+class ResultWriter:
+    def __init__(self, stream: bool = False, partial: bool = False, indent: int = 2, out=None):
+        self.stream = stream
+        self.partial = stream and partial
+        self.indent = indent
+        self.out = out or sys.stdout
+        self._results = []
+
+    def _emit(self, obj):
+        self.out.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        self.out.flush()
+
+    def write(self, item: dict):
+        """Kết quả của một file."""
+        if self.stream:
+            self._emit(item)
+        else:
+            self._results.append(item)
+
+    def event(self, kind: str, payload: dict):
+        """Kết quả trung gian (trang, segment...), chỉ ghi khi bật partial."""
+        if self.partial:
+            self._emit({"event": kind, **payload})
+
+    def close(self):
+        if not self.stream:
+            self.out.write(json.dumps(self._results, ensure_ascii=False, indent=self.indent) + "\n")
+            self.out.flush()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tiền xử lý ảnh trước OCR trên mảng NumPy (OpenCV), dùng chung cho
+process_pdf.py và process_OCR.py.
+
+Pipeline được mô tả bằng chuỗi các bước, ví dụ:
+    "gray,resize=2,contrast=3.0,sharpen=2.0,median=3,threshold=180"
+
+Các bước ghi đè trực tiếp lên buffer hiện tại khi có thể (gray/resize/median
+cấp phát buffer mới, sharpen dùng một buffer tạm), nên mảng truyền vào có
+thể bị thay đổi.
+
+Bước hỗ trợ:
+    gray[=bgr|rgb]        chuyển sang ảnh xám (mặc định thứ tự kênh BGR của cv2)
+    resize=<scale>        phóng to/thu nhỏ (LANCZOS4), bỏ qua khi scale == 1
+    contrast=<factor>     tương đương PIL ImageEnhance.Contrast
+    sharpen=<factor>      tương đương PIL ImageEnhance.Sharpness
+    median=<ksize>        lọc trung vị
+    threshold=<t>         nhị phân: < t -> 0, còn lại 255
+    adaptive=<block>:<c>  cv2.adaptiveThreshold (Gaussian)
+
+numpy/cv2 chỉ được import khi pipeline thực sự chạy: parse()/spec dùng được
+trên đường không OCR (vd. khoá cache) mà không tốn thời gian nạp OpenCV.
+"""
+
+import metrics
+
+# Pipeline tương đương chuỗi PIL cũ trong process_pdf.py
+PDF_PIPELINE = "gray,resize=2,contrast=3.0,sharpen=2.0,median=3,threshold=180"
+# Pipeline cũ của ImageOCR.preprocess trong process_OCR.py
+IMAGE_PIPELINE = "gray,adaptive=31:12"
+
+# Kernel ImageFilter.SMOOTH mà PIL ImageEnhance.Sharpness dùng
+_SMOOTH_KERNEL_ROWS = [[1, 1, 1], [1, 5, 1], [1, 1, 1]]
+
+
+def _gray(img, order="bgr"):
+    import cv2
+    if img.ndim == 2:
+        return img
+    channels = img.shape[2]
+    if channels == 4:
+        code = cv2.COLOR_BGRA2GRAY if order == "bgr" else cv2.COLOR_RGBA2GRAY
+    else:
+        code = cv2.COLOR_BGR2GRAY if order == "bgr" else cv2.COLOR_RGB2GRAY
+    return cv2.cvtColor(img, code)
+
+
+def _resize(img, scale):
+    import cv2
+    scale = float(scale)
+    if scale == 1:
+        return img
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_LANCZOS4)
+
+
+def _contrast(img, factor):
+    # PIL: out = mean + factor * (img - mean), mean làm tròn theo histogram ảnh xám
+    import cv2
+    factor = float(factor)
+    mean = int(cv2.mean(img)[0] + 0.5)
+    cv2.addWeighted(img, factor, img, 0.0, mean * (1.0 - factor), dst=img)
+    return img
+
+
+def _sharpen(img, factor):
+    # PIL: out = smooth + factor * (img - smooth)
+    import numpy as np
+    import cv2
+    factor = float(factor)
+    kernel = np.array(_SMOOTH_KERNEL_ROWS, dtype=np.float32) / 13.0
+    smooth = cv2.filter2D(img, -1, kernel, borderType=cv2.BORDER_REPLICATE)
+    cv2.addWeighted(img, factor, smooth, 1.0 - factor, 0.0, dst=img)
+    return img
+
+
+def _median(img, ksize):
+    # medianBlur đọc lân cận nên không ghi đè tại chỗ được
+    import cv2
+    return cv2.medianBlur(img, int(ksize))
+
+
+def _threshold(img, value):
+    # PIL point(lambda x: 0 if x < t else 255) <=> cv2 THRESH_BINARY với ngưỡng t - 1
+    import cv2
+    cv2.threshold(img, int(value) - 1, 255, cv2.THRESH_BINARY, dst=img)
+    return img
+
+
+def _adaptive(img, params):
+    import cv2
+    block, c = (params.split(":") + ["12"])[:2]
+    cv2.adaptiveThreshold(
+        img, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, int(block), float(c),
+        dst=img
+    )
+    return img
+
+
+# Các bước ghi đè lên buffer đầu vào (cần buffer ghi được)
+INPLACE_STEPS = {"contrast", "sharpen", "threshold", "adaptive"}
+
+STEPS = {
+    "gray": _gray,
+    "resize": _resize,
+    "contrast": _contrast,
+    "sharpen": _sharpen,
+    "median": _median,
+    "threshold": _threshold,
+    "adaptive": _adaptive,
+}
+
+
+class PreprocessPipeline:
+    def __init__(self, steps):
+        for name, _ in steps:
+            if name not in STEPS:
+                raise ValueError(f"Unknown preprocess step: {name}")
+        self.steps = list(steps)
+
+    @classmethod
+    def parse(cls, spec: str) -> "PreprocessPipeline":
+        steps = []
+        for item in spec.split(","):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, param = item.partition("=")
+            steps.append((name.strip(), param.strip() or None))
+        return cls(steps)
+
+    def with_step(self, name: str, param) -> "PreprocessPipeline":
+        """
+        Bản sao pipeline với tham số của một bước được thay (vd. resize theo dpi).
+        Pipeline chưa có bước đó thì thêm vào đầu (sau gray nếu pipeline bắt đầu
+        bằng gray) để tham số không bị bỏ qua.
+        """
+        steps = [(n, param if n == name else p) for n, p in self.steps]
+        if all(n != name for n, _ in self.steps):
+            steps.insert(1 if steps and steps[0][0] == "gray" else 0, (name, param))
+        return PreprocessPipeline(steps)
+
+    @property
+    def spec(self) -> str:
+        return ",".join(name if param is None else f"{name}={param}" for name, param in self.steps)
+
+    def __call__(self, image):
+        import numpy as np
+        img = image if isinstance(image, np.ndarray) else np.array(image)
+        if img.dtype != np.uint8:
+            img = img.astype(np.uint8)
+        with metrics.span("preprocess"):
+            for name, param in self.steps:
+                if name in INPLACE_STEPS and not img.flags.writeable:
+                    # Buffer chỉ đọc (vd. bytes của pixmap): chép một lần rồi xử lý tại chỗ
+                    img = img.copy()
+                fn = STEPS[name]
+                img = fn(img) if param is None else fn(img, param)
+        return img
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Nhận diện ngôn ngữ dùng chung cho các script trích xuất.
+
+- Profile langdetect được nạp một lần cho mỗi process (load_profiles); gọi
+  trước khi tạo thread/process pool (fork) để các worker dùng lại.
+- Văn bản dài không lấy 5000 ký tự đầu mà lấy mẫu phân tầng: chia văn bản
+  thành LANG_SAMPLE_WINDOWS đoạn đều nhau, mỗi đoạn lấy một cửa sổ
+  LANG_WINDOW_CHARS ký tự ở giữa. Chi phí cố định theo số cửa sổ, và tài liệu
+  nhiều ngôn ngữ (vd. phần đầu tiếng Anh, thân tiếng Việt) không bị quyết
+  định bởi trang bìa.
+- Mỗi đoạn có ngôn ngữ riêng; các đoạn liền nhau cùng ngôn ngữ được gộp
+  thành span {"start", "end", "language", "confidence"} (offset theo ký tự).
+
+Văn bản ngắn hơn tổng kích thước các cửa sổ được detect nguyên văn như trước.
+"""
+
+import os
+
+import metrics
+
+LANG_SAMPLE_WINDOWS = int(os.getenv("LANG_SAMPLE_WINDOWS", "10"))
+LANG_WINDOW_CHARS = int(os.getenv("LANG_WINDOW_CHARS", "500"))
+
+# Mapping ISO-639-1 -> locale phổ biến
+LANG_MAP = {
+    "vi": "vi-VN",
+    "en": "en-US",
+    "fr": "fr-FR",
+    "de": "de-DE",
+    "es": "es-ES",
+    "it": "it-IT",
+    "pt": "pt-PT",
+    "ru": "ru-RU",
+    "ja": "ja-JP",
+    "ko": "ko-KR",
+    "zh-cn": "zh-CN",
+    "zh-tw": "zh-TW",
+    "zh": "zh-CN",  # Whisper trả về "zh"
+}
+
+# Cửa sổ được nới tới khoảng trắng gần nhất trong phạm vi này để không cắt giữa từ
+_SNAP_CHARS = 40
+
+_factory = None
+
+
+def normalize_lang(lang_code: str, default=None):
+    """Chuyển ISO-639-1 sang locale, nếu không có thì trả về nguyên bản."""
+    if not lang_code:
+        return default
+    return LANG_MAP.get(lang_code.lower(), lang_code)
+
+
+def load_profiles():
+    """DetectorFactory của langdetect, nạp profile một lần cho cả process."""
+    global _factory
+    if _factory is None:
+        from langdetect import detector_factory
+
+        detector_factory.DetectorFactory.seed = 0  # kết quả ổn định giữa các lần chạy
+        with metrics.span("lang_detect.load_profiles"):
+            detector_factory.init_factory()
+        _factory = detector_factory._factory
+    return _factory
+
+
+def _snap(text: str, start: int, end: int) -> tuple:
+    if start > 0:
+        space = text.find(" ", start, start + _SNAP_CHARS)
+        if space != -1:
+            start = space + 1
+    if end < len(text):
+        space = text.rfind(" ", end - _SNAP_CHARS, end)
+        if space > start:
+            end = space
+    return start, end
+
+
+def sample_windows(text: str, windows: int = None, window_chars: int = None) -> list:
+    """
+    [(stratum_start, stratum_end, window_start, window_end)]: văn bản chia thành
+    `windows` đoạn đều nhau, mỗi đoạn một cửa sổ ở giữa. Văn bản ngắn -> một
+    đoạn duy nhất là cả văn bản.
+    """
+    windows = max(1, windows or LANG_SAMPLE_WINDOWS)
+    window_chars = max(1, window_chars or LANG_WINDOW_CHARS)
+    n = len(text)
+    if n <= windows * window_chars:
+        return [(0, n, 0, n)]
+
+    out = []
+    for i in range(windows):
+        s, e = n * i // windows, n * (i + 1) // windows
+        middle = (s + e) // 2
+        ws, we = _snap(text, max(s, middle - window_chars // 2), min(e, middle + window_chars // 2))
+        out.append((s, e, ws, we))
+    return out
+
+
+def _probabilities(text: str) -> list:
+    """[(code, prob)] của một đoạn văn bản, rỗng nếu langdetect không nhận ra."""
+    from langdetect.lang_detect_exception import LangDetectException
+
+    detector = load_profiles().create()
+    detector.append(text)
+    try:
+        return [(p.lang, p.prob) for p in detector.get_probabilities()]
+    except LangDetectException:
+        return []
+
+
+def detect_language(text: str, windows: int = None, window_chars: int = None) -> dict:
+    """
+    {"code": "vi", "language": "vi-VN", "confidence": 0.98, "spans": [...]}.
+    code/language là None nếu không nhận diện được (văn bản rỗng, chỉ có số...).
+    Điểm của mỗi ngôn ngữ = tổng xác suất trên các cửa sổ, trọng số theo độ
+    dài đoạn mà cửa sổ đại diện.
+    """
+    result = {"code": None, "language": None, "confidence": 0.0, "spans": []}
+    if not text or not text.strip():
+        return result
+
+    with metrics.span("lang_detect"):
+        return _detect(text, windows, window_chars, result)
+
+
+def _detect(text, windows, window_chars, result):
+    scores, total, spans = {}, 0, []
+    for s, e, ws, we in sample_windows(text, windows, window_chars):
+        probs = _probabilities(text[ws:we])
+        if not probs:
+            continue
+        weight = e - s
+        total += weight
+        for code, prob in probs:
+            scores[code] = scores.get(code, 0.0) + prob * weight
+
+        code, prob = probs[0]
+        if spans and spans[-1]["code"] == code and spans[-1]["end"] == s:
+            # Gộp đoạn liền kề cùng ngôn ngữ, confidence trung bình theo độ dài
+            span = spans[-1]
+            length = span["end"] - span["start"]
+            span["confidence"] = (span["confidence"] * length + prob * weight) / (length + weight)
+            span["end"] = e
+        else:
+            spans.append({"start": s, "end": e, "code": code, "confidence": prob})
+
+    if not scores:
+        return result
+
+    code = max(scores, key=scores.get)
+    result["code"] = code
+    result["language"] = normalize_lang(code)
+    result["confidence"] = round(scores[code] / total, 4)
+    result["spans"] = [
+        {
+            "start": span["start"],
+            "end": span["end"],
+            "language": normalize_lang(span["code"]),
+            "confidence": round(span["confidence"], 4),
+        }
+        for span in spans
+    ]
+    return result
+
+
+def detect_code(text: str) -> str:
+    """Mã ISO-639-1 (vd. "vi") của văn bản hoặc None."""
+    return detect_language(text)["code"]
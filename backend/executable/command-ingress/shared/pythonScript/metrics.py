@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Đo thời gian / bộ nhớ theo từng bước cho các script trích xuất.
+
+    with metrics.recording() as rec:          # một recorder cho mỗi file input
+        with metrics.span("render", page=3):  # bước con, lồng nhau được
+            ...
+        metrics.count("pages_ocr")
+    result["metrics"] = rec.to_dict()
+
+- Tắt (mặc định): recording() trả về recorder rỗng, span() trả về một
+  context manager dùng chung không làm gì -> chi phí chỉ là một lần gọi hàm.
+- Bật bằng EXTRACTION_METRICS=1 hoặc --metrics của script: mỗi bước ghi số
+  lần, tổng/max ms và mức tăng peak RSS của process trong bước đó (bước nào
+  đẩy peak bộ nhớ lên).
+- EXTRACTION_TRACE=<file> (hoặc --trace): ghi thêm từng span theo định dạng
+  Chrome trace (mở bằng chrome://tracing hoặc ui.perfetto.dev) khi script
+  gọi write_trace() lúc kết thúc.
+
+Recorder gắn với thread hiện tại; thread pool dùng bind() để các thread con
+ghi vào recorder của file đang xử lý. Process con trả về to_dict(events=True)
+để process cha merge().
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+METRICS_ENABLED = os.getenv("EXTRACTION_METRICS", "0").lower() in ("1", "true", "on", "yes")
+TRACE_PATH = os.getenv("EXTRACTION_TRACE") or None
+
+MB = 1024 * 1024
+
+# Mốc để đổi perf_counter sang wall clock: span của các process khác nhau
+# nằm trên cùng trục thời gian trong trace
+_EPOCH_WALL = time.time()
+_EPOCH_PERF = time.perf_counter()
+
+_local = threading.local()
+_trace_events = []
+_trace_lock = threading.Lock()
+
+
+def peak_rss_bytes():
+    """Peak RSS của process hiện tại (None nếu hệ điều hành không hỗ trợ)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Recorder:
+    enabled = True
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        rss_before = peak_rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            rss_after = peak_rss_bytes()
+            growth = (rss_after - rss_before) if rss_before is not None and rss_after is not None else 0
+            self._add(name, started, finished, growth, args)
+
+    def _add(self, name, started, finished, rss_growth, args):
+        ms = (finished - started) * 1000
+        with self._lock:
+            stage = self.stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "peak_rss_growth_mb": 0.0})
+            stage["count"] += 1
+            stage["total_ms"] += ms
+            stage["max_ms"] = max(stage["max_ms"], ms)
+            stage["peak_rss_growth_mb"] += rss_growth / MB
+            if self.trace:
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": round((_EPOCH_WALL + started - _EPOCH_PERF) * 1e6),
+                    "dur": round(ms * 1000),
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                })
+
+    def count(self, name: str, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, data: dict):
+        """Gộp to_dict() của recorder khác (vd. từ process con)."""
+        if not data:
+            return
+        with self._lock:
+            for name, other in data.get("stages", {}).items():
+                stage = self.stages.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "peak_rss_growth_mb": 0.0})
+                stage["count"] += other["count"]
+                stage["total_ms"] += other["total_ms"]
+                stage["max_ms"] = max(stage["max_ms"], other["max_ms"])
+                stage["peak_rss_growth_mb"] += other["peak_rss_growth_mb"]
+            for name, n in data.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            if self.trace:
+                self.events.extend(data.get("events", []))
+
+    def to_dict(self, events: bool = False) -> dict:
+        peak = peak_rss_bytes()
+        with self._lock:
+            out = {
+                "wall_ms": round((time.perf_counter() - self._started) * 1000, 1),
+                "peak_rss_mb": round(peak / MB, 1) if peak else None,
+                "stages": {
+                    name: {
+                        "count": stage["count"],
+                        "total_ms": round(stage["total_ms"], 1),
+                        "max_ms": round(stage["max_ms"], 1),
+                        "peak_rss_growth_mb": round(stage["peak_rss_growth_mb"], 1),
+                    }
+                    for name, stage in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+            if events:
+                out["events"] = list(self.events)
+        return out
+
+
+class _NullRecorder:
+    enabled = False
+    trace = False
+
+    def span(self, name: str, **args):
+        return _NULL_SPAN
+
+    def count(self, name: str, n=1):
+        pass
+
+    def merge(self, data: dict):
+        pass
+
+    def to_dict(self, events: bool = False):
+        return None
+
+
+_NULL_SPAN = contextlib.nullcontext()
+NULL_RECORDER = _NullRecorder()
+
+
+def current():
+    """Recorder của thread hiện tại (recorder rỗng nếu không bật)."""
+    return getattr(_local, "recorder", NULL_RECORDER)
+
+
+def span(name: str, **args):
+    return current().span(name, **args)
+
+
+def count(name: str, n=1):
+    current().count(name, n)
+
+
+@contextlib.contextmanager
+def recording(enabled: bool = None, trace: bool = None):
+    """Recorder mới cho thread hiện tại trong phạm vi with (thường là một file input)."""
+    enabled = METRICS_ENABLED if enabled is None else enabled
+    trace = bool(TRACE_PATH) if trace is None else trace
+    recorder = Recorder(trace=trace) if (enabled or trace) else NULL_RECORDER
+    previous = current()
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+        if recorder.trace:
+            with _trace_lock:
+                _trace_events.extend(recorder.events)
+
+
+def bind(fn):
+    """fn chạy trên thread khác nhưng ghi vào recorder của thread gọi bind()."""
+    recorder = current()
+    if not recorder.enabled:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = current()
+        _local.recorder = recorder
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.recorder = previous
+
+    return bound
+
+
+def add_trace_events(events: list):
+    """Thêm span do process con ghi (Recorder.events) vào trace của process này."""
+    if events:
+        with _trace_lock:
+            _trace_events.extend(events)
+
+
+def configure(enabled: bool = None, trace_path: str = None):
+    """Ghi đè cấu hình từ env bằng tuỳ chọn CLI (--metrics / --trace)."""
+    global METRICS_ENABLED, TRACE_PATH
+    if enabled is not None:
+        METRICS_ENABLED = enabled
+    if trace_path:
+        TRACE_PATH = trace_path
+
+
+def write_trace(path: str = None):
+    """Ghi mọi span đã thu thập ra file Chrome trace (nếu có bật trace)."""
+    path = path or TRACE_PATH
+    if not path or not _trace_events:
+        return
+    with _trace_lock:
+        events = sorted(_trace_events, key=lambda e: e["ts"])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    print(f"[METRICS] trace written to {path} ({len(events)} spans)", file=sys.stderr)
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared OCR engine (EasyOCR + Tesseract) cho process_pdf.py và process_OCR.py.
+
+- OcrEngine: giữ một EasyOCR reader + cấu hình Tesseract, dùng trong process.
+- Worker thường trú: `python ocr_engine.py --serve --socket /tmp/ocr.sock`
+  (hoặc `--port 8765`, hoặc `--stdio`) nạp model một lần và nhận job
+  `ocr_page` dạng JSON theo dòng (NDJSON).
+- get_ocr_engine(): nếu có OCR_SERVER_ADDR và worker đang chạy thì dùng
+  OcrClient, nếu không thì tạo OcrEngine cục bộ.
+- Tesseract: nếu cài tesserocr thì giữ một PyTessBaseAPI thường trú cho mỗi
+  thread (không spawn tesseract và nạp traineddata cho mỗi ảnh); nếu không
+  có thì gọi pytesseract như cũ. Ép dùng pytesseract bằng TESSERACT_BACKEND=cli.
+- numpy/PIL/pytesseract/EasyOCR chỉ được import khi thật sự OCR, nên import
+  module này (vd. process_pdf.py với PDF có text layer) gần như không tốn gì.
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import shlex
+import base64
+import socket
+import argparse
+import threading
+import queue
+import socketserver
+
+import metrics
+
+
+DEFAULT_EASYOCR_LANGS = ["vi", "en"]
+DEFAULT_TESSERACT_LANG = "vie+eng"
+DEFAULT_TESSERACT_CONFIG = "--oem 3 --psm 6"
+DEFAULT_ENGINES = ("easyocr", "tesseract")
+SUPPORTED_ENGINES = ("easyocr", "tesseract")
+TESSERACT_BACKEND = os.getenv("TESSERACT_BACKEND", "auto").lower()
+# Timeout (giây) kết nối / chờ trả lời của OCR server; quá hạn thì chuyển sang engine cục bộ
+OCR_SERVER_CONNECT_TIMEOUT = float(os.getenv("OCR_SERVER_CONNECT_TIMEOUT", "2"))
+OCR_SERVER_TIMEOUT = float(os.getenv("OCR_SERVER_TIMEOUT", "300"))
+
+# Cột của output TSV Tesseract, theo thứ tự (giống pytesseract.Output.DICT)
+TSV_COLUMNS = ("level", "page_num", "block_num", "par_num", "line_num", "word_num",
+               "left", "top", "width", "height", "conf", "text")
+
+
+# =========================
+# Setup Tesseract
+# =========================
+def setup_tesseract():
+    """Tìm tesseract: TESSERACT_CMD, TESSERACT_CMDS rồi các đường dẫn phổ biến trên Windows."""
+    candidates = []
+    manual_path = os.getenv("TESSERACT_CMD")
+    if manual_path:
+        candidates.append(manual_path)
+    candidates.extend(c for c in os.getenv("TESSERACT_CMDS", "").split(",") if c.strip())
+
+    if os.name == "nt":
+        username = os.getenv("USERNAME")
+        candidates.extend([
+            r"F:\Tesseract-OCR\tesseract.exe",
+            fr"C:\Users\{username}\AppData\Local\Tesseract-OCR\tesseract.exe",
+            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+        ])
+
+    for cmd in candidates:
+        cmd = cmd.strip()
+        if os.path.exists(cmd):
+            import pytesseract
+            pytesseract.pytesseract.tesseract_cmd = cmd
+            print(f"[DEBUG] Using Tesseract at: {cmd}", file=sys.stderr)
+            return True
+
+    if os.name == "nt":
+        print("[WARNING] Tesseract not found, OCR may not work properly", file=sys.stderr)
+        return False
+    # Linux/macOS: dùng tesseract có sẵn trong PATH
+    return True
+
+
+def _to_array(image):
+    import numpy as np
+    if isinstance(image, np.ndarray):
+        return image
+    if image.mode == "1":
+        image = image.convert("L")
+    return np.array(image)
+
+
+def _bbox_from_points(points) -> dict:
+    xs = [float(p[0]) for p in points]
+    ys = [float(p[1]) for p in points]
+    return {
+        "x": int(min(xs)),
+        "y": int(min(ys)),
+        "w": int(max(xs) - min(xs)),
+        "h": int(max(ys) - min(ys)),
+    }
+
+
+def text_from_tesseract_data(data: dict) -> str:
+    """Ghép lại văn bản theo dòng (block, par, line) từ output image_to_data."""
+    lines, current_key, current = [], None, []
+    for i, word in enumerate(data.get("text", [])):
+        word = (word or "").strip()
+        if not word:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key != current_key and current:
+            lines.append(" ".join(current))
+            current = []
+        current_key = key
+        current.append(word)
+    if current:
+        lines.append(" ".join(current))
+    return "\n".join(lines)
+
+
+def parse_tesseract_config(config: str):
+    """'--oem 1 --psm 6 -c k=v' -> (psm, oem, {k: v}) cho tesserocr."""
+    psm, oem, variables = None, None, {}
+    tokens = shlex.split(config or "")
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        value = tokens[i + 1] if i + 1 < len(tokens) else None
+        if token == "--psm" and value is not None:
+            psm, i = int(value), i + 2
+        elif token == "--oem" and value is not None:
+            oem, i = int(value), i + 2
+        elif token == "-c" and value is not None and "=" in value:
+            key, _, val = value.partition("=")
+            variables[key] = val
+            i += 2
+        else:
+            i += 1
+    return psm, oem, variables
+
+
+def tsv_to_dict(tsv: str) -> dict:
+    """Output GetTSVText của tesserocr -> dict cùng dạng pytesseract.Output.DICT."""
+    data = {column: [] for column in TSV_COLUMNS}
+    for row in tsv.splitlines():
+        values = row.split("\t")
+        if len(values) < len(TSV_COLUMNS) - 1:
+            continue
+        if len(values) < len(TSV_COLUMNS):
+            values.append("")
+        for column, value in zip(TSV_COLUMNS[:10], values):
+            data[column].append(int(value))
+        data["conf"].append(float(values[10]))
+        data["text"].append(values[11])
+    return data
+
+
+def _load_tesserocr():
+    if TESSERACT_BACKEND == "cli":
+        return None
+    try:
+        import tesserocr
+        return tesserocr
+    except ImportError:
+        if TESSERACT_BACKEND == "tesserocr":
+            raise
+        return None
+
+
+# =========================
+# OCR engine (trong process)
+# =========================
+class OcrEngine:
+    def __init__(self, easyocr_langs=None, tesseract_lang=DEFAULT_TESSERACT_LANG, gpu=False):
+        self.easyocr_langs = list(easyocr_langs or DEFAULT_EASYOCR_LANGS)
+        self.tesseract_lang = tesseract_lang
+        self.gpu = gpu
+        self.model_load_ms = None
+        self._easyocr_reader = None
+        self._lock = threading.Lock()
+        # PyTessBaseAPI không dùng chung được giữa các thread: mỗi thread một handle
+        self._tesserocr = _load_tesserocr()
+        self._tess_local = threading.local()
+        self.tesseract_backend = "tesserocr" if self._tesserocr else "cli"
+        setup_tesseract()
+
+    @property
+    def easyocr_reader(self):
+        # Nạp EasyOCR lần đầu cần dùng, sau đó giữ lại cho mọi job
+        if self._easyocr_reader is None:
+            with self._lock:
+                if self._easyocr_reader is None:
+                    import easyocr
+                    started = time.perf_counter()
+                    with metrics.span("ocr.easyocr_load"):
+                        self._easyocr_reader = easyocr.Reader(self.easyocr_langs, gpu=self.gpu)
+                    self.model_load_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self._easyocr_reader
+
+    def load(self):
+        """Nạp model ngay (dùng cho worker thường trú)."""
+        return self.easyocr_reader
+
+    def _run_easyocr(self, image) -> dict:
+        result = self.easyocr_reader.readtext(_to_array(image))
+        lines = [{
+            "text": text,
+            "confidence": round(float(conf), 4),
+            "bbox": _bbox_from_points(points),
+        } for points, text, conf in result]
+        return {"text": "\n".join(line["text"] for line in lines), "lines": lines}
+
+    def _tess_api(self, config):
+        """PyTessBaseAPI thường trú của thread hiện tại cho (lang, config)."""
+        apis = getattr(self._tess_local, "apis", None)
+        if apis is None:
+            apis = self._tess_local.apis = {}
+        key = (self.tesseract_lang, config)
+        api = apis.get(key)
+        if api is None:
+            psm, oem, variables = parse_tesseract_config(config)
+            kwargs = {"lang": self.tesseract_lang}
+            if psm is not None:
+                kwargs["psm"] = psm
+            if oem is not None:
+                kwargs["oem"] = oem
+            if os.getenv("TESSDATA_PREFIX"):
+                kwargs["path"] = os.getenv("TESSDATA_PREFIX")
+            api = self._tesserocr.PyTessBaseAPI(**kwargs)
+            for name, value in variables.items():
+                api.SetVariable(name, value)
+            apis[key] = api
+        return api
+
+    def _run_tesserocr(self, image, config, detail) -> dict:
+        from PIL import Image
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(_to_array(image))
+        api = self._tess_api(config)
+        api.SetImage(image)
+        try:
+            if detail:
+                data = tsv_to_dict(api.GetTSVText(0))
+                return {"text": text_from_tesseract_data(data), "data": data}
+            return {"text": api.GetUTF8Text()}
+        finally:
+            api.Clear()
+
+    def _run_tesseract(self, image, config, detail) -> dict:
+        if self._tesserocr is not None:
+            return self._run_tesserocr(image, config, detail)
+        import pytesseract
+        if detail:
+            data = pytesseract.image_to_data(
+                image,
+                lang=self.tesseract_lang,
+                config=config,
+                output_type=pytesseract.Output.DICT
+            )
+            return {"text": text_from_tesseract_data(data), "data": data}
+        text = pytesseract.image_to_string(image, lang=self.tesseract_lang, config=config)
+        return {"text": text}
+
+    def ocr_page(self, image, engines=DEFAULT_ENGINES, tesseract_config=DEFAULT_TESSERACT_CONFIG, detail=False) -> dict:
+        """
+        OCR một ảnh (PIL.Image hoặc numpy array) bằng các engine yêu cầu.
+        Trả về {engine: {"text", "ms", ["lines" | "data"], ["error"]}}; lỗi của
+        từng engine được ghi vào "error" thay vì raise.
+        """
+        results = {}
+        for name in engines:
+            if name not in SUPPORTED_ENGINES:
+                results[name] = {"text": "", "ms": 0.0, "error": f"Unsupported engine: {name}"}
+                continue
+            started = time.perf_counter()
+            try:
+                with metrics.span(f"ocr.{name}"):
+                    if name == "easyocr":
+                        out = self._run_easyocr(image)
+                    else:
+                        out = self._run_tesseract(image, tesseract_config, detail)
+            except Exception as e:
+                print(f"[{name}] Error: {e}", file=sys.stderr)
+                out = {"text": "", "error": str(e)}
+            out["ms"] = round((time.perf_counter() - started) * 1000, 1)
+            results[name] = out
+        return results
+
+
+# =========================
+# Giao thức NDJSON
+# =========================
+def encode_image(image) -> str:
+    import numpy as np
+    from PIL import Image
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def decode_image(payload: str):
+    from PIL import Image
+    image = Image.open(io.BytesIO(base64.b64decode(payload)))
+    return _to_array(image)
+
+
+def parse_address(address: str):
+    """'127.0.0.1:8765' -> TCP, còn lại coi là đường dẫn Unix socket."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and host:
+        return socket.AF_INET, (host, int(port))
+    return getattr(socket, "AF_UNIX", None), address
+
+
+class OcrServer:
+    """Worker thường trú: một EasyOCR reader, job được xử lý tuần tự qua hàng đợi."""
+
+    def __init__(self, engine: OcrEngine):
+        self.engine = engine
+        self.jobs = queue.Queue()
+        self.stats = {"jobs_served": 0, "jobs_failed": 0}
+        self.started = time.perf_counter()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def _work(self):
+        while True:
+            job, done = self.jobs.get()
+            try:
+                done["reply"] = self._run_ocr(job)
+            finally:
+                self.jobs.task_done()
+                done["event"].set()
+
+    def _run_ocr(self, job):
+        reply = {"id": job.get("id")}
+        try:
+            image = decode_image(job["image"])
+            reply["result"] = self.engine.ocr_page(
+                image,
+                engines=tuple(job.get("engines") or DEFAULT_ENGINES),
+                tesseract_config=job.get("tesseract_config") or DEFAULT_TESSERACT_CONFIG,
+                detail=bool(job.get("detail")),
+            )
+            reply["ok"] = True
+            self.stats["jobs_served"] += 1
+        except Exception as e:
+            reply["ok"] = False
+            reply["error"] = str(e)
+            self.stats["jobs_failed"] += 1
+        return reply
+
+    def health(self, job_id=None):
+        return {
+            "id": job_id,
+            "ok": True,
+            "queue_depth": self.jobs.qsize(),
+            "jobs_served": self.stats["jobs_served"],
+            "jobs_failed": self.stats["jobs_failed"],
+            "model_load_ms": self.engine.model_load_ms,
+            "tesseract_backend": self.engine.tesseract_backend,
+            "uptime_s": round(time.perf_counter() - self.started, 1),
+            "pid": os.getpid(),
+        }
+
+    def handle(self, line: str):
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            return {"id": None, "ok": False, "error": f"Invalid JSON: {e}"}
+
+        cmd = job.get("cmd", "ocr_page")
+        if cmd in ("health", "stats"):
+            return self.health(job.get("id"))
+        if cmd == "shutdown":
+            return {"id": job.get("id"), "ok": True, "event": "shutdown"}
+        if cmd != "ocr_page":
+            return {"id": job.get("id"), "ok": False, "error": f"Unsupported cmd: {cmd}"}
+
+        done = {"event": threading.Event(), "reply": None}
+        self.jobs.put((job, done))
+        done["event"].wait()
+        return done["reply"]
+
+
+def serve_stdio(server: OcrServer):
+    stdin = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        reply = server.handle(line)
+        stdout.write(json.dumps(reply, ensure_ascii=False) + "\n")
+        stdout.flush()
+        if reply.get("event") == "shutdown":
+            break
+
+
+def serve_socket(server: OcrServer, address: str):
+    family, addr = parse_address(address)
+    if family is None:
+        raise RuntimeError("Unix socket không được hỗ trợ trên hệ điều hành này, dùng host:port")
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw in self.rfile:
+                line = raw.decode("utf-8").strip()
+                if not line:
+                    continue
+                reply = server.handle(line)
+                self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+                self.wfile.flush()
+                if reply.get("event") == "shutdown":
+                    # shutdown() chờ serve_forever dừng nên không gọi được từ thread đang phục vụ request
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+
+    if family == socket.AF_INET:
+        base = socketserver.ThreadingTCPServer
+    else:
+        base = socketserver.ThreadingUnixStreamServer
+        if os.path.exists(addr):
+            os.unlink(addr)
+
+    class Server(base):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    with Server(addr, Handler) as srv:
+        print(f"[OCR] Serving on {address}", file=sys.stderr)
+        srv.serve_forever()
+    print("[OCR] Shutdown", file=sys.stderr)
+    if family != socket.AF_INET and os.path.exists(addr):
+        os.unlink(addr)
+
+
+# =========================
+# Client
+# =========================
+class OcrClient:
+    """
+    Gửi job tới worker thường trú, cùng interface ocr_page với OcrEngine.
+    Server không trả lời trong timeout hoặc mất kết nối: đóng kết nối và các
+    trang từ đó về sau OCR bằng OcrEngine cục bộ.
+    """
+
+    def __init__(self, address: str, timeout=None, connect_timeout=None):
+        family, addr = parse_address(address)
+        if family is None:
+            raise RuntimeError(f"Không hỗ trợ địa chỉ OCR server: {address}")
+        self.address = address
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(connect_timeout or OCR_SERVER_CONNECT_TIMEOUT)
+        self._sock.connect(addr)
+        self._sock.settimeout(timeout or OCR_SERVER_TIMEOUT)
+        self._file = self._sock.makefile("rwb")
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._broken = False
+        self._local = None
+
+    def _request(self, payload: dict) -> dict:
+        with self._lock:
+            if self._broken:
+                raise ConnectionError(f"OCR server {self.address} connection was closed")
+            self._next_id += 1
+            payload["id"] = self._next_id
+            try:
+                self._file.write((json.dumps(payload) + "\n").encode("utf-8"))
+                self._file.flush()
+                line = self._file.readline()
+            except OSError:
+                # Timeout giữa chừng: trả lời đến muộn sẽ lệch với request sau, bỏ kết nối
+                self._broken = True
+                self.close()
+                raise
+        if not line:
+            raise ConnectionError(f"OCR server {self.address} closed the connection")
+        reply = json.loads(line.decode("utf-8"))
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error") or "OCR server error")
+        return reply
+
+    def ocr_page(self, image, engines=DEFAULT_ENGINES, tesseract_config=DEFAULT_TESSERACT_CONFIG, detail=False) -> dict:
+        if not self._broken:
+            try:
+                # Thời gian từng engine nằm trong "ms" của kết quả; span gồm cả encode + round-trip
+                with metrics.span("ocr.remote", engines=",".join(engines)):
+                    reply = self._request({
+                        "cmd": "ocr_page",
+                        "image": encode_image(image),
+                        "engines": list(engines),
+                        "tesseract_config": tesseract_config,
+                        "detail": detail,
+                    })
+                return reply["result"]
+            except OSError as e:
+                print(f"[OCR] OCR server {self.address} failed: {e}, fallback to local engine", file=sys.stderr)
+        return self._local_engine().ocr_page(image, engines=engines, tesseract_config=tesseract_config, detail=detail)
+
+    def _local_engine(self):
+        with self._lock:
+            if self._local is None:
+                self._local = OcrEngine()
+            return self._local
+
+    @property
+    def tesseract_backend(self):
+        return self._local.tesseract_backend if self._local is not None else "server"
+
+    def health(self) -> dict:
+        return self._request({"cmd": "health"})
+
+    def close(self):
+        try:
+            self._file.close()
+        except OSError:
+            # Buffer ghi còn dữ liệu khi kết nối đã hỏng
+            pass
+        self._sock.close()
+
+
+_engine = None
+
+
+def get_ocr_engine():
+    """OcrClient nếu OCR_SERVER_ADDR trỏ tới worker đang chạy, ngược lại OcrEngine cục bộ."""
+    global _engine
+    if _engine is None:
+        address = os.getenv("OCR_SERVER_ADDR")
+        if address:
+            try:
+                _engine = OcrClient(address)
+                print(f"[OCR] Using OCR server at {address}", file=sys.stderr)
+            except Exception as e:
+                print(f"[OCR] Cannot reach OCR server {address}: {e}, fallback to local engine", file=sys.stderr)
+        if _engine is None:
+            _engine = OcrEngine()
+    return _engine
+
+
+def reset_ocr_engine():
+    """
+    Bỏ engine đã tạo mà không đóng nó. Process con fork gọi hàm này khi khởi
+    động: nó không được dùng chung socket của OcrClient (hay EasyOCR reader)
+    với process cha, get_ocr_engine() sau đó tạo engine riêng.
+    """
+    global _engine
+    _engine = None
+
+
+def current_ocr_engine():
+    """Engine get_ocr_engine() đã tạo, None nếu chưa (không kết nối/nạp gì)."""
+    return _engine
+
+
+# =========================
+# CLI
+# =========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared OCR worker (EasyOCR + Tesseract)")
+    parser.add_argument("--serve", action="store_true", help="Chạy worker thường trú")
+    parser.add_argument("--socket", help="Đường dẫn Unix socket")
+    parser.add_argument("--port", type=int, help="Lắng nghe TCP trên 127.0.0.1:<port>")
+    parser.add_argument("--stdio", action="store_true", help="Nhận job NDJSON qua stdin/stdout")
+    parser.add_argument("--health", metavar="ADDR", help="In health/stats của worker đang chạy")
+    args = parser.parse_args()
+
+    if args.health:
+        client = OcrClient(args.health)
+        print(json.dumps(client.health(), ensure_ascii=False, indent=2))
+        client.close()
+        sys.exit(0)
+
+    if not args.serve:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    ocr_engine = OcrEngine()
+    ocr_engine.load()
+    print(f"[OCR] EasyOCR loaded in {ocr_engine.model_load_ms} ms", file=sys.stderr)
+    ocr_server = OcrServer(ocr_engine)
+
+    if args.stdio:
+        serve_stdio(ocr_server)
+    else:
+        address = args.socket or (f"127.0.0.1:{args.port}" if args.port else os.getenv("OCR_SERVER_ADDR"))
+        if not address:
+            print("Cần --socket, --port hoặc OCR_SERVER_ADDR", file=sys.stderr)
+            sys.exit(1)
+        serve_socket(ocr_server, address)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache kết quả trích xuất trên đĩa, dùng chung cho process_pdf.py, process_docx.py,
+process_OCR.py và process_STT.py.
+
+- Key = sha256(nội dung file) + sha256(namespace + version/config của extractor),
+  nên đổi dpi OCR, engine hay model Whisper sẽ không dùng lại kết quả cũ.
+- Mỗi entry là một file JSON <root>/<namespace>/<key>.json; mtime được cập nhật
+  khi hit, vượt EXTRACTION_CACHE_MAX_MB thì xoá entry lâu không dùng nhất (LRU).
+- Tắt bằng EXTRACTION_CACHE=0.
+
+CLI:
+    python result_cache.py stats
+    python result_cache.py list [--namespace pdf]
+    python result_cache.py purge [--namespace pdf] [--older-than-days 30]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+
+import metrics
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, "..", "..", "..", "..", ".cache", "extraction")
+
+CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR") or DEFAULT_CACHE_DIR
+CACHE_MAX_MB = float(os.getenv("EXTRACTION_CACHE_MAX_MB", "512"))
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "1").lower() not in ("0", "false", "off", "no")
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(namespace: str, content_hash: str, config: dict) -> str:
+    config_json = json.dumps({"namespace": namespace, "config": config}, sort_keys=True, ensure_ascii=False)
+    config_hash = hashlib.sha256(config_json.encode("utf-8")).hexdigest()
+    return f"{content_hash[:40]}-{config_hash[:16]}"
+
+
+class ResultCache:
+    def __init__(self, root: str = None, max_mb: float = None, enabled: bool = None):
+        self.root = os.path.abspath(root or CACHE_DIR)
+        self.max_bytes = int((CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        self.enabled = CACHE_ENABLED if enabled is None else enabled
+
+    def _path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.root, namespace, key + ".json")
+
+    def get(self, namespace: str, key: str):
+        if not self.enabled:
+            return None
+        path = self._path(namespace, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path, None)  # đánh dấu vừa dùng (LRU)
+            return entry["result"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, namespace: str, key: str, result, config: dict = None, evict: bool = True):
+        """evict=False khi ghi nhiều entry liên tiếp (vd. từng trang): caller tự gọi evict() một lần."""
+        if not self.enabled:
+            return
+        directory = os.path.join(self.root, namespace)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({
+                    "key": key,
+                    "namespace": namespace,
+                    "created": time.time(),
+                    "config": config,
+                    "result": result,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(namespace, key))
+        except OSError as e:
+            print(f"[CACHE] Cannot write entry {key}: {e}", file=sys.stderr)
+            return
+        if evict:
+            self.evict()
+
+    def entries(self, namespace: str = None) -> list:
+        """[(path, namespace, size, mtime)] của các entry hiện có."""
+        if not os.path.isdir(self.root):
+            return []
+        namespaces = [namespace] if namespace else sorted(os.listdir(self.root))
+        found = []
+        for ns in namespaces:
+            directory = os.path.join(self.root, ns)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((path, ns, stat.st_size, stat.st_mtime))
+        return found
+
+    def evict(self):
+        """Xoá entry ít dùng gần đây nhất cho tới khi tổng dung lượng dưới giới hạn."""
+        entries = self.entries()
+        total = sum(size for _, _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for path, _, size, _ in sorted(entries, key=lambda e: e[3]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def purge(self, namespace: str = None, older_than_days: float = None) -> int:
+        cutoff = time.time() - older_than_days * 86400 if older_than_days is not None else None
+        removed = 0
+        for path, _, _, mtime in self.entries(namespace):
+            if cutoff is not None and mtime >= cutoff:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def stats(self) -> dict:
+        by_namespace = {}
+        for _, ns, size, _ in self.entries():
+            item = by_namespace.setdefault(ns, {"entries": 0, "bytes": 0})
+            item["entries"] += 1
+            item["bytes"] += size
+        return {
+            "root": self.root,
+            "enabled": self.enabled,
+            "max_bytes": self.max_bytes,
+            "entries": sum(v["entries"] for v in by_namespace.values()),
+            "bytes": sum(v["bytes"] for v in by_namespace.values()),
+            "namespaces": by_namespace,
+        }
+
+    def get_or_compute(self, namespace: str, path: str, config: dict, compute, is_cacheable=None,
+                       content_hash: str = None):
+        """
+        Trả về (result, hit). Khi miss thì gọi compute() và lưu lại nếu
+        is_cacheable(result) đúng (mặc định: mọi kết quả). content_hash dùng
+        cho input không nằm trên đĩa (vd. bytes_sha256 của stdin); khi đó path
+        chỉ dùng để log.
+        """
+        if not self.enabled:
+            return compute(), False
+        try:
+            with metrics.span("cache.hash"):
+                key = make_key(namespace, content_hash or file_sha256(path), config)
+        except OSError:
+            # File không đọc được: để extractor tự báo lỗi theo schema của nó
+            return compute(), False
+
+        cached = self.get(namespace, key)
+        if cached is not None:
+            print(f"[CACHE] hit {namespace} {os.path.basename(path)}", file=sys.stderr)
+            metrics.count("cache.hit")
+            return cached, True
+
+        metrics.count("cache.miss")
+        result = compute()
+        if is_cacheable is None or is_cacheable(result):
+            self.put(namespace, key, result, config)
+        return result, False
+
+
+_cache = None
+
+
+def get_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
+
+
+# =========================
+# CLI
+# =========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect / purge the extraction result cache")
+    parser.add_argument("--dir", default=None, help="Cache directory (default EXTRACTION_CACHE_DIR)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Số entry và dung lượng theo namespace")
+    list_parser = sub.add_parser("list", help="Liệt kê entry (mới dùng gần nhất trước)")
+    list_parser.add_argument("--namespace")
+    purge_parser = sub.add_parser("purge", help="Xoá entry")
+    purge_parser.add_argument("--namespace")
+    purge_parser.add_argument("--older-than-days", type=float, default=None)
+    args = parser.parse_args()
+
+    cache = ResultCache(root=args.dir, enabled=True)
+
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    elif args.command == "list":
+        rows = sorted(cache.entries(args.namespace), key=lambda e: e[3], reverse=True)
+        for path, ns, size, mtime in rows:
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
+            print(f"{ns}\t{os.path.basename(path)[:-5]}\t{size}\t{last_used}")
+    elif args.command == "purge":
+        removed = cache.purge(args.namespace, args.older_than_days)
+        print(f"Removed {removed} entries", file=sys.stderr)